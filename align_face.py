@@ -1,7 +1,7 @@
 import cv2
 import numpy as np
-from skimage import transform as trans
-import insightface
+
+from face_detector import OnnxFaceDetector
 
 
 def get_face_embedding_model():
@@ -11,6 +11,8 @@ def get_face_embedding_model():
     Returns:
         InsightFace face analysis model
     """
+    import insightface
+
     app = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
     app.prepare(ctx_id=0, det_size=(640, 640))
     return app
@@ -92,6 +94,96 @@ def face_to_embedding(aligned_face, model=None, use_original_detection=False):
             return face_to_embedding(aligned_face, model, use_original_detection=True)
 
 
+# Standard face template (5 keypoints: left_eye, right_eye, nose, left_mouth, right_mouth)
+# Tọa độ chuẩn cho face template 112x112
+FACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],  # left eye
+    [73.5318, 51.5014],  # right eye
+    [56.0252, 71.7366],  # nose tip
+    [41.5493, 92.3655],  # left mouth corner
+    [70.7299, 92.2041]  # right mouth corner
+], dtype=np.float32)
+
+
+def _face_template(target_size=(112, 112)):
+    src = FACE_TEMPLATE.copy()
+    # Scale src points theo target_size
+    if target_size != (112, 112):
+        src[:, 0] *= target_size[0] / 112.0
+        src[:, 1] *= target_size[1] / 112.0
+    return src
+
+
+def estimate_similarity_transforms(points, template):
+    """
+    Closed-form batched Umeyama estimate of similarity transforms
+
+    Args:
+        points: Detected keypoints (N,P,2)
+        template: Target keypoints (P,2)
+
+    Returns:
+        (transforms, valid): affine matrices (N,2,3) mapping points onto the
+        template and a boolean mask of non-degenerate estimates
+    """
+    src = np.asarray(points, dtype=np.float64)
+    dst = np.asarray(template, dtype=np.float64)
+    n, num = src.shape[:2]
+
+    src_mean = src.mean(axis=1)
+    dst_mean = dst.mean(axis=0)
+    src_demean = src - src_mean[:, None, :]
+    dst_demean = dst - dst_mean
+
+    # Ma trận hiệp phương sai (N,2,2) cho từng khuôn mặt
+    cov = np.einsum('pi,npj->nij', dst_demean, src_demean) / num
+    d = np.ones((n, 2))
+    d[np.linalg.det(cov) < 0, 1] = -1
+
+    u, s, vt = np.linalg.svd(cov)
+    rotation = u @ (d[:, :, None] * vt)
+
+    src_var = (src_demean ** 2).sum(axis=(1, 2)) / num
+    valid = src_var > 1e-6
+    scale = (s * d).sum(axis=1) / np.where(valid, src_var, 1.0)
+
+    transforms = np.empty((n, 2, 3), dtype=np.float64)
+    transforms[:, :, :2] = scale[:, None, None] * rotation
+    transforms[:, :, 2] = dst_mean - scale[:, None] * np.einsum('nij,nj->ni', rotation, src_mean)
+    return transforms, valid
+
+
+def align_faces_batch(image, keypoints, target_size=(112, 112)):
+    """
+    Align many faces of one image into a preallocated buffer
+
+    Args:
+        image: Input image
+        keypoints: Keypoints (N,>=5,2), only the first 5 are used
+        target_size: Output face size (width, height)
+
+    Returns:
+        (aligned_faces, indices): aligned faces (M,height,width,3) and the
+        indices of their rows in keypoints; rows with degenerate keypoints
+        are dropped instead of returned as blank crops
+    """
+    empty = np.zeros((0, target_size[1], target_size[0], 3), dtype=np.uint8), np.zeros((0,), dtype=np.intp)
+    # Không có khuôn mặt: reshape(0, -1, 2) không xác định được chiều -1
+    if len(keypoints) == 0:
+        return empty
+    keypoints = np.asarray(keypoints, dtype=np.float32).reshape(len(keypoints), -1, 2)
+    if keypoints.shape[1] < 5:
+        return empty
+
+    transforms, valid = estimate_similarity_transforms(keypoints[:, :5], _face_template(target_size))
+    indices = np.flatnonzero(valid)
+    aligned_faces = np.zeros((len(indices), target_size[1], target_size[0], 3), dtype=np.uint8)
+    for row, i in enumerate(indices):
+        cv2.warpAffine(image, transforms[i], target_size, dst=aligned_faces[row], borderValue=0.0)
+
+    return aligned_faces, indices
+
+
 def align_face(image, keypoints, target_size=(112, 112)):
     """
     Align face using facial keypoints
@@ -102,25 +194,8 @@ def align_face(image, keypoints, target_size=(112, 112)):
         target_size: Output face size (width, height)
 
     Returns:
-        Aligned face image
+        Aligned face image, or None when the keypoints are degenerate
     """
-    # Standard face template (5 keypoints: left_eye, right_eye, nose, left_mouth, right_mouth)
-    # Tọa độ chuẩn cho face template 112x112
-    src = np.array([
-        [38.2946, 51.6963],  # left eye
-        [73.5318, 51.5014],  # right eye
-        [56.0252, 71.7366],  # nose tip
-        [41.5493, 92.3655],  # left mouth corner
-        [70.7299, 92.2041]  # right mouth corner
-    ], dtype=np.float32)
-
-    # Scale src points theo target_size
-    if target_size != (112, 112):
-        scale_x = target_size[0] / 112.0
-        scale_y = target_size[1] / 112.0
-        src[:, 0] *= scale_x
-        src[:, 1] *= scale_y
-
     # Extract keypoints từ YOLO model (giả sử có ít nhất 5 keypoints)
     # YOLO face model thường có các keypoints: left_eye, right_eye, nose, left_mouth, right_mouth
     if len(keypoints) < 5:
@@ -128,52 +203,118 @@ def align_face(image, keypoints, target_size=(112, 112)):
         return None
 
     # Lấy 5 keypoints đầu tiên
-    dst = keypoints[:5, :2].astype(np.float32)
+    dst = np.asarray(keypoints)[:5, :2].astype(np.float32)
+    aligned_faces, _ = align_faces_batch(image, dst[None], target_size)
+    return aligned_faces[0] if len(aligned_faces) else None
 
-    # Tính transformation matrix
-    tform = trans.SimilarityTransform()
-    tform.estimate(dst, src)
-    M = tform.params[0:2, :]
 
-    # Apply transformation
-    aligned_face = cv2.warpAffine(image, M, target_size, borderValue=0.0)
+def select_keypoints(keypoints_data, conf_threshold=0.5):
+    """
+    Keep the first 5 keypoints with confidence > conf_threshold per detection
 
-    return aligned_face
+    Args:
+        keypoints_data: Keypoints (N,K,3) as [x, y, confidence]
 
+    Returns:
+        (keypoints, indices): keypoints (M,5,2) of detections that have at
+        least 5 confident keypoints and their indices in keypoints_data
+    """
+    keypoints_data = np.asarray(keypoints_data, dtype=np.float32)
+    mask = keypoints_data[..., 2] > conf_threshold
+    valid = mask.sum(axis=1) >= 5
 
-def extract_faces_with_alignment(image, yolo_model, conf_threshold=0.25):
+    # Sắp xếp ổn định để các keypoint hợp lệ lên đầu, giữ nguyên thứ tự ban đầu
+    order = np.argsort(~mask, axis=1, kind='stable')[:, :5]
+    keypoints = np.take_along_axis(keypoints_data[..., :2], order[..., None], axis=1)
+    return keypoints[valid], np.flatnonzero(valid)
+
+
+def detect_faces(image, yolo_model, conf_threshold=0.25, imgsz=None):
     """
-    Extract và align tất cả faces trong image
+    Run the YOLO face detector and keep detections usable for alignment
 
     Args:
         image: Input image
         yolo_model: YOLO model
         conf_threshold: Confidence threshold
+        imgsz: Letterbox size for models with a dynamic input (None = model default)
 
     Returns:
-        List of aligned faces
+        (boxes, scores, keypoints, results): boxes (N,4) xyxy, scores (N,),
+        keypoints (N,5,2) and the raw YOLO results
     """
-    results = yolo_model.predict(image, conf=conf_threshold, verbose=False)
-    aligned_faces = []
+    if isinstance(yolo_model, OnnxFaceDetector):
+        # Detector ONNX trực tiếp: không có kết quả thô của ultralytics
+        return (*_select_detections(*yolo_model.detect(image, conf_threshold, imgsz)), None)
+
+    options = {} if imgsz is None else {"imgsz": imgsz}
+    results = yolo_model.predict(image, conf=conf_threshold, verbose=False, **options)
+    boxes, scores, keypoints = _parse_results(results)
+    return boxes, scores, keypoints, results
+
+
+def _select_detections(boxes, scores, keypoints_data):
+    """Keep detections with 5 confident keypoints, as _parse_results does for YOLO results"""
+    selected, indices = select_keypoints(keypoints_data)
+    return boxes[indices], scores[indices], selected
+
+
+def _parse_results(results):
+    """Convert YOLO pose results of one image into (boxes, scores, keypoints) arrays"""
+    boxes, scores, keypoints = [], [], []
 
     for result in results:
-        if result.keypoints is not None:
-            for keypoints_per_detection in result.keypoints.data:
-                keypoints_array = keypoints_per_detection.cpu().numpy()
-
-                # Chỉ lấy keypoints có confidence > 0.5
-                valid_keypoints = []
-                for keypoint in keypoints_array:
-                    x, y, conf = keypoint
-                    if conf > 0.5:
-                        valid_keypoints.append([x, y])
-
-                if len(valid_keypoints) >= 5:
-                    valid_keypoints = np.array(valid_keypoints)
-                    aligned_face = align_face(image, valid_keypoints)
-                    if aligned_face is not None:
-                        aligned_faces.append(aligned_face)
+        if result.keypoints is None or len(result.keypoints.data) == 0:
+            continue
+        # Một lần copy device -> host cho tất cả detection
+        keypoints_data = result.keypoints.data.cpu().numpy()
+        selected, indices = select_keypoints(keypoints_data)
+        keypoints.append(selected)
+        boxes.append(result.boxes.xyxy.cpu().numpy()[indices])
+        scores.append(result.boxes.conf.cpu().numpy()[indices])
+
+    if not keypoints:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+
+    return np.concatenate(boxes), np.concatenate(scores), np.concatenate(keypoints)
+
+
+def detect_faces_batch(images, yolo_model, conf_threshold=0.25, batch_size=16, imgsz=None):
+    """
+    Run the YOLO face detector on many images, batch_size images per predict call
+
+    Args:
+        imgsz: Letterbox size for models with a dynamic input (None = model default)
+
+    Returns:
+        List of (boxes, scores, keypoints), one per image
+    """
+    if isinstance(yolo_model, OnnxFaceDetector):
+        return [_select_detections(*yolo_model.detect(image, conf_threshold, imgsz)) for image in images]
+
+    options = {} if imgsz is None else {"imgsz": imgsz}
+    detections = []
+    for start in range(0, len(images), batch_size):
+        results = yolo_model.predict(images[start:start + batch_size], conf=conf_threshold, verbose=False,
+                                     **options)
+        detections.extend(_parse_results([result]) for result in results)
+    return detections
 
+
+def extract_faces_with_alignment(image, yolo_model, conf_threshold=0.25):
+    """
+    Extract và align tất cả faces trong image
+
+    Args:
+        image: Input image
+        yolo_model: YOLO model
+        conf_threshold: Confidence threshold
+
+    Returns:
+        Aligned faces (N,112,112,3) of the non-degenerate detections and the raw YOLO results
+    """
+    _, _, keypoints, results = detect_faces(image, yolo_model, conf_threshold)
+    aligned_faces, _ = align_faces_batch(image, keypoints)
     return aligned_faces, results
 
 
@@ -200,36 +341,24 @@ def extract_faces_with_embeddings(image, yolo_model, conf_threshold=0.25, embedd
         boxes = result.boxes
         keypoints = result.keypoints
 
-        if keypoints is not None and boxes is not None:
-            for i, keypoints_per_detection in enumerate(keypoints.data):
-                keypoints_array = keypoints_per_detection.cpu().numpy()
-
-                # Chỉ lấy keypoints có confidence > 0.5
-                valid_keypoints = []
-                for keypoint in keypoints_array:
-                    x, y, conf = keypoint
-                    if conf > 0.5:
-                        valid_keypoints.append([x, y])
-
-                if len(valid_keypoints) >= 5:
-                    valid_keypoints = np.array(valid_keypoints)
-                    aligned_face = align_face(image, valid_keypoints)
-
-                    if aligned_face is not None:
-                        # Convert aligned face to embedding
-                        embedding = face_to_embedding(aligned_face, embedding_model)
-
-                        if embedding is not None:
-                            box = boxes.xyxy[i].cpu().numpy()
-                            confidence = boxes.conf[i].cpu().numpy()
-
-                            face_data.append({
-                                'aligned_face': aligned_face,
-                                'embedding': embedding,
-                                'keypoints': valid_keypoints,
-                                'box': box,
-                                'confidence': confidence
-                            })
+        if keypoints is not None and boxes is not None and len(keypoints.data) > 0:
+            valid_keypoints, indices = select_keypoints(keypoints.data.cpu().numpy())
+            aligned_faces, kept = align_faces_batch(image, valid_keypoints)
+            boxes_xyxy = boxes.xyxy.cpu().numpy()
+            confidences = boxes.conf.cpu().numpy()
+
+            for aligned_face, face_keypoints, i in zip(aligned_faces, valid_keypoints[kept], indices[kept]):
+                # Convert aligned face to embedding
+                embedding = face_to_embedding(aligned_face, embedding_model)
+
+                if embedding is not None:
+                    face_data.append({
+                        'aligned_face': aligned_face,
+                        'embedding': embedding,
+                        'keypoints': face_keypoints,
+                        'box': boxes_xyxy[i],
+                        'confidence': confidences[i]
+                    })
 
     return face_data, results
 
@@ -241,18 +370,33 @@ def draw_keypoints_and_boxes(image, results):
         # print(f"Keypoints: {result.keypoints}")  # If keypoints are detected
 
         # draw keypoints
-        if result.keypoints is not None:
-            for keypoints_per_detection in result.keypoints.data:
-                keypoints_array = keypoints_per_detection.cpu().numpy()
-                # keypoints_array shape is typically (num_keypoints, 3) where 3 = [x, y, confidence]
-                for keypoint in keypoints_array:
-                    x, y, conf = keypoint
-                    # Only draw keypoint if confidence is high enough
-                    if conf > 0.5:  # confidence threshold
-                        cv2.circle(image, (int(x), int(y)), 3, (0, 0, 255), -1)
+        if result.keypoints is not None and len(result.keypoints.data) > 0:
+            # keypoints shape is (num_detections, num_keypoints, 3) where 3 = [x, y, confidence]
+            keypoints_array = result.keypoints.data.cpu().numpy().reshape(-1, 3)
+            # Only draw keypoint if confidence is high enough
+            for x, y in keypoints_array[keypoints_array[:, 2] > 0.5, :2].astype(int):
+                cv2.circle(image, (int(x), int(y)), 3, (0, 0, 255), -1)
 
         # draw boxes
         for box in boxes.xyxy.cpu().numpy():
             x1, y1, x2, y2 = map(int, box[:4])
             cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
     return image
+
+
+def draw_detections(image, boxes, keypoints):
+    """
+    Draw face boxes and keypoints given as arrays (see detect_faces)
+
+    Args:
+        image: Image to draw on
+        boxes: Boxes (N,4) xyxy
+        keypoints: Keypoints (N,K,2)
+    """
+    for x, y in np.asarray(keypoints).reshape(-1, 2).astype(int):
+        cv2.circle(image, (int(x), int(y)), 3, (0, 0, 255), -1)
+
+    for box in np.asarray(boxes).reshape(-1, 4).astype(int):
+        x1, y1, x2, y2 = map(int, box[:4])
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    return image
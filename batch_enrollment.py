@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MANIFEST_NAMES = ("manifest.csv", "manifest.json")
+
+
+def parse_manifest(data: bytes, filename: str) -> Dict[str, dict]:
+    """
+    Parse a CSV or JSON manifest mapping image files to person_name / code_card
+
+    CSV needs the header ``filename,person_name,code_card``. JSON may be a
+    list of objects with the same keys or an object keyed by filename.
+
+    Returns:
+        Dict basename -> {"person_name", "code_card"}
+    """
+    text = data.decode("utf-8-sig")
+    try:
+        if filename.lower().endswith(".json"):
+            rows = json.loads(text)
+            if isinstance(rows, dict):
+                rows = [dict(value, filename=key) for key, value in rows.items()]
+        else:
+            rows = list(csv.DictReader(io.StringIO(text)))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid manifest: {e}")
+
+    manifest = {}
+    for row in rows:
+        if not row.get("filename"):
+            raise HTTPException(status_code=400, detail="Every manifest row needs a filename")
+        manifest[os.path.basename(row["filename"].strip())] = {
+            "person_name": (row.get("person_name") or "").strip(),
+            "code_card": str(row.get("code_card") or "").strip(),
+        }
+    return manifest
+
+
+def read_zip_archive(archive_bytes: bytes):
+    """
+    Read images (and an optional manifest.csv / manifest.json) from a zip archive
+
+    Returns:
+        (files, manifest): dict basename -> bytes, manifest dict or None
+    """
+    files = {}
+    manifest = None
+    try:
+        with zipfile.ZipFile(io.BytesIO(archive_bytes)) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                name = os.path.basename(info.filename)
+                if name.lower() in MANIFEST_NAMES:
+                    manifest = parse_manifest(archive.read(info), name)
+                elif name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith("."):
+                    files[name] = archive.read(info)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Archive must be a zip file")
+    return files, manifest
+
+
+def build_items(files: Dict[str, bytes], manifest: Optional[Dict[str, dict]]) -> List[dict]:
+    """Join uploaded images with their manifest rows"""
+    if not manifest:
+        raise HTTPException(status_code=400, detail="A manifest (CSV or JSON) is required")
+
+    items = []
+    for filename, image_bytes in files.items():
+        row = manifest.get(filename, {})
+        items.append({
+            "filename": filename,
+            "image_bytes": image_bytes,
+            "person_name": row.get("person_name"),
+            "code_card": row.get("code_card"),
+        })
+    return items
@@ -0,0 +1,49 @@
+"""
+Compare two benchmark reports written by run_pipeline:
+
+    python -m benchmarks.compare baseline.json candidate.json
+"""
+import argparse
+import json
+
+
+def compare(baseline, candidate, metric="p50_ms"):
+    """Rows (stage, baseline, candidate, change %) for stages present in both reports"""
+    rows = []
+    for stage, stats in candidate["stages"].items():
+        before = baseline["stages"].get(stage, {}).get(metric)
+        after = stats.get(metric)
+        change = (after - before) / before * 100 if before and after is not None else None
+        rows.append((stage, before, after, change))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="p50_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    for name, report in (("baseline", baseline), ("candidate", candidate)):
+        revision = report.get("revision", {})
+        print(f"{name}: {revision.get('commit')}{' (dirty)' if revision.get('dirty') else ''} "
+              f"detector={report['config']['detector']} embedding={report['config']['embedding_model']}")
+    if baseline.get("config") != candidate.get("config"):
+        print("warning: reports were produced with different settings or models")
+
+    print(f"\n{'stage':<32}{'baseline':>12}{'candidate':>12}{'change':>10}   ({args.metric})")
+    for stage, before, after, change in compare(baseline, candidate, args.metric):
+        before_text = f"{before:.3f}" if before is not None else "-"
+        after_text = f"{after:.3f}" if after is not None else "-"
+        change_text = f"{change:+.1f}%" if change is not None else "-"
+        print(f"{stage:<32}{before_text:>12}{after_text:>12}{change_text:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Camera-free inputs for the benchmarks: synthetic frames with a known face
+layout, a stand-in for the YOLO face detector and a stand-in ArcFace ONNX
+model with the real input/output shapes.
+"""
+import glob
+import math
+import os
+
+import cv2
+import numpy as np
+
+from align_face import FACE_TEMPLATE
+
+
+def face_layout(width, height, num_faces, fill=0.6):
+    """
+    Deterministic grid of faces for a frame size
+
+    Returns:
+        (boxes, keypoints): boxes (N,4) xyxy, keypoints (N,5,2)
+    """
+    if num_faces == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+
+    cols = math.ceil(math.sqrt(num_faces * width / height))
+    rows = math.ceil(num_faces / cols)
+    cell_w, cell_h = width / cols, height / rows
+    side = min(cell_w, cell_h) * fill
+
+    boxes, keypoints = [], []
+    for i in range(num_faces):
+        x0 = (i % cols) * cell_w + (cell_w - side) / 2
+        y0 = (i // cols) * cell_h + (cell_h - side) / 2
+        boxes.append([x0, y0, x0 + side, y0 + side])
+        keypoints.append(FACE_TEMPLATE / 112.0 * side + [x0, y0])
+    return np.array(boxes, dtype=np.float32), np.array(keypoints, dtype=np.float32)
+
+
+def synthetic_frame(width, height, num_faces, seed=0):
+    """BGR frame with a noisy background and num_faces drawn face-like blobs"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (0, 0), 3)
+
+    boxes, keypoints = face_layout(width, height, num_faces)
+    for (x1, y1, x2, y2), points in zip(boxes, keypoints):
+        center = (int((x1 + x2) / 2), int((y1 + y2) / 2))
+        axes = (int((x2 - x1) / 2), int((y2 - y1) / 2))
+        cv2.ellipse(frame, center, axes, 0, 0, 360, (150, 180, 220), -1)
+        for x, y in points:
+            cv2.circle(frame, (int(x), int(y)), max(2, axes[0] // 12), (40, 40, 40), -1)
+    return frame
+
+
+def load_frames(frames_dir=None, count=8, width=1280, height=720, num_faces=4, seed=0):
+    """Recorded frames from frames_dir (sorted, first ``count``) or synthetic frames"""
+    if frames_dir:
+        paths = sorted(p for p in glob.glob(os.path.join(frames_dir, "*"))
+                       if p.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".webp")))[:count]
+        frames = [frame for frame in (cv2.imread(p) for p in paths) if frame is not None]
+        if not frames:
+            raise SystemExit(f"No readable images in {frames_dir}")
+        return frames
+    return [synthetic_frame(width, height, num_faces, seed=seed + i) for i in range(count)]
+
+
+class _Tensor:
+    """Minimal stand-in for a torch tensor: .cpu().numpy()"""
+
+    def __init__(self, array):
+        self.data = self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def __len__(self):
+        return len(self.array)
+
+
+class _Keypoints:
+    def __init__(self, data):
+        self.data = _Tensor(data)
+
+
+class _Boxes:
+    def __init__(self, xyxy, conf):
+        self.xyxy = _Tensor(xyxy)
+        self.conf = _Tensor(conf)
+
+
+class _Result:
+    def __init__(self, boxes, keypoints):
+        scores = np.linspace(0.95, 0.6, len(boxes), dtype=np.float32)
+        data = np.concatenate([keypoints, np.full(keypoints.shape[:2] + (1,), 0.9, dtype=np.float32)], axis=2)
+        self.boxes = _Boxes(boxes, scores)
+        self.keypoints = _Keypoints(data)
+
+
+class StandInFaceDetector:
+    """
+    Replaces the ultralytics YOLO pose model when weights or ultralytics are missing.
+
+    ``predict`` returns result objects shaped like ultralytics results, with
+    the faces of :func:`face_layout` for the frame size, so the parsing,
+    keypoint selection and alignment code runs unchanged; only the network
+    forward pass is skipped.
+    """
+
+    def __init__(self, num_faces):
+        self.num_faces = num_faces
+
+    def predict(self, source, conf=0.25, verbose=False):
+        images = source if isinstance(source, list) else [source]
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            results.append(_Result(*face_layout(width, height, self.num_faces)))
+        return results
+
+
+def build_stand_in_embedding_model(path, seed=0):
+    """
+    Write a small ONNX model with ArcFace's interface: (batch,3,112,112) float32 -> (batch,512)
+
+    Two strided convolutions, global pooling and a projection. Weights are
+    random (fixed seed) so embeddings are meaningless but the runtime path
+    (session, dynamic batch, pre/post-processing) is the real one.
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(seed)
+
+    def weight(name, *shape):
+        return numpy_helper.from_array((rng.standard_normal(shape) * 0.05).astype(np.float32), name)
+
+    nodes = [
+        helper.make_node("Conv", ["input.1", "w1", "b1"], ["c1"], strides=[2, 2], pads=[1, 1, 1, 1]),
+        helper.make_node("Relu", ["c1"], ["r1"]),
+        helper.make_node("Conv", ["r1", "w2", "b2"], ["c2"], strides=[2, 2], pads=[1, 1, 1, 1]),
+        helper.make_node("Relu", ["c2"], ["r2"]),
+        helper.make_node("GlobalAveragePool", ["r2"], ["pool"]),
+        helper.make_node("Flatten", ["pool"], ["flat"]),
+        helper.make_node("Gemm", ["flat", "w3", "b3"], ["embedding"], transB=1),
+    ]
+    initializers = [
+        weight("w1", 64, 3, 3, 3), weight("b1", 64),
+        weight("w2", 128, 64, 3, 3), weight("b2", 128),
+        weight("w3", 512, 128), weight("b3", 512),
+    ]
+    graph = helper.make_graph(
+        nodes, "stand_in_arcface",
+        [helper.make_tensor_value_info("input.1", TensorProto.FLOAT, ["batch", 3, 112, 112])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, ["batch", 512])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    onnx.checker.check_model(model)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    onnx.save(model, path)
+    return path
+
+
+def random_gallery(size, dim=512, seed=0, chunk=100_000):
+    """L2-normalized random embeddings (size,dim), generated in chunks to bound temporary memory"""
+    rng = np.random.default_rng(seed)
+    gallery = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, chunk):
+        block = rng.standard_normal((min(chunk, size - start), dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        gallery[start:start + len(block)] = block
+    return gallery
@@ -0,0 +1,229 @@
+"""
+Offline per-stage benchmark of the face pipeline.
+
+Runs without cameras, GPU or network and prints (or writes) a JSON report
+with p50/p95/p99 latency and throughput per stage:
+
+    python -m benchmarks.run_pipeline --faces 4 --output bench.json
+    python -m benchmarks.run_pipeline --frames-dir recorded/ --gallery-sizes 1000,100000
+    python -m benchmarks.compare old.json new.json
+
+Real weights under weight/ are used when present (and ultralytics is
+installed); otherwise a stand-in detector and a stand-in ArcFace ONNX model
+are used and the report says so. Inputs are seeded, so two runs with the
+same arguments on the same machine are comparable across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from align_face import align_face, align_faces_batch, detect_faces, extract_faces_with_alignment  # noqa: E402
+from benchmarks.fixtures import (StandInFaceDetector, build_stand_in_embedding_model, load_frames,  # noqa: E402
+                                 random_gallery)
+from check_platform import PlatformEnum  # noqa: E402
+from face_detector import OnnxFaceDetector  # noqa: E402
+from face_embedding import SimpleEmbeddingExtractor  # noqa: E402
+from gallery_index import GalleryIndex  # noqa: E402
+from image_ingest import decode_upload  # noqa: E402
+import onnx_session  # noqa: E402
+from shared_frame import SharedFrameWriter  # noqa: E402
+
+DEFAULT_GALLERY_SIZES = "1000,10000,100000"
+STAND_IN_MODEL = os.path.join(tempfile.gettempdir(), "face_bench", "stand_in_arcface.onnx")
+
+
+def summarize(samples_ns, items_per_call=1):
+    """Latency percentiles (ms) and throughput (items/s) of a list of durations in ns"""
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    total_s = samples.sum() / 1e3
+    return {
+        "calls": len(samples),
+        "items_per_call": items_per_call,
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "mean_ms": round(float(samples.mean()), 4),
+        "throughput_per_s": round(len(samples) * items_per_call / total_s, 2) if total_s > 0 else None,
+    }
+
+
+def measure(func, inputs, iterations, warmup, items_per_call=1):
+    """Call func on inputs round-robin; warmup calls are not recorded"""
+    for i in range(warmup):
+        func(inputs[i % len(inputs)])
+    samples = []
+    for i in range(iterations):
+        value = inputs[i % len(inputs)]
+        started = time.perf_counter_ns()
+        func(value)
+        samples.append(time.perf_counter_ns() - started)
+    return summarize(samples, items_per_call)
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def environment():
+    info = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cv2_threads": cv2.getNumThreads(),
+    }
+    try:
+        import onnxruntime
+        info["onnxruntime"] = onnxruntime.__version__
+        info["ort_session"] = {
+            "optimization": onnx_session.ORT_OPTIMIZATION,
+            "intra_op_threads": onnx_session.ORT_INTRA_THREADS,
+            "inter_op_threads": onnx_session.ORT_INTER_THREADS,
+            "execution_mode": onnx_session.ORT_EXECUTION_MODE,
+            "cache_optimized": onnx_session.ORT_CACHE_OPTIMIZED,
+        }
+    except ImportError:
+        pass
+    return info
+
+
+def load_detector(args):
+    path = os.path.join(ROOT, "weight", "yolov8n-face.onnx")
+    if not args.stand_in and os.path.exists(path) and args.detector == "onnx":
+        return OnnxFaceDetector(path), f"{path} (onnxruntime)"
+    if not args.stand_in and os.path.exists(path):
+        try:
+            from ultralytics import YOLO
+            return YOLO(path, task='pose'), path
+        except ImportError:
+            pass
+    return StandInFaceDetector(args.faces), "stand-in"
+
+
+def load_extractor(args):
+    path = os.path.join(ROOT, "weight", "w600k_r50.onnx")
+    if args.stand_in or not os.path.exists(path):
+        path = STAND_IN_MODEL
+        if not os.path.exists(path):
+            build_stand_in_embedding_model(path, seed=args.seed)
+    return SimpleEmbeddingExtractor(PlatformEnum.UBUNTU, path), path
+
+
+def run(args):
+    frames = load_frames(args.frames_dir, count=args.num_frames, width=args.width, height=args.height,
+                         num_faces=args.faces, seed=args.seed)
+    encoded = [cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes() for frame in frames]
+    detector, detector_model = load_detector(args)
+    extractor, embedding_model = load_extractor(args)
+
+    # Khuôn mặt của từng frame (dùng chung cho các stage sau detect)
+    detections = [detect_faces(frame, detector)[2] for frame in frames]
+    faces_per_frame = max(1, int(np.mean([len(k) for k in detections])))
+    aligned = [align_faces_batch(frame, keypoints)[0] for frame, keypoints in zip(frames, detections)]
+    aligned = [faces for faces in aligned if len(faces)] or [np.zeros((1, 112, 112, 3), dtype=np.uint8)]
+    single = [(frame, keypoints[0]) for frame, keypoints in zip(frames, detections) if len(keypoints)]
+
+    it, warm = args.iterations, args.warmup
+    stages = {
+        "decode_jpeg": measure(lambda data: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR),
+                               encoded, it, warm),
+        "decode_upload_reduced": measure(decode_upload, encoded, it, warm),
+        "extract_faces_with_alignment": measure(lambda frame: extract_faces_with_alignment(frame, detector),
+                                                frames, it, warm, faces_per_frame),
+        "align_faces_batch": measure(lambda pair: align_faces_batch(*pair), list(zip(frames, detections)),
+                                     it, warm, faces_per_frame),
+        "embed_preprocess": measure(extractor.preprocess_faces, aligned, it, warm, faces_per_frame),
+        "embed_inference": measure(extractor.extract_embeddings_batch, aligned, it, warm, faces_per_frame),
+    }
+    if single:
+        stages["align_face"] = measure(lambda pair: align_face(*pair), single, it, warm)
+
+    queries = extractor.extract_embeddings_batch(np.concatenate(aligned))
+    for size in [int(s) for s in args.gallery_sizes.split(",") if s]:
+        index = GalleryIndex(None, "benchmark", quantization=args.quantization, rescore=args.rescore)
+        index.load([str(i) for i in range(size)], random_gallery(size, seed=args.seed))
+        stages[f"gallery_search_{size}"] = measure(lambda q: index.search(q, limit=1), list(queries), it, warm)
+        stages[f"gallery_search_{size}"]["store"] = index.stats
+        del index
+
+    writer = SharedFrameWriter(f"bench_frame_{os.getpid()}", args.width, args.height)
+    try:
+        stages["shared_memory_write"] = measure(lambda frame: writer.write(frame, fps=0.0), frames, it, warm)
+    finally:
+        writer.close()
+
+    return {
+        "revision": git_revision(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "config": {
+            "faces": args.faces,
+            "frames": len(frames),
+            "frame_size": list(frames[0].shape[1::-1]),
+            "frames_dir": args.frames_dir,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "quantization": args.quantization,
+            "rescore": args.rescore,
+            "detector": detector_model,
+            "detector_warmup_ms": getattr(detector, "warmup_ms", None),
+            "embedding_warmup_ms": extractor.warmup_ms,
+            "embedding_model": embedding_model,
+        },
+        "stages": stages,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--faces", type=int, default=4, help="Faces per synthetic frame")
+    parser.add_argument("--frames-dir", help="Use recorded frames from this directory instead of synthetic ones")
+    parser.add_argument("--num-frames", type=int, default=8)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--gallery-sizes", default=DEFAULT_GALLERY_SIZES,
+                        help="Comma-separated gallery sizes (add 1000000 explicitly, 1M needs ~4 GB RAM)")
+    parser.add_argument("--quantization", default="float32", choices=["float32", "float16", "int8"],
+                        help="Gallery store precision")
+    parser.add_argument("--rescore", action="store_true", help="Re-score top candidates in float32")
+    parser.add_argument("--detector", default="ultralytics", choices=["ultralytics", "onnx"],
+                        help="Run the real detector through ultralytics or directly on ONNX Runtime")
+    parser.add_argument("--stand-in", action="store_true", help="Use stand-in models even if weights exist")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""
+Headless camera supervisor.
+
+Starts one worker process per camera listed in a YAML config, watches them
+with async health checks and restarts dead or stalled workers with an
+exponential backoff. The config file is re-read when it changes (or on
+SIGHUP): added cameras are started, removed ones stopped and changed ones
+restarted, without touching the others.
+
+    python camera_supervisor.py --config cameras.yaml
+
+The Qt window (``python main.py --viewer``) can attach to the same
+shared-memory frames to watch the cameras.
+"""
+import argparse
+import asyncio
+import contextlib
+import multiprocessing as mp
+import os
+import signal
+import time
+
+import yaml
+
+from check_platform import get_os_name
+from shared_frame import SharedFrameReader, unlink_frame_channel
+from thread_budget import allocate, apply_in_child
+
+CAMERA_TYPES = ("face", "vehicle")
+# Worker dừng vòng lặp khi nhận SIGTERM (đang chờ inference server tối đa 5s); kill chỉ là phương án cuối
+STOP_TIMEOUT = 10.0
+
+DEFAULT_SETTINGS = {
+    # Inference server dùng chung cho camera face; số slot cố định trước để thêm camera lúc chạy
+    "inference_server": True,
+    "inference_slots": 8,
+    "health_interval": 5.0,
+    "frame_timeout": 10.0,
+    # Thời gian chờ frame đầu tiên (load model, kết nối RTSP)
+    "startup_timeout": 60.0,
+    "restart_backoff": 1.0,
+    "max_backoff": 60.0,
+    # Worker chạy ổn định lâu hơn ngưỡng này thì backoff quay về ban đầu
+    "stable_after": 60.0,
+    "reload_interval": 2.0,
+    "status_interval": 60.0,
+    # Chia CPU / số thread cho từng worker (big core trên RK3588)
+    "thread_budget": True,
+}
+
+
+def shared_mem_name(cam_id):
+    return f"camera_{cam_id}_frame"
+
+
+def load_camera_config(path):
+    """
+    Read the camera YAML config
+
+    Returns:
+        (settings, cameras): supervisor settings with defaults applied and
+        {camera id: camera dict} with keys id, rtsp, lane, url_parking, type, data
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("settings") or {})
+
+    cameras = {}
+    for entry in config.get("cameras") or []:
+        camera = {
+            "id": entry["id"],
+            "rtsp": entry["rtsp"],
+            "lane": entry.get("lane", "left"),
+            "url_parking": entry.get("url_parking"),
+            "type": entry.get("type", "face"),
+            # face: dict tùy chọn (roi, motion, ...); vehicle: polygon hoặc {"polygon": ..., "min_overlap": ...}
+            "data": entry.get("data") or [],
+        }
+        if camera["type"] not in CAMERA_TYPES:
+            raise ValueError(f"Camera {camera['id']}: type must be one of {CAMERA_TYPES}, got {camera['type']}")
+        if camera["id"] in cameras:
+            raise ValueError(f"Duplicate camera id {camera['id']} in {path}")
+        if entry.get("enabled", True):
+            cameras[camera["id"]] = camera
+    return settings, cameras
+
+
+def worker_weights(cameras, served):
+    """
+    Thread budget weights of the worker processes
+
+    The inference server weighs one per face camera it serves (ids in
+    ``served``); those cameras only decode and align and get weight 0.
+    """
+    weights = {}
+    for camera in cameras:
+        weights[f"camera-{camera['id']}"] = 0 if camera["id"] in served else 1
+    if served:
+        weights["inference-server"] = len(served)
+    return weights
+
+
+def spawn_environment(budget):
+    """Context exporting a ThreadBudget to the process started inside it (no-op for None)"""
+    return budget.spawn_environment() if budget is not None else contextlib.nullcontext()
+
+
+def run_camera(camera, inference=None):
+    """Process target for one camera; the pipeline module is only imported in the child"""
+    apply_in_child()
+    args = (camera["id"], camera["rtsp"], shared_mem_name(camera["id"]), camera["lane"], camera["url_parking"],
+            camera["data"])
+    if camera["type"] == "face":
+        from one_process_face import run_face_processing
+        run_face_processing(*args, inference)
+    else:
+        from one_process_car import run_vehicle_processing
+        run_vehicle_processing(*args)
+
+
+class CameraWorker:
+    """
+    One supervised camera process.
+
+    Health comes from the process state and the frame channel header
+    (``sequence`` / ``last_update`` are O(1) reads), so checking never
+    copies a frame. A dead or stalled worker is restarted after a backoff
+    that doubles on every quick failure and resets once the worker has run
+    for ``stable_after`` seconds.
+    """
+
+    def __init__(self, camera, settings, inference=None):
+        self.camera = camera
+        self.cam_id = camera["id"]
+        self.settings = settings
+        # (slot, request_queue, response_queue) của inference server, None = worker tự load model
+        self.inference = inference
+        self.shared_mem_name = shared_mem_name(self.cam_id)
+        # ThreadBudget dùng cho lần spawn tiếp theo, None = không giới hạn
+        self.budget = None
+
+        self.process = None
+        self.reader = None
+        self.state = "stopped"
+        self.started_at = 0.0
+        self.restarts = 0
+        self.last_reason = None
+        self.backoff = settings["restart_backoff"]
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._supervise())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._terminate()
+        self.state = "stopped"
+
+    def _spawn(self):
+        # Segment của lần chạy trước (worker bị kill) không được dùng lại
+        unlink_frame_channel(self.shared_mem_name)
+        self.process = mp.Process(target=run_camera, args=(self.camera, self.inference), name=f"camera-{self.cam_id}")
+        with spawn_environment(self.budget):
+            self.process.start()
+        self.started_at = time.time()
+        self.state = "starting"
+        print(f"[Supervisor] Camera {self.cam_id} started (pid {self.process.pid})")
+
+    async def _terminate(self):
+        self._close_reader()
+        process = self.process
+        if process is None:
+            return
+        # join chạy trong executor để không chặn các camera khác
+        loop = asyncio.get_running_loop()
+        if process.is_alive():
+            process.terminate()
+            await loop.run_in_executor(None, process.join, STOP_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+                await loop.run_in_executor(None, process.join)
+        process.close()
+        self.process = None
+
+    def _try_attach(self):
+        try:
+            self.reader = SharedFrameReader(self.shared_mem_name)
+        except (FileNotFoundError, ValueError):
+            self.reader = None
+
+    def _close_reader(self):
+        if self.reader is not None:
+            try:
+                self.reader.close()
+            except Exception:
+                pass
+            self.reader = None
+
+    def _check(self, now):
+        """Returns the reason the worker must be restarted, or None if it is healthy"""
+        if not self.process.is_alive():
+            return f"process exited with code {self.process.exitcode}"
+        if self.reader is None:
+            self._try_attach()
+        last_update = self.reader.last_update if self.reader is not None else 0.0
+        if last_update == 0.0:
+            if now - self.started_at > self.settings["startup_timeout"]:
+                return f"no frames {self.settings['startup_timeout']:.0f}s after start"
+            return None
+        if now - last_update > self.settings["frame_timeout"]:
+            return f"no frames for {self.settings['frame_timeout']:.0f}s"
+        self.state = "running"
+        return None
+
+    async def _supervise(self):
+        while True:
+            self._spawn()
+            while True:
+                reason = self._check(time.time())
+                if reason is not None:
+                    break
+                # Khi đang khởi động kiểm tra dày hơn để gắn shared memory sớm
+                await asyncio.sleep(0.5 if self.state == "starting" else self.settings["health_interval"])
+
+            ran_for = time.time() - self.started_at
+            await self._terminate()
+            if ran_for > self.settings["stable_after"]:
+                self.backoff = self.settings["restart_backoff"]
+            self.restarts += 1
+            self.last_reason = reason
+            self.state = "backoff"
+            print(f"[Supervisor] Camera {self.cam_id}: {reason}, restarting in {self.backoff:.0f}s")
+            await asyncio.sleep(self.backoff)
+            self.backoff = min(self.backoff * 2, self.settings["max_backoff"])
+
+    def status(self):
+        status = {
+            "id": self.cam_id,
+            "type": self.camera["type"],
+            "state": self.state,
+            "pid": self.process.pid if self.process is not None else None,
+            "restarts": self.restarts,
+            "last_reason": self.last_reason,
+            "budget_threads": self.budget.threads if self.budget is not None else None,
+            "budget_cpus": self.budget.cpus if self.budget is not None else None,
+        }
+        if self.reader is not None:
+            status.update(self.reader.stats())
+            status["frames"] = self.reader.sequence
+        return status
+
+
+class CameraSupervisor:
+    """
+    Owns the camera workers and the shared inference server of one box.
+
+    Everything runs on one asyncio loop: each worker has its own watch task,
+    so a slow restart of one camera never delays the others.
+    """
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.settings, self.cameras = load_camera_config(config_path)
+        self._config_mtime = os.path.getmtime(config_path)
+        self.workers = {}
+        # Phát hiện platform một lần ở đây: process con kế thừa biến môi trường FACE_PLATFORM
+        self.platform = get_os_name()
+        self.budgets = {}
+
+        # Inference server dùng chung cho các camera face
+        self.inference_process = None
+        self.inference_request_queue = None
+        self.inference_response_queues = []
+        self._free_slots = []
+        face_count = sum(1 for camera in self.cameras.values() if camera["type"] == "face")
+        if self.settings["inference_server"]:
+            slots = max(int(self.settings["inference_slots"]), face_count)
+            self.inference_request_queue = mp.Queue()
+            self.inference_response_queues = [mp.Queue() for _ in range(slots)]
+            self._free_slots = list(range(slots))
+
+        self._stopped = None
+        self._reload_requested = None
+
+    def _start_inference_server(self):
+        from inference_server import run_inference_server
+        self.inference_process = mp.Process(
+            target=run_inference_server,
+            args=(self.inference_request_queue, self.inference_response_queues),
+            name="inference-server",
+            daemon=True
+        )
+        with spawn_environment(self.budgets.get("inference-server")):
+            self.inference_process.start()
+        print(f"[Supervisor] Inference server started (pid {self.inference_process.pid})")
+
+    async def _stop_inference_server(self):
+        process, self.inference_process = self.inference_process, None
+        if process is not None and process.is_alive():
+            process.terminate()
+            await asyncio.get_running_loop().run_in_executor(None, process.join, 5)
+            print("[Supervisor] Inference server stopped")
+
+    def _take_slot(self):
+        if not self._free_slots:
+            return None
+        slot = self._free_slots.pop(0)
+        return slot, self.inference_request_queue, self.inference_response_queues[slot]
+
+    def _release_slot(self, inference):
+        from inference_server import drain_queue
+
+        slot, _, response_queue = inference
+        # Bỏ các phản hồi còn sót để camera nhận slot sau không đọc nhầm
+        drain_queue(response_queue)
+        self._free_slots.append(slot)
+
+    def _add(self, camera):
+        inference = self._take_slot() if camera["type"] == "face" else None
+        if camera["type"] == "face" and inference is None and self.settings["inference_server"]:
+            print(f"[Supervisor] WARNING: all {len(self.inference_response_queues)} inference slots are in use, "
+                  f"camera {camera['id']} loads its own models (raise settings.inference_slots)")
+        worker = CameraWorker(camera, self.settings, inference)
+        self.workers[camera["id"]] = worker
+        return worker
+
+    def _allocate_threads(self):
+        """
+        Recompute the CPU / thread budget of every worker
+
+        Workers that are already running keep their current budget until
+        their next restart; new workers start with the new one.
+        """
+        if not self.settings["thread_budget"]:
+            self.budgets = {}
+        else:
+            served = {cam_id for cam_id, worker in self.workers.items() if worker.inference is not None}
+            self.budgets = allocate(worker_weights([w.camera for w in self.workers.values()], served), self.platform)
+        for worker in self.workers.values():
+            worker.budget = self.budgets.get(f"camera-{worker.cam_id}")
+        for name, budget in self.budgets.items():
+            print(f"[Supervisor] {name}: {budget.threads} thread(s) on CPUs {budget.cpus}")
+
+    async def _remove(self, cam_id):
+        worker = self.workers.pop(cam_id)
+        await worker.stop()
+        if worker.inference is not None:
+            self._release_slot(worker.inference)
+        print(f"[Supervisor] Camera {cam_id} stopped")
+
+    async def apply(self, cameras):
+        """Start added cameras, stop removed ones and restart changed ones; the others keep running"""
+        stale = [cam_id for cam_id, worker in self.workers.items()
+                 if cam_id not in cameras or worker.camera != cameras[cam_id]]
+        await asyncio.gather(*(self._remove(cam_id) for cam_id in stale))
+        added = [self._add(camera) for cam_id, camera in cameras.items() if cam_id not in self.workers]
+        self.cameras = cameras
+        # Không còn camera face nào dùng server: giải phóng hai model
+        if self.inference_process is not None and all(w.inference is None for w in self.workers.values()):
+            await self._stop_inference_server()
+
+        self._allocate_threads()
+        if self.inference_process is None and any(worker.inference is not None for worker in added):
+            self._start_inference_server()
+        for worker in added:
+            worker.start()
+
+    async def reload(self):
+        try:
+            settings, cameras = load_camera_config(self.config_path)
+        except Exception as e:
+            print(f"[Supervisor] Invalid config {self.config_path}, keeping the current one: {e}")
+            return
+        # Worker dùng chung dict settings: cập nhật tại chỗ
+        self.settings.update(settings)
+        await self.apply(cameras)
+        print(f"[Supervisor] Config reloaded: {len(cameras)} camera(s)")
+
+    async def _watch_config(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._reload_requested.wait(), self.settings["reload_interval"])
+            except asyncio.TimeoutError:
+                pass
+            try:
+                mtime = os.path.getmtime(self.config_path)
+            except OSError:
+                continue
+            if self._reload_requested.is_set() or mtime != self._config_mtime:
+                self._reload_requested.clear()
+                self._config_mtime = mtime
+                # Lỗi khi áp dụng config (spawn lỗi, option sai) không được làm dừng task theo dõi
+                try:
+                    await self.reload()
+                except Exception as e:
+                    print(f"[Supervisor] Error applying config {self.config_path}: {e}")
+
+    async def _watch_inference_server(self):
+        while True:
+            await asyncio.sleep(self.settings["health_interval"])
+            if self.inference_process is not None and not self.inference_process.is_alive():
+                print("[Supervisor] Inference server died, restarting...")
+                self._start_inference_server()
+
+    async def _report_status(self):
+        while True:
+            await asyncio.sleep(self.settings["status_interval"])
+            for worker in self.workers.values():
+                status = worker.status()
+                print(f"[Supervisor] Camera {status['id']} {status['state']} | pid {status['pid']} | "
+                      f"restarts {status['restarts']} | FPS {status.get('fps', 0):.0f} | "
+                      f"latency {status.get('latency_ms', 0):.0f} ms | threads {status['budget_threads']} "
+                      f"on CPUs {status['budget_cpus']}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._reload_requested = asyncio.Event()
+        loop.add_signal_handler(signal.SIGINT, self._stopped.set)
+        loop.add_signal_handler(signal.SIGTERM, self._stopped.set)
+        loop.add_signal_handler(signal.SIGHUP, self._reload_requested.set)
+
+        await self.apply(self.cameras)
+        tasks = [loop.create_task(coro) for coro in
+                 (self._watch_config(), self._watch_inference_server(), self._report_status())]
+        print(f"[Supervisor] Running {len(self.workers)} camera(s) from {self.config_path}")
+
+        await self._stopped.wait()
+        print("[Supervisor] Stopping...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.apply({})
+        await self._stop_inference_server()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run camera workers without a display")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "cameras.yaml"),
+                        help="Camera YAML config (re-read when it changes)")
+    args = parser.parse_args(argv)
+
+    mp.set_start_method('spawn', force=True)
+    asyncio.run(CameraSupervisor(args.config).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,16 @@
+import json
 import os
 import platform
+import shutil
 import subprocess
+import tempfile
 from enum import Enum
 
+# Kết quả get_os_name() được lưu vào biến môi trường (process con kế thừa) và file cache
+PLATFORM_ENV = "FACE_PLATFORM"
+PLATFORM_CACHE_PATH = os.environ.get("FACE_PLATFORM_CACHE",
+                                     os.path.join(tempfile.gettempdir(), "face_platform.json"))
+
 
 class PlatformEnum(Enum):
     WINDOWS = "windows"
@@ -74,7 +82,8 @@ def detect_os():
         except:
             # Thử cách khác nếu file không tồn tại
             try:
-                distro_info = subprocess.check_output("lsb_release -a", shell=True, universal_newlines=True)
+                distro_info = subprocess.check_output(["lsb_release", "-a"], universal_newlines=True,
+                                                      stderr=subprocess.DEVNULL)
                 if "Ubuntu" in distro_info:
                     is_ubuntu = True
             except:
@@ -86,45 +95,38 @@ def detect_os():
         # Kiểm tra Orange Pi (thường chạy trên ARM và có thông tin trong model name)
         is_orangepi = False
         is_orangepi_max = False
-        try:
-            with open("/proc/cpuinfo") as f:
-                cpuinfo = f.read()
-                if any(x in cpuinfo.lower() for x in ["orangepi", "orange pi" "h3", "h5", "h6", "allwinner"]):
-                    is_orangepi = True
+        cpuinfo = _read_text("/proc/cpuinfo")
+        if any(x in cpuinfo.lower() for x in ["orangepi", "orange pi" "h3", "h5", "h6", "allwinner"]):
+            is_orangepi = True
 
-                if any(x in cpuinfo.lower() for x in ["opi 5 max"]):
-                    is_orangepi_max = True
-        except:
-            pass
+        if any(x in cpuinfo.lower() for x in ["opi 5 max"]):
+            is_orangepi_max = True
 
         # Kiểm tra thêm model hardware
-        try:
-            if os.path.exists("/proc/device-tree/model"):
-                with open("/proc/device-tree/model") as f:
-                    model = f.read()
-                    if "Orange Pi".lower() in model.lower():
-                        is_orangepi = True
-
-                    if "opi 5 max".lower() in model.lower():
-                        is_orangepi_max = True
+        model = _read_text("/proc/device-tree/model")
+        if model:
+            if "Orange Pi".lower() in model.lower():
+                is_orangepi = True
 
-                    result["details"]["hardware_model"] = model.strip('\0')
+            if "opi 5 max".lower() in model.lower():
+                is_orangepi_max = True
 
-        except:
-            pass
+            result["details"]["hardware_model"] = model.strip('\0')
 
-        # Kiểm tra board hardware qua các command phổ biến
-        try:
-            board_info = subprocess.check_output(
-                "cat /proc/device-tree/model 2>/dev/null || cat /sys/firmware/devicetree/base/model 2>/dev/null || (which armbian-config > /dev/null && armbian-config -s)",
-                shell=True, universal_newlines=True)
+        # Kiểm tra board hardware: đọc trực tiếp file device tree, chỉ gọi armbian-config khi không có
+        board_info = model or _read_text("/sys/firmware/devicetree/base/model")
+        if not board_info and shutil.which("armbian-config"):
+            try:
+                board_info = subprocess.check_output(["armbian-config", "-s"], universal_newlines=True,
+                                                     stderr=subprocess.DEVNULL, timeout=5)
+            except:
+                pass
+        if board_info:
             if "Orange Pi".lower() in board_info:
                 is_orangepi = True
             if "opi 5 max".lower() in board_info:
                 is_orangepi_max = True
             result["details"]["board_info"] = board_info.strip()
-        except:
-            pass
 
         result["is_orangepi"] = is_orangepi
         result["is_orangepi_max"] = is_orangepi_max
@@ -143,12 +145,10 @@ def detect_os():
             processor_name = winreg.QueryValueEx(reg_key, "ProcessorNameString")[0]
             result["details"]["cpu"] = processor_name
         elif platform.system() == "Linux":
-            with open("/proc/cpuinfo") as f:
-                cpu_info = f.read()
-                for line in cpu_info.split("\n"):
-                    if "model name" in line:
-                        result["details"]["cpu"] = line.split(":")[1].strip()
-                        break
+            for line in cpuinfo.split("\n"):
+                if "model name" in line:
+                    result["details"]["cpu"] = line.split(":")[1].strip()
+                    break
     except:
         result["details"]["cpu"] = platform.processor()
 
@@ -173,9 +173,15 @@ def detect_os():
     return result
 
 
-# Hàm đơn giản hóa để chỉ trả về tên OS
-def get_os_name():
-    os_info = detect_os()
+def _read_text(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _platform_from_info(os_info):
     if os_info["is_windows"]:
         return PlatformEnum.WINDOWS
     elif os_info["is_orangepi_max"]:
@@ -189,6 +195,58 @@ def get_os_name():
         return PlatformEnum.UNKNOWN
 
 
+def _host_key():
+    # File cache chỉ hợp lệ trên đúng máy đã tạo ra nó
+    return {"node": platform.node(), "machine": platform.machine(), "system": platform.system()}
+
+
+def _read_platform_cache():
+    try:
+        with open(PLATFORM_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached.get("host") == _host_key():
+            return PlatformEnum(cached["platform"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _write_platform_cache(platform_name):
+    try:
+        tmp_path = f"{PLATFORM_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"platform": platform_name.value, "host": _host_key()}, f)
+        os.replace(tmp_path, PLATFORM_CACHE_PATH)
+    except OSError:
+        pass
+
+
+# Hàm đơn giản hóa để chỉ trả về tên OS
+def get_os_name(refresh=False):
+    """
+    Platform of this machine, detected once
+
+    Looked up in order: the FACE_PLATFORM environment variable (set by the
+    first call, so spawned camera processes inherit it), the cache file
+    FACE_PLATFORM_CACHE, then a full detect_os() whose result is saved to
+    both. ``refresh=True`` forces a new detection.
+    """
+    if not refresh:
+        try:
+            return PlatformEnum(os.environ[PLATFORM_ENV])
+        except (KeyError, ValueError):
+            pass
+        cached = _read_platform_cache()
+        if cached is not None:
+            os.environ[PLATFORM_ENV] = cached.value
+            return cached
+
+    platform_name = _platform_from_info(detect_os())
+    os.environ[PLATFORM_ENV] = platform_name.value
+    _write_platform_cache(platform_name)
+    return platform_name
+
+
 # Chạy kiểm tra nếu script được gọi trực tiếp
 if __name__ == "__main__":
     os_info = detect_os()
@@ -205,4 +263,4 @@ if __name__ == "__main__":
     for key, value in os_info["details"].items():
         print(f"- {key}: {value}")
 
-    print(f"\nTóm tắt: Hệ điều hành của bạn là {get_os_name()}")
+    print(f"\nTóm tắt: Hệ điều hành của bạn là {get_os_name(refresh=True)}")
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_version(*paths):
+    """
+    Fingerprint of model weight files (path, size, mtime); directories are walked
+
+    Returns:
+        Short hex digest that changes whenever a weight file is replaced
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for file in files:
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU + TTL cache of detection/embedding results keyed by upload content.
+
+    Keys are the SHA-256 of the uploaded bytes plus the model version, so a
+    repeated upload skips YOLO and ArcFace entirely. An entry keeps the boxes
+    of every detected face and the embeddings computed so far (add_face only
+    embeds the first face). The weight files are re-fingerprinted every
+    ``check_interval`` seconds and the cache is cleared when they change.
+    Size and TTL default to the FACE_CACHE_SIZE / FACE_CACHE_TTL environment
+    variables.
+    """
+
+    def __init__(self, model_paths=(), max_entries=None, ttl=None, check_interval=10.0):
+        self.max_entries = max_entries if max_entries is not None else int(os.environ.get("FACE_CACHE_SIZE", 1024))
+        self.ttl = ttl if ttl is not None else float(os.environ.get("FACE_CACHE_TTL", 3600))
+        self.model_paths = tuple(model_paths)
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = model_version(*self.model_paths)
+        self._checked_at = time.monotonic()
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, data: bytes):
+        return hashlib.sha256(data).hexdigest() + ":" + self.version
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = model_version(*self.model_paths)
+        if version != self.version:
+            self.version = version
+            self.invalidate()
+
+    def get(self, data: bytes, max_faces=None):
+        """
+        Cached result for these bytes
+
+        Returns:
+            (boxes, embeddings) with up to ``max_faces`` faces, or None on a miss
+        """
+        self._check_version()
+        key = self.key(data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            wanted = None
+            if entry is not None:
+                _, boxes, embeddings = entry
+                wanted = len(boxes) if max_faces is None else min(max_faces, len(boxes))
+            if entry is None or len(embeddings) < wanted:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return boxes[:wanted], embeddings[:wanted]
+
+    def put(self, data: bytes, boxes, embeddings):
+        """Store the boxes of all detected faces and the embeddings of the first len(embeddings)"""
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        embeddings = np.array(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1 and embeddings.size:
+            embeddings = embeddings[None]
+        boxes.flags.writeable = False
+        embeddings.flags.writeable = False
+
+        key = self.key(data)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and len(previous[2]) > len(embeddings):
+                return
+            self._entries[key] = (time.monotonic(), boxes, embeddings)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "model_version": self.version,
+        }
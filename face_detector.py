@@ -0,0 +1,92 @@
+import os
+
+import cv2
+import numpy as np
+
+from check_platform import PlatformEnum
+from onnx_session import create_session, warm_up
+
+# "ultralytics" (mặc định) hoặc "onnx": chạy yolov8n-face.onnx trực tiếp bằng ONNX Runtime
+FACE_DETECTOR_BACKEND = os.environ.get("FACE_DETECTOR_BACKEND", "ultralytics")
+
+
+class OnnxFaceDetector:
+    """
+    YOLOv8 face (pose) model run directly on ONNX Runtime.
+
+    Same model file as the ultralytics path, but the session comes from
+    onnx_session.create_session (tuned options, cached optimized graph) and
+    is warmed up at load time. Letterboxing, decoding of the
+    (1, 5 + 3K, anchors) output and NMS are done here with NumPy and OpenCV.
+    """
+
+    def __init__(self, model_path, conf_threshold=0.25, iou_threshold=0.45, session_options=None, warmup=True):
+        self.session = create_session(model_path, **(session_options or {}))
+        tensor = self.session.get_inputs()[0]
+        self.input_name = tensor.name
+        height, width = tensor.shape[2:4]
+        # Input động: mặc định 640, có thể đổi theo từng lần gọi (imgsz)
+        self.dynamic_input = not (isinstance(height, int) and isinstance(width, int))
+        self.input_size = (640, 640) if self.dynamic_input else (width, height)
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.warmup_ms = None
+        if warmup:
+            self.warmup_ms = warm_up(self.session, {self.input_name: (1, 3, self.input_size[1], self.input_size[0])})
+
+    def _letterbox(self, image, size):
+        """Resize keeping the aspect ratio and pad to size (width, height) with gray, as ultralytics does"""
+        height, width = image.shape[:2]
+        scale = min(size[0] / width, size[1] / height)
+        new_width, new_height = round(width * scale), round(height * scale)
+        pad_x, pad_y = (size[0] - new_width) / 2, (size[1] - new_height) / 2
+
+        canvas = np.full((size[1], size[0], 3), 114, dtype=np.uint8)
+        left, top = int(round(pad_x - 0.1)), int(round(pad_y - 0.1))
+        canvas[top:top + new_height, left:left + new_width] = cv2.resize(image, (new_width, new_height),
+                                                                         interpolation=cv2.INTER_LINEAR)
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+        return blob, scale, (left, top)
+
+    def detect(self, image, conf_threshold=None, imgsz=None):
+        """
+        Returns:
+            (boxes, scores, keypoints): boxes (N,4) xyxy, scores (N,) and
+            keypoints (N,K,3) as [x, y, confidence], in image coordinates
+        """
+        conf_threshold = self.conf_threshold if conf_threshold is None else conf_threshold
+        size = (imgsz, imgsz) if imgsz and self.dynamic_input else self.input_size
+        blob, scale, (left, top) = self._letterbox(image, size)
+
+        predictions = self.session.run(None, {self.input_name: blob})[0][0].T
+        predictions = predictions[predictions[:, 4] > conf_threshold]
+        if len(predictions) == 0:
+            return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32), \
+                np.zeros((0, 5, 3), dtype=np.float32)
+
+        centers, sizes = predictions[:, :2], predictions[:, 2:4]
+        xywh = np.concatenate([centers - sizes / 2, sizes], axis=1)
+        keep = cv2.dnn.NMSBoxes(xywh.tolist(), predictions[:, 4].tolist(), conf_threshold, self.iou_threshold)
+        keep = np.asarray(keep, dtype=np.intp).reshape(-1)
+        predictions, xywh = predictions[keep], xywh[keep]
+
+        offset = np.array([left, top], dtype=np.float32)
+        boxes = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+        boxes = np.clip((boxes.reshape(-1, 2, 2) - offset) / scale, 0, [image.shape[1], image.shape[0]])
+        keypoints = predictions[:, 5:].reshape(len(predictions), -1, 3).copy()
+        keypoints[..., :2] = (keypoints[..., :2] - offset) / scale
+        return boxes.reshape(-1, 4).astype(np.float32), predictions[:, 4].astype(np.float32), \
+            keypoints.astype(np.float32)
+
+
+def load_face_detector(platform, model_path, session_options=None):
+    """
+    Face detector for this platform
+
+    RKNN models always go through ultralytics; on Ubuntu FACE_DETECTOR_BACKEND=onnx
+    selects OnnxFaceDetector. Both work with align_face.detect_faces.
+    """
+    if platform == PlatformEnum.UBUNTU and FACE_DETECTOR_BACKEND == "onnx":
+        return OnnxFaceDetector(model_path, session_options=session_options)
+    from ultralytics import YOLO
+    return YOLO(model_path, task='pose')
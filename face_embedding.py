@@ -1,24 +1,38 @@
+import os
 import time
 
 import cv2
 import numpy as np
 
 from check_platform import PlatformEnum
+from onnx_session import create_session, warm_up
 
 
 class SimpleEmbeddingExtractor:
-    def __init__(self, platform, model_path):  # Sửa lỗi __init__
+    def __init__(self, platform, model_path, rknn_batch_size=1, session_options=None, warmup=True):  # Sửa lỗi __init__
         try:
             self.platform = platform
+            # None = batch động (chạy cả batch một lần), số nguyên = chia micro-batch cố định
+            self.max_batch_size = None
+            self.rknn_batch_size = rknn_batch_size
+            # Tham số cho onnx_session.create_session (số thread, mức tối ưu graph, ...)
+            self.session_options = session_options or {}
+            self.warmup_ms = None
             if platform == PlatformEnum.UBUNTU:
-                import onnxruntime as ort
-                self.session = ort.InferenceSession(
-                    model_path,
-                    providers=['CPUExecutionProvider']  # Có thể thêm 'CUDAExecutionProvider' nếu có GPU
-                )
+                # Có thể thêm 'CUDAExecutionProvider' vào providers nếu có GPU
+                self.session = create_session(model_path, **self.session_options)
                 self.input_name = self.session.get_inputs()[0].name
                 self.output_name = self.session.get_outputs()[0].name
 
+                batch_dim = self.session.get_inputs()[0].shape[0]
+                if isinstance(batch_dim, int):
+                    self._load_dynamic_batch_session(model_path, batch_dim)
+
+                # Chạy thử một lần để khuôn mặt thật đầu tiên không phải chịu chi phí khởi tạo
+                if warmup:
+                    batch = self.max_batch_size or 1
+                    self.warmup_ms = warm_up(self.session, {self.input_name: (batch, 3, 112, 112)})
+
             else:
                 from rknn.api import RKNN
                 self.rknn = RKNN()
@@ -37,6 +51,36 @@ class SimpleEmbeddingExtractor:
             print(f"Error loading model: {e}")
             raise
 
+    def _load_dynamic_batch_session(self, model_path, batch_dim):
+        """
+        Re-wrap a fixed-batch ONNX model with a dynamic batch axis
+
+        The rewritten model is cached next to the original as *_dynamic.onnx.
+        If onnx is not installed or the graph does not accept a larger batch,
+        the original session is kept and batches are split into micro-batches.
+        """
+        self.max_batch_size = batch_dim
+        dynamic_path = os.path.splitext(model_path)[0] + "_dynamic.onnx"
+        try:
+            if not os.path.exists(dynamic_path) or os.path.getmtime(dynamic_path) < os.path.getmtime(model_path):
+                import onnx
+                model = onnx.load(model_path)
+                for tensor in list(model.graph.input) + list(model.graph.output):
+                    dim = tensor.type.tensor_type.shape.dim[0]
+                    dim.ClearField("dim_value")
+                    dim.dim_param = "batch"
+                # Bỏ shape trung gian đã cố định batch để runtime tự suy luận lại
+                del model.graph.value_info[:]
+                onnx.save(model, dynamic_path)
+
+            session = create_session(dynamic_path, **self.session_options)
+            # Kiểm tra model thật sự chạy được với batch > 1
+            session.run([self.output_name], {self.input_name: np.zeros((2, 3, 112, 112), dtype=np.float32)})
+            self.session = session
+            self.max_batch_size = None
+        except Exception as e:
+            print(f"Dynamic batch not available, using micro-batches of {batch_dim}: {e}")
+
     def preprocess_face(self, face_image):
         """
         Tiền xử lý ảnh khuôn mặt trước khi đưa vào model
@@ -68,6 +112,91 @@ class SimpleEmbeddingExtractor:
 
         return face_image
 
+    def preprocess_faces(self, faces):
+        """
+        Tiền xử lý nhiều khuôn mặt thành một batch
+
+        Args:
+            faces: List ảnh khuôn mặt BGR hoặc mảng (N,112,112,3)
+
+        Returns:
+            Tensor float32 shape (N,3,112,112) đã normalize về [-1, 1]
+        """
+        if isinstance(faces, np.ndarray) and faces.ndim == 4 and faces.shape[1:3] == (112, 112):
+            # BGR -> RGB và HWC -> CHW cho cả batch cùng lúc
+            batch = faces[..., ::-1].transpose(0, 3, 1, 2).astype(np.float32)
+        else:
+            batch = np.empty((len(faces), 3, 112, 112), dtype=np.float32)
+            for i, face in enumerate(faces):
+                if face.shape[:2] != (112, 112):
+                    face = cv2.resize(face, (112, 112))
+                batch[i] = face[:, :, ::-1].transpose(2, 0, 1)
+
+        batch -= 127.5
+        batch /= 127.5
+        return batch
+
+    def _run_rknn_batch(self, faces):
+        """Chạy RKNN theo micro-batch có kích thước cố định"""
+        size = self.rknn_batch_size
+        embeddings = []
+        for start in range(0, len(faces), size):
+            chunk = faces[start:start + size]
+            if size == 1:
+                inputs = chunk[0]
+            else:
+                inputs = np.zeros((size, 112, 112, 3), dtype=np.uint8)
+                for i, face in enumerate(chunk):
+                    inputs[i] = face if face.shape[:2] == (112, 112) else cv2.resize(face, (112, 112))
+            outputs = self.rknn.inference(inputs=[inputs])
+            if outputs is None or len(outputs) == 0 or outputs[0] is None:
+                return None
+            embeddings.append(np.asarray(outputs[0], dtype=np.float32).reshape(-1, 512)[:len(chunk)])
+        return np.vstack(embeddings)
+
+    def extract_embeddings_batch(self, faces):
+        """
+        Trích xuất embedding cho nhiều khuôn mặt đã align trong một lần inference
+
+        Args:
+            faces: List ảnh khuôn mặt BGR (112x112) hoặc mảng (N,112,112,3)
+
+        Returns:
+            Ma trận embedding (N,512) đã L2-normalize, hoặc None nếu lỗi
+        """
+        if len(faces) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+
+        try:
+            if self.platform == PlatformEnum.UBUNTU:
+                batch = self.preprocess_faces(faces)
+                if self.max_batch_size is None:
+                    embeddings = self.session.run([self.output_name], {self.input_name: batch})[0]
+                else:
+                    size = self.max_batch_size
+                    chunks = []
+                    for start in range(0, len(batch), size):
+                        chunk = batch[start:start + size]
+                        if len(chunk) < size:
+                            # Model batch cố định: pad phần dư bằng 0
+                            chunk = np.concatenate([chunk, np.zeros((size - len(chunk), 3, 112, 112), dtype=np.float32)])
+                        output = self.session.run([self.output_name], {self.input_name: chunk})[0]
+                        chunks.append(output[:min(size, len(batch) - start)])
+                    embeddings = np.vstack(chunks)
+            else:
+                embeddings = self._run_rknn_batch(faces)
+                if embeddings is None:
+                    return None
+
+            embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(faces), -1)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            return embeddings / norms
+
+        except Exception as e:
+            print(f"Error during batch embedding extraction: {e}")
+            return None
+
     def extract_embedding_from_aligned_face(self, aligned_face):
         """
         Trích xuất embedding từ khuôn mặt đã được align
@@ -1,27 +1,33 @@
 # main.py
+import contextlib
 import os
+import threading
 import warnings
 
 from fastapi import HTTPException
-from ultralytics import YOLO
 
-from align_face import extract_faces_with_alignment
+from align_face import detect_faces, detect_faces_batch
 from check_platform import PlatformEnum, get_os_name
+from embedding_cache import EmbeddingCache
+from face_detector import load_face_detector
 from face_embedding import SimpleEmbeddingExtractor
+from image_ingest import UploadedImage, decode_upload
+from metrics import FACES_PER_UPLOAD, TimedClient, stage_error, stage_timer
+from thumbnails import backfill_thumbnails, delete_thumbnails, make_thumbnails, make_thumbnails_from_file, thumbnail_path
 
 # Suppress FutureWarning from InsightFace before importing
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", message=".*rcond parameter will change.*")
 
-import cv2
 import numpy as np
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import (Distance, VectorParams, PointStruct, PayloadSchemaType, FieldCondition, Filter,
+                                  MatchValue, SearchRequest)
+import time
 import uuid
-from typing import List, Optional
+from typing import List, Optional, Sequence, Tuple
 import logging
-from PIL import Image
-import io
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Setup logging
@@ -32,10 +38,10 @@ logger = logging.getLogger(__name__)
 class FaceRecognitionService:
     def __init__(self):
         # Initialize Qdrant client
-        self.qdrant_client = QdrantClient(
+        self.qdrant_client = TimedClient(QdrantClient(
             host="localhost",
             port=6333
-        )
+        ), "qdrant")
         self.platform = get_os_name()
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.path_model_detect_face = os.path.join(self.script_dir, "weight/yolov8n-face.onnx")
@@ -44,9 +50,22 @@ class FaceRecognitionService:
             self.path_model_detect_face = os.path.join(self.script_dir, "weight/yolov8n-face_rknn_model_640")
             self.path_model_recognition = os.path.join(self.script_dir, "weight/w600k_r50.rknn")
 
-        self.yolo_model = YOLO(self.path_model_detect_face, task='pose')
+        self.yolo_model = load_face_detector(self.platform, self.path_model_detect_face)
         self.embedding_extractor = SimpleEmbeddingExtractor(self.platform, self.path_model_recognition)
 
+        # Model được gọi từ nhiều thread của executor: YOLO (ultralytics) và RKNN không thread-safe
+        self._detector_lock = threading.Lock()
+        self._recognizer_lock = threading.Lock() if self.platform != PlatformEnum.UBUNTU else contextlib.nullcontext()
+
+        # Cache kết quả detect/embedding theo nội dung ảnh (upload lặp lại bỏ qua YOLO + ArcFace)
+        self.embedding_cache = EmbeddingCache(model_paths=(self.path_model_detect_face, self.path_model_recognition))
+
+        # Async client for read-only routes so they keep serving while inference is saturated
+        self.async_qdrant_client = TimedClient(AsyncQdrantClient(
+            host="localhost",
+            port=6333
+        ), "qdrant")
+
         # Collection name
         self.collection_name = "face_embeddings"
 
@@ -68,30 +87,85 @@ class FaceRecognitionService:
                     )
                 )
                 logger.info(f"Created collection: {self.collection_name}")
+
+            # Index updated_ts so camera gallery indexes can sync incrementally
+            self.qdrant_client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name="updated_ts",
+                field_schema=PayloadSchemaType.FLOAT
+            )
         except Exception as e:
             logger.error(f"Error creating collection: {e}")
             raise e
 
     def extract_face_embedding(self, image_bytes: bytes) -> Optional[np.ndarray]:
-        """Extract face embedding from image bytes"""
+        """Extract the embedding of the first detected face from image bytes"""
+        embeddings = self.extract_face_embeddings(image_bytes, max_faces=1)
+        if embeddings is None or len(embeddings) == 0:
+            return None
+        return embeddings[0]
+
+    def extract_face_embeddings(self, image_bytes: bytes, max_faces: Optional[int] = None) -> Optional[np.ndarray]:
+        """Extract embeddings (N,512) of the detected faces in one batched inference"""
+        faces = self.extract_faces(image_bytes, max_faces)
+        return None if faces is None else faces[1]
+
+    def extract_faces(self, image_bytes: bytes,
+                      max_faces: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Boxes (N,4) in original image coordinates and embeddings (N,512) of the detected faces"""
+        cached = self.embedding_cache.get(image_bytes, max_faces)
+        if cached is not None:
+            return cached if len(cached[1]) else None
+
+        upload = self._decode(image_bytes)
+        if upload is None:
+            return None
+        return self._detect_and_embed(upload, max_faces)
+
+    @staticmethod
+    def _decode(image_bytes: bytes) -> Optional[UploadedImage]:
+        with stage_timer("decode"):
+            upload = decode_upload(image_bytes)
+        if upload is None:
+            stage_error("decode")
+        return upload
+
+    def _embed_upload(self, upload: UploadedImage, max_faces: Optional[int] = None) -> Optional[np.ndarray]:
+        """Embeddings of an already decoded upload, served from the cache when the same bytes were seen"""
+        cached = self.embedding_cache.get(upload.data, max_faces)
+        if cached is not None:
+            return cached[1] if len(cached[1]) else None
+        faces = self._detect_and_embed(upload, max_faces)
+        return None if faces is None else faces[1]
+
+    def _detect_and_embed(self, upload: UploadedImage,
+                          max_faces: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Detect on the (possibly reduced) decoded upload, align and embed the faces"""
         try:
+            with self._detector_lock, stage_timer("detect"):
+                boxes, _, keypoints, _ = detect_faces(upload.image, self.yolo_model)
+            FACES_PER_UPLOAD.observe(len(keypoints))
+            original_boxes = boxes * upload.scale
 
-            # Convert bytes to image
-            image = Image.open(io.BytesIO(image_bytes))
-            image_array = np.array(image)
-
-            # Convert RGB to BGR for OpenCV
-            if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-
-            # Detect faces and extract embeddings
-            aligned_faces, results = extract_faces_with_alignment(image_array, self.yolo_model)
-
-            if len(aligned_faces) == 0:
+            if len(keypoints) == 0:
+                self.embedding_cache.put(upload.data, original_boxes, [])
+                return None
+            selected = slice(None) if max_faces is None else slice(max_faces)
+            with stage_timer("align"):
+                aligned_faces, kept = upload.align(boxes[selected], keypoints[selected])
+            # Khuôn mặt có keypoint suy biến bị bỏ khỏi cả boxes để boxes / embeddings khớp thứ tự
+            dropped = np.setdiff1d(np.arange(len(keypoints))[selected], kept)
+            original_boxes = np.delete(original_boxes, dropped, axis=0)
+            if len(kept) == 0:
+                self.embedding_cache.put(upload.data, original_boxes, [])
                 return None
-            embedding = self.embedding_extractor.extract_embedding_from_aligned_face(aligned_faces[0])
-            # Return embedding of the first detected face
-            return embedding
+            with self._recognizer_lock, stage_timer("embed"):
+                embeddings = self.embedding_extractor.extract_embeddings_batch(aligned_faces)
+            if embeddings is None:
+                stage_error("embed")
+                return None
+            self.embedding_cache.put(upload.data, original_boxes, embeddings)
+            return original_boxes[:len(embeddings)], embeddings
 
         except Exception as e:
             logger.error(f"Error extracting face embedding: {e}")
@@ -99,31 +173,20 @@ class FaceRecognitionService:
 
     def add_face(self, image_bytes: bytes, person_name: str,code_card:str) -> dict:
         """Add face to database"""
-        embedding = self.extract_face_embedding(image_bytes)
+        upload = self._decode(image_bytes)
+        if upload is None:
+            raise HTTPException(status_code=400, detail="File is not a valid image")
 
-        if embedding is None:
+        embeddings = self._embed_upload(upload, max_faces=1)
+        if embeddings is None or len(embeddings) == 0:
             raise HTTPException(status_code=400, detail="No face detected in image")
+        embedding = embeddings[0]
 
-        # Ensure embedding is 1D and convert to list
-        if embedding.ndim > 1:
-            embedding = embedding.flatten()
-
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
-
-        url = None
-        # Convert RGB to BGR for OpenCV
-        if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-            # save image use opencv
-            url = os.path.join( "images", f"{uuid.uuid4()}.jpg")
-            url_save = os.path.join(self.script_dir, url)
-            # check if images directory exists
-            if not os.path.exists(os.path.dirname(url_save)):
-                os.makedirs(os.path.dirname(url_save))
-            cv2.imwrite(url_save, image_array)
-
-        if not url:
+        # Lưu nguyên bytes gốc, không encode lại
+        try:
+            url = upload.save_original(self.script_dir)
+        except OSError as e:
+            logger.error(f"Error saving image: {e}")
             raise HTTPException(status_code=403, detail="Failed to save image")
 
         # Generate unique ID
@@ -144,11 +207,14 @@ class FaceRecognitionService:
                             "image_url": url,
                             "code_card": code_card,
                             "created_at": current_time,
-                            "updated_at": current_time
+                            "updated_at": current_time,
+                            "updated_ts": time.time()
                         }
                     )
                 ]
             )
+            # Thumbnail chỉ ghi sau khi upsert thành công, tránh file mồ côi
+            make_thumbnails(upload.image, face_id, self.script_dir)
 
             return {
                 "success": True,
@@ -163,6 +229,157 @@ class FaceRecognitionService:
             logger.error(f"Error storing face: {e}")
             raise HTTPException(status_code=500, detail="Failed to store face")
 
+    def add_faces_batch(self, items: List[dict], detect_batch_size: int = 16, upsert_batch_size: int = 256,
+                        max_workers: int = 8) -> List[dict]:
+        """
+        Enroll many faces at once
+
+        Args:
+            items: List of {"filename", "image_bytes", "person_name", "code_card"}
+            detect_batch_size: Images per YOLO predict call
+            upsert_batch_size: Points per Qdrant upsert
+            max_workers: Threads used to decode and save images
+
+        Returns:
+            One result dict per item, in input order
+        """
+        results = [{"filename": item.get("filename"), "success": False} for item in items]
+
+        # Giải mã song song (cv2.imdecode nhả GIL)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            uploads = list(executor.map(lambda item: self._decode(item["image_bytes"]), items))
+
+        valid = []
+        for i, (item, upload) in enumerate(zip(items, uploads)):
+            if not item.get("person_name") or not item.get("code_card"):
+                results[i]["error"] = "person_name and code_card are required"
+            elif upload is None:
+                results[i]["error"] = "File is not a valid image"
+            else:
+                valid.append(i)
+
+        # Ảnh đã gặp (upload lại) lấy embedding từ cache
+        cached_embeddings = {}
+        to_detect = []
+        for i in valid:
+            cached = self.embedding_cache.get(uploads[i].data, max_faces=1)
+            if cached is None:
+                to_detect.append(i)
+            elif len(cached[1]) == 0:
+                results[i]["error"] = "No face detected in image"
+            else:
+                cached_embeddings[i] = cached[1][0]
+
+        # Detect theo batch, chỉ lấy khuôn mặt đầu tiên như add_face
+        with self._detector_lock, stage_timer("detect"):
+            detections = detect_faces_batch([uploads[i].image for i in to_detect], self.yolo_model,
+                                            batch_size=detect_batch_size)
+        detected = []
+        detected_boxes = []
+        crops = []
+        for i, (boxes, _, keypoints) in zip(to_detect, detections):
+            FACES_PER_UPLOAD.observe(len(keypoints))
+            if len(keypoints) == 0:
+                results[i]["error"] = "No face detected in image"
+                self.embedding_cache.put(uploads[i].data, boxes * uploads[i].scale, [])
+                continue
+            with stage_timer("align"):
+                faces, _ = uploads[i].align(boxes[:1], keypoints[:1])
+            if len(faces) == 0:
+                results[i]["error"] = "No face detected in image"
+                continue
+            crops.append(faces[0])
+            detected.append(i)
+            detected_boxes.append(boxes * uploads[i].scale)
+
+        if crops:
+            with self._recognizer_lock, stage_timer("embed"):
+                new_embeddings = self.embedding_extractor.extract_embeddings_batch(np.stack(crops))
+            if new_embeddings is None:
+                stage_error("embed")
+                for i in detected:
+                    results[i]["error"] = "Failed to extract embedding"
+                detected = []
+            else:
+                for i, boxes, embedding in zip(detected, detected_boxes, new_embeddings):
+                    self.embedding_cache.put(uploads[i].data, boxes, embedding[None])
+                    cached_embeddings[i] = embedding
+
+        enrolled = sorted(cached_embeddings)
+        embeddings = [cached_embeddings[i] for i in enrolled]
+
+        face_ids = {i: str(uuid.uuid4()) for i in enrolled}
+
+        def save_image(i):
+            try:
+                return uploads[i].save_original(self.script_dir)
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            urls = list(executor.map(save_image, enrolled))
+
+        points = []
+        current_time = datetime.now().isoformat()
+        for i, embedding, url in zip(enrolled, embeddings, urls):
+            if url is None:
+                results[i]["error"] = "Failed to save image"
+                continue
+            face_id = face_ids[i]
+            points.append((i, PointStruct(
+                id=face_id,
+                vector=embedding.tolist(),
+                payload={
+                    "person_name": items[i]["person_name"],
+                    "face_id": face_id,
+                    "image_url": url,
+                    "code_card": items[i]["code_card"],
+                    "created_at": current_time,
+                    "updated_at": current_time,
+                    "updated_ts": time.time()
+                }
+            )))
+
+        stored = []
+        for start in range(0, len(points), upsert_batch_size):
+            chunk = points[start:start + upsert_batch_size]
+            try:
+                self.qdrant_client.upsert(
+                    collection_name=self.collection_name,
+                    points=[point for _, point in chunk]
+                )
+            except Exception as e:
+                logger.error(f"Error storing face batch: {e}")
+                for i, _ in chunk:
+                    results[i]["error"] = "Failed to store face"
+                continue
+
+            for i, point in chunk:
+                stored.append(i)
+                results[i].update({
+                    "success": True,
+                    "face_id": point.payload["face_id"],
+                    "person_name": point.payload["person_name"],
+                    "code_card": point.payload["code_card"],
+                    "image_path": point.payload["image_url"].replace("images/", "")
+                })
+
+        # Thumbnail chỉ cho các khuôn mặt đã upsert thành công
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda i: make_thumbnails(uploads[i].image, face_ids[i], self.script_dir), stored))
+
+        return results
+
+    @staticmethod
+    def _search_result(match: dict) -> dict:
+        return {
+            "id": match["face_id"],  # Changed from face_id to id
+            "person_name": match["person_name"],
+            "score": match["similarity_score"],  # Changed from similarity_score to score
+            "image_path": (match.get("image_url") or "").replace("images/", ""),  # Changed from image_url to image_path and remove images/ prefix
+            "code_card": match.get("code_card"),
+        }
+
     def search_face(self, image_bytes: bytes, limit: int = 5) -> List[dict]:
         """Search for similar faces"""
         embedding = self.extract_face_embedding(image_bytes)
@@ -170,95 +387,180 @@ class FaceRecognitionService:
         if embedding is None:
             raise HTTPException(status_code=400, detail="No face detected in image")
 
-        # Ensure embedding is 1D
-        if embedding.ndim > 1:
-            embedding = embedding.flatten()
+        matches = self.find_faces(embedding[None], limit)[0]
+        return [self._search_result(match) for match in matches]
+
+    def search_faces(self, image_bytes: bytes, limit: int = 5, max_faces: Optional[int] = None) -> List[dict]:
+        """
+        Search every face of a (group) photo in one Qdrant round trip
+
+        Returns:
+            One {"box": [x1, y1, x2, y2], "results": [...]} per detected face
+        """
+        faces = self.extract_faces(image_bytes, max_faces)
+        if faces is None:
+            raise HTTPException(status_code=400, detail="No face detected in image")
 
+        boxes, embeddings = faces
+        matches = self.find_faces(embeddings, limit)
+        return [{
+            "box": [round(float(v), 1) for v in box],
+            "results": [self._search_result(match) for match in face_matches],
+        } for box, face_matches in zip(boxes, matches)]
+
+    def find_faces(self, embeddings, limit: int = 1,
+                   payload_fields: Sequence[str] = ("face_id", "person_name", "image_url", "code_card")) -> List[List[dict]]:
+        """
+        Nearest gallery faces for many embeddings with one search_batch call
+
+        Args:
+            embeddings: Embeddings (N,512)
+            limit: Matches per face
+            payload_fields: Payload fields to fetch (face_id, person_name and similarity_score are always returned)
+
+        Returns:
+            One list of matches per embedding, in input order
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, 512)
+        if len(embeddings) == 0:
+            return []
+
+        fields = list(dict.fromkeys(["face_id", "person_name", *payload_fields]))
         try:
-            # Search in Qdrant
-            search_results = self.qdrant_client.search(
+            batch_results = self.qdrant_client.search_batch(
                 collection_name=self.collection_name,
-                query_vector=embedding.tolist(),
-                limit=limit
+                requests=[SearchRequest(vector=embedding.tolist(), limit=limit, with_payload=fields)
+                          for embedding in embeddings]
             )
-
-            results = []
-            for result in search_results:
-                results.append({
-                    "id": result.payload["face_id"],  # Changed from face_id to id
-                    "person_name": result.payload["person_name"],
-                    "score": result.score,  # Changed from similarity_score to score
-                    "image_path": result.payload.get("image_url", "").replace("images/", ""),  # Changed from image_url to image_path and remove images/ prefix
-                    "code_card": result.payload.get("code_card"),
-                })
-
-            return results
-
         except Exception as e:
             logger.error(f"Error searching faces: {e}")
             raise HTTPException(status_code=500, detail="Failed to search faces")
 
-    def find_face(self, embedding, limit: int = 1) -> List[dict]:
-        # Ensure embedding is 1D
-        if embedding.ndim > 1:
-            embedding = embedding.flatten()
+        return [[dict({field: result.payload.get(field) for field in fields}, similarity_score=result.score)
+                 for result in results] for results in batch_results]
 
+    def find_face(self, embedding, limit: int = 1) -> List[dict]:
+        return self.find_faces(np.asarray(embedding).reshape(1, -1), limit)[0]
+
+    @staticmethod
+    def _face_from_payload(payload: dict) -> dict:
+        return {
+            "id": payload["face_id"],  # Changed from face_id to id
+            "person_name": payload["person_name"],
+            "image_path": payload.get("image_url", "").replace("images/", ""),  # Changed from image_url to image_path and remove images/ prefix
+            # updated_ts đầy đủ (không làm tròn giây): hai lần sửa trong một giây vẫn đổi URL
+            "thumb_path": f"{payload['face_id']}?v={payload.get('updated_ts', 0)}",
+            "code_card": payload.get("code_card"),
+            "created_at": payload.get("created_at"),
+            "updated_at": payload.get("updated_at")
+        }
+
+    @staticmethod
+    def _faces_filter(person_name: Optional[str] = None, code_card: Optional[str] = None) -> Optional[Filter]:
+        """Exact-match payload filter for the face listing"""
+        conditions = []
+        if person_name:
+            conditions.append(FieldCondition(key="person_name", match=MatchValue(value=person_name)))
+        if code_card:
+            conditions.append(FieldCondition(key="code_card", match=MatchValue(value=code_card)))
+        return Filter(must=conditions) if conditions else None
+
+    @staticmethod
+    def _parse_cursor(cursor: Optional[str]):
+        if not cursor:
+            return None
+        return int(cursor) if cursor.isdigit() else cursor
+
+    async def aget_faces_page(self, cursor: Optional[str] = None, limit: int = 100, person_name: Optional[str] = None,
+                              code_card: Optional[str] = None) -> dict:
+        """
+        Get one page of stored faces
+
+        Args:
+            cursor: next_cursor returned by the previous page (Qdrant next_page_offset)
+            limit: Page size
+            person_name: Optional exact-match filter
+            code_card: Optional exact-match filter
+
+        Returns:
+            {"faces": [...], "next_cursor": str or None}
+        """
         try:
-            # Search in Qdrant
-            search_results = self.qdrant_client.search(
+            points, next_offset = await self.async_qdrant_client.scroll(
                 collection_name=self.collection_name,
-                query_vector=embedding.tolist(),
-                limit=limit
+                scroll_filter=self._faces_filter(person_name, code_card),
+                limit=limit,
+                offset=self._parse_cursor(cursor),
+                with_payload=True,
+                with_vectors=False
             )
 
-            results = []
-            for result in search_results:
-                results.append({
-                    "face_id": result.payload["face_id"],
-                    "person_name": result.payload["person_name"],
-                    "similarity_score": result.score,
-                    "image_url": result.payload.get("image_url"),
-                    "code_card": result.payload.get("code_card"),
-                })
-
-            return results
+            return {
+                "faces": [self._face_from_payload(point.payload) for point in points],
+                "next_cursor": str(next_offset) if next_offset is not None else None
+            }
 
         except Exception as e:
-            results = []
+            logger.error(f"Error getting faces page: {e}")
+            raise HTTPException(status_code=500, detail="Failed to get faces")
 
-    def get_all_faces(self) -> List[dict]:
-        """Get all stored faces"""
-        try:
-            # Scroll through all points
-            scroll_result = self.qdrant_client.scroll(
+    async def aiter_faces(self, person_name: Optional[str] = None, code_card: Optional[str] = None,
+                          page_size: int = 256):
+        """Walk the whole collection page by page (payload only), yielding one face at a time"""
+        offset = None
+        while True:
+            points, offset = await self.async_qdrant_client.scroll(
                 collection_name=self.collection_name,
-                limit=100
+                scroll_filter=self._faces_filter(person_name, code_card),
+                limit=page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
             )
+            for point in points:
+                yield self._face_from_payload(point.payload)
+            if offset is None:
+                break
+
+    async def aget_face(self, face_id: str) -> Optional[dict]:
+        """Get one stored face, None if it does not exist (async Qdrant client)"""
+        points = await self.async_qdrant_client.retrieve(
+            collection_name=self.collection_name,
+            ids=[face_id]
+        )
+        return self._face_from_payload(points[0].payload) if points else None
 
-            faces = []
-            for point in scroll_result[0]:
-                faces.append({
-                    "id": point.payload["face_id"],  # Changed from face_id to id
-                    "person_name": point.payload["person_name"],
-                    "image_path": point.payload.get("image_url", "").replace("images/", ""),  # Changed from image_url to image_path and remove images/ prefix
-                    "code_card": point.payload.get("code_card"),
-                    "created_at": point.payload.get("created_at"),
-                    "updated_at": point.payload.get("updated_at")
-                })
+    async def aget_collection_info(self):
+        return await self.async_qdrant_client.get_collection(self.collection_name)
 
-            return faces
+    def backfill_thumbnails(self) -> int:
+        """Create missing thumbnails for faces enrolled before thumbnails existed"""
+        return backfill_thumbnails(self.qdrant_client, self.collection_name, self.script_dir)
 
-        except Exception as e:
-            logger.error(f"Error getting all faces: {e}")
-            raise HTTPException(status_code=500, detail="Failed to get faces")
+    def ensure_thumbnail(self, face_id: str, size: int) -> Optional[str]:
+        """Return the thumbnail file of a face, building it from the original if missing"""
+        path = thumbnail_path(self.script_dir, size, face_id)
+        if os.path.exists(path):
+            return path
+
+        points = self.qdrant_client.retrieve(
+            collection_name=self.collection_name,
+            ids=[face_id],
+            with_payload=["image_url"]
+        )
+        if not points or not points[0].payload.get("image_url"):
+            return None
+        make_thumbnails_from_file(points[0].payload["image_url"], face_id, self.script_dir)
+        return path if os.path.exists(path) else None
 
-    def delete_face(self, face_id: str) -> dict:
-        """Delete a face from database"""
+    async def adelete_face(self, face_id: str) -> dict:
+        """Delete a face from database (async Qdrant client)"""
         try:
-            self.qdrant_client.delete(
+            await self.async_qdrant_client.delete(
                 collection_name=self.collection_name,
                 points_selector=[face_id]
             )
+            delete_thumbnails(face_id, self.script_dir)
 
             return {
                 "success": True,
@@ -295,42 +597,24 @@ class FaceRecognitionService:
             
             # Always update the updated_at timestamp
             updated_payload["updated_at"] = datetime.now().isoformat()
+            updated_payload["updated_ts"] = time.time()
             
             # If new image is provided, extract new embedding and save new image
             if image_bytes is not None:
-                embedding = self.extract_face_embedding(image_bytes)
-                
-                if embedding is None:
+                upload = self._decode(image_bytes)
+                if upload is None:
+                    raise HTTPException(status_code=400, detail="File is not a valid image")
+
+                embeddings = self._embed_upload(upload, max_faces=1)
+                if embeddings is None or len(embeddings) == 0:
                     raise HTTPException(status_code=400, detail="No face detected in new image")
+                embedding = embeddings[0]
                 
-                # Ensure embedding is 1D
-                if embedding.ndim > 1:
-                    embedding = embedding.flatten()
-                
-                # Save new image
-                image = Image.open(io.BytesIO(image_bytes))
-                image_array = np.array(image)
-                
-                if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-                    image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-                    
-                    # Delete old image if exists
-                    old_image_url = updated_payload.get("image_url")
-                    if old_image_url:
-                        old_image_path = os.path.join(self.script_dir, old_image_url)
-                        if os.path.exists(old_image_path):
-                            os.remove(old_image_path)
-                    
-                    # Save new image
-                    new_url = os.path.join("images", f"{uuid.uuid4()}.jpg")
-                    new_url_save = os.path.join(self.script_dir, new_url)
-                    
-                    if not os.path.exists(os.path.dirname(new_url_save)):
-                        os.makedirs(os.path.dirname(new_url_save))
-                    
-                    cv2.imwrite(new_url_save, image_array)
-                    updated_payload["image_url"] = new_url
-                
+                old_image_url = updated_payload.get("image_url")
+
+                # Save new image (original bytes, không encode lại)
+                updated_payload["image_url"] = upload.save_original(self.script_dir)
+
                 # Update with new embedding and payload
                 self.qdrant_client.upsert(
                     collection_name=self.collection_name,
@@ -342,6 +626,13 @@ class FaceRecognitionService:
                         )
                     ]
                 )
+
+                # Chỉ thay thumbnail / xóa ảnh cũ khi Qdrant đã nhận ảnh mới
+                make_thumbnails(upload.image, face_id, self.script_dir)
+                if old_image_url:
+                    old_image_path = os.path.join(self.script_dir, old_image_url)
+                    if os.path.exists(old_image_path):
+                        os.remove(old_image_path)
             else:
                 # Update only payload (keep existing embedding)
                 self.qdrant_client.set_payload(
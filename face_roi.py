@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+
+
+def roi_polygon(roi):
+    """
+    Normalize an ROI setting to a polygon (N,2) float32 in frame coordinates
+
+    Accepts a polygon [[x, y], ...] (>= 3 points) or a rectangle [x1, y1, x2, y2].
+
+    Returns:
+        Polygon array or None if roi is empty
+    """
+    if roi is None or len(roi) == 0:
+        return None
+    points = np.asarray(roi, dtype=np.float32)
+    if points.ndim == 1 and len(points) == 4:
+        x1, y1, x2, y2 = points
+        points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32)
+    points = points.reshape(-1, 2)
+    if len(points) < 3:
+        raise ValueError(f"ROI needs a rectangle [x1, y1, x2, y2] or at least 3 points, got {roi}")
+    return points
+
+
+class FaceDetectionRoi:
+    """
+    Region of interest of a face camera.
+
+    The detector only sees the bounding rectangle of the ROI (letterboxed by
+    the detector to ``detect_size``, or to the model's own input size), so
+    faces at the gate get more pixels at a lower cost. Detections are mapped
+    back to full-frame coordinates and those whose center falls outside the
+    polygon are dropped.
+    """
+
+    def __init__(self, roi, detect_size=None):
+        self.polygon = roi_polygon(roi)
+        # Chỉ dùng được với model hỗ trợ input động; None = kích thước mặc định của model
+        self.detect_size = detect_size
+        self._is_rect = self.polygon is not None and len(self.polygon) == 4 and \
+            len(np.unique(self.polygon[:, 0])) == 2 and len(np.unique(self.polygon[:, 1])) == 2
+
+    @classmethod
+    def from_options(cls, options):
+        """Build from a camera's options dict ({"roi": ..., "detect_size": 320}); None when no ROI is set"""
+        if options.get("roi") is None and options.get("detect_size") is None:
+            return None
+        return cls(options.get("roi"), options.get("detect_size"))
+
+    def crop(self, frame):
+        """
+        Returns:
+            (view of the ROI bounding rectangle, (x0, y0) offset in the frame)
+        """
+        if self.polygon is None:
+            return frame, (0, 0)
+        height, width = frame.shape[:2]
+        x0, y0 = np.clip(np.floor(self.polygon.min(axis=0)).astype(int), 0, [width, height])
+        x1, y1 = np.clip(np.ceil(self.polygon.max(axis=0)).astype(int), 0, [width, height])
+        if x1 <= x0 or y1 <= y0:
+            return frame, (0, 0)
+        return frame[y0:y1, x0:x1], (int(x0), int(y0))
+
+    def to_frame(self, boxes, scores, keypoints, offset):
+        """Shift detections from crop to frame coordinates and drop faces centered outside the polygon"""
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        keypoints = np.array(keypoints, dtype=np.float32).reshape(len(boxes), -1, 2)
+        scores = np.asarray(scores, dtype=np.float32)
+        boxes[:, [0, 2]] += offset[0]
+        boxes[:, [1, 3]] += offset[1]
+        keypoints += np.asarray(offset, dtype=np.float32)
+
+        if self.polygon is not None and not self._is_rect and len(boxes):
+            contour = self.polygon.reshape(-1, 1, 2)
+            centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+            inside = np.array([cv2.pointPolygonTest(contour, (float(x), float(y)), False) >= 0 for x, y in centers],
+                              dtype=bool)
+            boxes, scores, keypoints = boxes[inside], scores[inside], keypoints[inside]
+        return boxes, scores, keypoints
@@ -0,0 +1,183 @@
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Pairwise IoU between two sets of xyxy boxes
+
+    Returns:
+        IoU matrix (len(boxes_a), len(boxes_b))
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def face_quality(boxes, scores):
+    """Detection score weighted by the short side of the box (bigger, sharper faces embed better)"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    short_side = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    return np.asarray(scores, dtype=np.float32).reshape(-1) * np.clip(short_side, 0, None)
+
+
+class Track:
+    def __init__(self, track_id, box, score):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.score = float(score)
+        self.hits = 1
+        self.misses = 0
+
+        # Cache danh tính của track
+        self.identity = None
+        self.embedding = None
+        self.quality = 0.0
+        self.frames_since_embed = 0
+        self.embedded = False
+
+    def predict(self):
+        """Constant-velocity prediction of the box in the next frame"""
+        return self.box + self.velocity
+
+    def update(self, box, score):
+        box = np.asarray(box, dtype=np.float32)
+        # Làm mượt vận tốc (alpha-beta filter)
+        self.velocity = 0.5 * self.velocity + 0.5 * (box - self.box)
+        self.box = box
+        self.score = float(score)
+        self.hits += 1
+        self.misses = 0
+
+    def reset_identity(self):
+        """Forget the cached identity, so the next frame embeds the track again"""
+        self.identity = None
+        self.embedding = None
+        self.quality = 0.0
+        self.embedded = False
+
+
+class FaceTracker:
+    """
+    Lightweight IoU tracker over the YOLO face boxes with a per-track identity cache.
+
+    A track is (re-)embedded only when it is new, when the face quality
+    improves noticeably over the best embedded frame, or every
+    ``reembed_interval`` frames; otherwise the cached identity is reused.
+    The cache is dropped when the association is uncertain (match IoU below
+    ``trust_iou``, or the detection overlaps another track), since crossing
+    faces can swap track ids. ``is_fresh`` tells whether the identity was
+    computed on the current frame; only such identities may open the barrier.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=15, reembed_interval=30, quality_gain=1.2, trust_iou=0.5):
+        self.iou_threshold = iou_threshold
+        self.trust_iou = trust_iou
+        self.max_misses = max_misses
+        self.reembed_interval = reembed_interval
+        self.quality_gain = quality_gain
+        self.tracks = {}
+        self._next_id = 0
+
+        # Thống kê số lần embed / dùng lại cache
+        self.embed_count = 0
+        self.cache_hits = 0
+        self.identity_resets = 0
+
+    def update(self, boxes, scores):
+        """
+        Associate detections of the current frame with existing tracks
+
+        Args:
+            boxes: Detection boxes (N,4) xyxy
+            scores: Detection scores (N,)
+
+        Returns:
+            List of track ids, one per detection
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        track_ids = [None] * len(boxes)
+        tracks = list(self.tracks.values())
+
+        if tracks and len(boxes):
+            predicted = np.stack([track.predict() for track in tracks])
+            iou = box_iou(predicted, boxes)
+
+            # Ghép tham lam theo IoU giảm dần
+            pairs = np.argwhere(iou >= self.iou_threshold)
+            pairs = pairs[np.argsort(-iou[pairs[:, 0], pairs[:, 1]], kind='stable')]
+            used_tracks, used_detections = set(), set()
+            for t, d in pairs:
+                if t in used_tracks or d in used_detections:
+                    continue
+                used_tracks.add(t)
+                used_detections.add(d)
+                tracks[t].update(boxes[d], scores[d])
+                track_ids[d] = tracks[t].track_id
+                # Ghép không chắc chắn (hai người đi cắt nhau): không tin danh tính cache của track
+                overlapping = (iou[:, d] >= self.iou_threshold).sum() > 1 or (iou[t] >= self.iou_threshold).sum() > 1
+                if tracks[t].embedded and (iou[t, d] < self.trust_iou or overlapping):
+                    tracks[t].reset_identity()
+                    self.identity_resets += 1
+
+        matched = set(track_ids)
+        for track in tracks:
+            if track.track_id not in matched:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    del self.tracks[track.track_id]
+
+        for d, track_id in enumerate(track_ids):
+            if track_id is None:
+                track = Track(self._next_id, boxes[d], scores[d])
+                self._next_id += 1
+                self.tracks[track.track_id] = track
+                track_ids[d] = track.track_id
+
+        for track_id in track_ids:
+            self.tracks[track_id].frames_since_embed += 1
+
+        return track_ids
+
+    def needs_embedding(self, track_id, quality):
+        """Decide whether a track has to go through ArcFace and the gallery search again"""
+        track = self.tracks[track_id]
+        if (not track.embedded
+                or track.frames_since_embed >= self.reembed_interval
+                or quality > track.quality * self.quality_gain):
+            return True
+
+        self.cache_hits += 1
+        return False
+
+    def set_identity(self, track_id, identity, quality, embedding=None):
+        """Store the search result of a freshly embedded track"""
+        track = self.tracks.get(track_id)
+        if track is None:
+            return
+        track.identity = identity
+        track.embedding = embedding
+        track.quality = float(quality)
+        track.frames_since_embed = 0
+        track.embedded = True
+        self.embed_count += 1
+
+    def is_fresh(self, track_id):
+        """True when the track's identity was computed on the current frame"""
+        track = self.tracks.get(track_id)
+        return track is not None and track.embedded and track.frames_since_embed == 0
+
+    def get_identity(self, track_id):
+        track = self.tracks.get(track_id)
+        return track.identity if track is not None else None
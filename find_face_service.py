@@ -1,21 +1,10 @@
 # main.py
-import os
-import warnings
+from gallery_index import GalleryIndex
 
-from fastapi import HTTPException
-from ultralytics import YOLO
-
-from align_face import extract_faces_with_alignment
-from check_platform import PlatformEnum, get_os_name
-from face_embedding import SimpleEmbeddingExtractor
-
-
-import cv2
 import numpy as np
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-import uuid
-from typing import List, Optional
+from qdrant_client.models import Distance, VectorParams, SearchRequest
+from typing import List, Sequence
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +24,10 @@ class FaceRecognitionService:
         # Create collection if not exists
         self._create_collection()
 
+        # In-memory gallery, refreshed from Qdrant in the background
+        self.gallery_index = GalleryIndex(self.qdrant_client, self.collection_name)
+        self.gallery_index.start()
+
     def _create_collection(self):
         """Create Qdrant collection for face embeddings"""
         try:
@@ -54,32 +47,40 @@ class FaceRecognitionService:
             logger.error(f"Error creating collection: {e}")
             raise e
 
-    def find_face(self, embedding, limit: int = 1) -> List[dict]:
-        # Ensure embedding is 1D
-        if embedding.ndim > 1:
-            embedding = embedding.flatten()
+    def find_faces(self, embeddings, limit: int = 1,
+                   payload_fields: Sequence[str] = ("face_id", "person_name", "code_card")) -> List[List[dict]]:
+        """
+        Match many face embeddings at once
+
+        Uses the in-memory gallery when it is loaded, otherwise one Qdrant
+        search_batch call that only fetches ``payload_fields``.
 
+        Returns:
+            One list of matches per embedding ([] for every face on error)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, 512)
+        if len(embeddings) == 0:
+            return []
+
+        if self.gallery_index.ready:
+            return self.gallery_index.search_batch(embeddings, limit, payload_fields)
+
+        fields = list(dict.fromkeys(["face_id", "person_name", *payload_fields]))
         try:
-            # Search in Qdrant
-            search_results = self.qdrant_client.search(
+            batch_results = self.qdrant_client.search_batch(
                 collection_name=self.collection_name,
-                query_vector=embedding.tolist(),
-                limit=limit
+                requests=[SearchRequest(vector=embedding.tolist(), limit=limit, with_payload=fields)
+                          for embedding in embeddings]
             )
-
-            results = []
-            for result in search_results:
-                results.append({
-                    "face_id": result.payload["face_id"],
-                    "person_name": result.payload["person_name"],
-                    "similarity_score": result.score,
-                    "code_card": result.payload.get("code_card"),
-                })
-
-            return results
+            return [[dict({field: result.payload.get(field) for field in fields}, similarity_score=result.score)
+                     for result in results] for results in batch_results]
 
         except Exception as e:
-            results = []
+            logger.error(f"Error finding faces: {e}")
+            return [[] for _ in embeddings]
+
+    def find_face(self, embedding, limit: int = 1) -> List[dict]:
+        return self.find_faces(np.asarray(embedding).reshape(1, -1), limit)[0]
 
 
 find_face_service = FaceRecognitionService()
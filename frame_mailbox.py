@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class LatestFrameMailbox:
+    """
+    Single-slot "latest frame" hand-off between the RTSP reader thread and the inference loop.
+
+    ``put`` always overwrites the slot (the consumer only cares about the
+    newest frame) and counts frames that were overwritten before being read.
+    ``get`` blocks on a condition variable until a frame newer than the last
+    one read arrives, so the consumer neither polls nor sleeps.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._read_seq = 0
+        self._closed = False
+
+        # Thống kê
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame, timestamp=None):
+        """Publish a frame with its capture timestamp, replacing any unread frame"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._cond:
+            if self._seq != self._read_seq:
+                self.dropped += 1
+            self._frame = frame
+            self._timestamp = timestamp
+            self._seq += 1
+            self.received += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for a frame newer than the last one returned
+
+        Returns:
+            (frame, capture_timestamp, sequence) or None on timeout / close
+        """
+        with self._cond:
+            ready = self._cond.wait_for(lambda: self._seq != self._read_seq or self._closed, timeout)
+            if not ready or self._seq == self._read_seq:
+                return None
+            self._read_seq = self._seq
+            frame, self._frame = self._frame, None
+            return frame, self._timestamp, self._seq
+
+    def close(self):
+        """Wake up a blocked consumer; subsequent get() calls return None"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
@@ -0,0 +1,288 @@
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from qdrant_client.models import FieldCondition, Filter, Range
+
+from quantized_store import QuantizedEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+# Các trường payload được giữ trong bộ nhớ cùng với ma trận embedding
+PAYLOAD_FIELDS = ("face_id", "person_name", "code_card", "image_url")
+
+
+class GalleryIndex:
+    """
+    In-memory copy of the Qdrant face gallery for the camera processes.
+
+    Embeddings are kept L2-normalized in one QuantizedEmbeddingStore so a
+    query is a single matmul instead of an HTTP round trip. ``quantization``
+    ("float32", "float16" or "int8", env FACE_GALLERY_QUANTIZATION) trades
+    memory for precision on edge boxes; ``rescore`` (env FACE_GALLERY_RESCORE)
+    re-scores the best candidates in float32, kept in memory or memory-mapped
+    from ``rescore_path`` (env FACE_GALLERY_RESCORE_PATH; each process writes
+    its own ``<root>.<pid>.npy`` next to it). Qdrant stays the
+    source of truth: a background thread pulls points whose ``updated_ts`` is
+    at or after the newest ``updated_ts`` already synced (the writer's clock,
+    never the local one), and reconciles the id set as soon as Qdrant holds
+    fewer points than the index, so a deleted face stops matching within one
+    refresh interval.
+    """
+
+    def __init__(self, qdrant_client, collection_name, refresh_interval=2.0,
+                 reconcile_interval=30.0, page_size=1000, dim=512,
+                 quantization=None, rescore=None, rescore_path=None):
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.page_size = page_size
+        self.dim = dim
+        self.quantization = quantization or os.environ.get("FACE_GALLERY_QUANTIZATION", "float32")
+        self.rescore = rescore if rescore is not None else os.environ.get("FACE_GALLERY_RESCORE", "1") == "1"
+        self.rescore_path = rescore_path or os.environ.get("FACE_GALLERY_RESCORE_PATH") or None
+        self.stats = {}
+
+        # Snapshot bất biến: (ids, store, payloads) - thay thế nguyên khối khi cập nhật
+        self._snapshot = ([], self._new_store(np.zeros((0, dim), dtype=np.float32)),
+                          {k: np.array([], dtype=object) for k in PAYLOAD_FIELDS})
+        self._row_of = {}
+        self._lock = threading.Lock()
+        # Con trỏ sync: updated_ts lớn nhất đã đồng bộ và các id mang đúng giá trị đó
+        self._since = 0.0
+        self._since_ids = set()
+        self._last_reconcile = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.ready = False
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    def start(self):
+        """Load the full gallery and start the background refresh thread"""
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"Error loading gallery index: {e}")
+
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _scroll(self, scroll_filter=None, with_vectors=True, with_payload=True):
+        offset = None
+        while True:
+            points, offset = self.qdrant_client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=self.page_size,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=with_vectors
+            )
+            yield from points
+            if offset is None:
+                break
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _advance_cursor(self, points):
+        """Move the sync cursor to the newest updated_ts among (point_id, payload) pairs (lock held)"""
+        for point_id, payload in points:
+            updated_ts = payload.get("updated_ts")
+            if updated_ts is None or updated_ts < self._since:
+                continue
+            if updated_ts > self._since:
+                self._since, self._since_ids = updated_ts, set()
+            self._since_ids.add(point_id)
+
+    def _new_store(self, matrix):
+        return QuantizedEmbeddingStore(matrix, dtype=self.quantization, rescore=self.rescore,
+                                       rescore_path=self.rescore_path, dim=self.dim)
+
+    def _build(self, ids, vectors, payloads):
+        matrix = np.ascontiguousarray(self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)))
+        if payloads is None:
+            columns = {k: np.full(len(ids), None, dtype=object) for k in PAYLOAD_FIELDS}
+        else:
+            columns = {k: np.array([p.get(k) for p in payloads], dtype=object) for k in PAYLOAD_FIELDS}
+        store = self._new_store(matrix)
+        self._measure(store, matrix)
+        return (list(ids), store, columns), {point_id: row for row, point_id in enumerate(ids)}
+
+    def _measure(self, store, matrix, num_queries=64, k=10):
+        """Record memory use and recall@k against exact search, using perturbed gallery vectors as queries"""
+        self.stats = store.memory_report()
+        if self.quantization == "float32" or len(matrix) == 0:
+            return
+        rng = np.random.default_rng(0)
+        queries = matrix[rng.choice(len(matrix), size=min(num_queries, len(matrix)), replace=False)]
+        queries = self._normalize(queries + rng.normal(0, 0.02, queries.shape).astype(np.float32))
+        self.stats[f"recall@{k}"] = round(store.recall(matrix, queries, k), 4)
+        logger.info(f"Gallery store {self.quantization}: {self.stats['resident_bytes'] / 1e6:.1f} MB "
+                    f"(saves {self.stats['saved_bytes'] / 1e6:.1f} MB), recall@{k} {self.stats[f'recall@{k}']}")
+
+    def load(self, ids, vectors, payloads=None):
+        """Replace the index contents with given vectors, without Qdrant (offline use and benchmarks)"""
+        snapshot, row_of = self._build(ids, vectors, payloads)
+        with self._lock:
+            self._snapshot, self._row_of = snapshot, row_of
+            self.ready = True
+
+    def reload(self):
+        """Rebuild the whole index from Qdrant"""
+        started_at = time.time()
+        ids, vectors, payloads = [], [], []
+        for point in self._scroll():
+            ids.append(str(point.id))
+            vectors.append(point.vector)
+            payloads.append(point.payload or {})
+
+        snapshot, row_of = self._build(ids, vectors, payloads)
+        with self._lock:
+            self._snapshot, self._row_of = snapshot, row_of
+            self._since, self._since_ids = 0.0, set()
+            self._advance_cursor(zip(ids, payloads))
+            self._last_reconcile = started_at
+            self.ready = True
+        logger.info(f"Gallery index loaded: {len(ids)} faces in {time.time() - started_at:.2f}s")
+
+    def refresh(self):
+        """Pull points created or edited since the last sync"""
+        # gte: điểm ghi cùng updated_ts với con trỏ sau lần sync trước vẫn được lấy, điểm đã có thì bỏ qua
+        since, since_ids = self._since, self._since_ids
+        scroll_filter = Filter(must=[FieldCondition(key="updated_ts", range=Range(gte=since))])
+        changed = [point for point in self._scroll(scroll_filter=scroll_filter)
+                   if not ((point.payload or {}).get("updated_ts") == since and str(point.id) in since_ids)]
+
+        with self._lock:
+            if not changed:
+                return 0
+            self._advance_cursor((str(point.id), point.payload or {}) for point in changed)
+
+            ids, store, columns = self._snapshot
+            ids = list(ids)
+            payloads = {k: list(v) for k, v in columns.items()}
+            new_rows = []
+            updates = []
+            for point in changed:
+                point_id = str(point.id)
+                vector = np.asarray(point.vector, dtype=np.float32).reshape(1, self.dim)
+                payload = point.payload or {}
+                row = self._row_of.get(point_id)
+                if row is None:
+                    ids.append(point_id)
+                    new_rows.append(vector)
+                    for k in PAYLOAD_FIELDS:
+                        payloads[k].append(payload.get(k))
+                else:
+                    updates.append((row, vector))
+                    for k in PAYLOAD_FIELDS:
+                        payloads[k][row] = payload.get(k)
+
+            if updates:
+                rows = np.array([row for row, _ in updates])
+                store = store.updated(rows, self._normalize(np.vstack([vector for _, vector in updates])))
+            if new_rows:
+                store = store.appended(self._normalize(np.vstack(new_rows)))
+
+            self.stats.update(store.memory_report())
+            self._snapshot = (ids, store, {k: np.array(v, dtype=object) for k, v in payloads.items()})
+            self._row_of = {point_id: row for row, point_id in enumerate(ids)}
+
+        return len(changed)
+
+    def needs_reconcile(self):
+        """
+        True when Qdrant holds fewer points than the index, i.e. a face was deleted
+
+        Right after ``refresh`` every live point is in the index, so any
+        deletion shows up as a smaller count; a point added after the refresh
+        can hide it for one interval only.
+        """
+        live = self.qdrant_client.count(collection_name=self.collection_name, exact=True).count
+        return live < len(self._snapshot[0])
+
+    def reconcile(self):
+        """Drop faces that were deleted from Qdrant"""
+        # Chỉ xét các điểm đã có trước khi quét, tránh xóa nhầm điểm vừa được refresh thêm vào
+        known_ids = set(self._snapshot[0])
+        live_ids = {str(point.id) for point in self._scroll(with_vectors=False, with_payload=False)}
+
+        with self._lock:
+            self._last_reconcile = time.time()
+            ids, store, columns = self._snapshot
+            keep = np.array([point_id in live_ids or point_id not in known_ids for point_id in ids], dtype=bool)
+            if keep.all():
+                return 0
+
+            kept_ids = [point_id for point_id, k in zip(ids, keep) if k]
+            store = store.subset(keep)
+            self.stats.update(store.memory_report())
+            self._snapshot = (kept_ids, store, {k: v[keep] for k, v in columns.items()})
+            self._row_of = {point_id: row for row, point_id in enumerate(kept_ids)}
+            return int((~keep).sum())
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                if not self.ready:
+                    self.reload()
+                    continue
+                self.refresh()
+                # Người bị xóa không được mở barrier: so số lượng mỗi lần refresh, quét id đầy đủ định kỳ
+                if self.needs_reconcile() or time.time() - self._last_reconcile > self.reconcile_interval:
+                    removed = self.reconcile()
+                    if removed:
+                        logger.info(f"Gallery index removed {removed} deleted faces")
+            except Exception as e:
+                logger.error(f"Error refreshing gallery index: {e}")
+
+    def search(self, embedding, limit: int = 1) -> Optional[List[dict]]:
+        """
+        Find the closest faces to an embedding
+
+        Args:
+            embedding: Query embedding (512,) or (1,512)
+            limit: Number of results
+
+        Returns:
+            List of matches in the same format as the Qdrant path of find_face
+        """
+        return self.search_batch(np.asarray(embedding).reshape(1, -1), limit)[0]
+
+    def search_batch(self, embeddings, limit: int = 1, payload_fields=PAYLOAD_FIELDS) -> List[List[dict]]:
+        """
+        Find the closest faces for many embeddings with one matmul
+
+        Args:
+            embeddings: Query embeddings (N,512)
+            limit: Number of results per query
+            payload_fields: Payload fields to include in each match
+
+        Returns:
+            One list of matches per embedding
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        ids, store, columns = self._snapshot
+        if len(ids) == 0:
+            return [[] for _ in queries]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        rows, scores = store.search_batch(queries / norms, limit)
+
+        fields = [k for k in PAYLOAD_FIELDS if k in payload_fields or k in ("face_id", "person_name")]
+        return [[dict({k: columns[k][row] for k in fields}, similarity_score=float(score))
+                 for row, score in zip(top, top_scores)] for top, top_scores in zip(rows, scores)]
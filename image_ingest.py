@@ -0,0 +1,184 @@
+import io
+import os
+import uuid
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from align_face import align_faces_batch
+
+# Cạnh dài tối thiểu cần cho detector (imgsz của YOLO)
+DETECT_SIZE = 640
+# Cạnh ngắn tối thiểu của khuôn mặt (px) để align trực tiếp trên ảnh đã thu nhỏ
+MIN_ALIGN_FACE = 112
+# Lề quanh box khi cắt vùng full-resolution
+CROP_MARGIN = 0.5
+# Ảnh upload thường có mặt nhỏ (ảnh toàn thân, ảnh nhóm): decode full-size một lần thay vì decode lại khi align
+FULL_DECODE = os.environ.get("FACE_UPLOAD_FULL_DECODE", "0") == "1"
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"BM", ".bmp"),
+    (b"GIF8", ".gif"),
+    (b"II*\x00", ".tif"),
+    (b"MM\x00*", ".tif"),
+)
+
+
+def image_extension(data: bytes) -> str:
+    """File extension matching the encoded image format (".jpg" if unknown)"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in _SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return ".jpg"
+
+
+def header_size(data: bytes):
+    """(width, height) read from the image header without decoding pixels, or None"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def reduction_for(width, height, min_side=DETECT_SIZE):
+    """Largest IMREAD_REDUCED factor that keeps the long side >= min_side (1 = full decode)"""
+    long_side = max(width, height)
+    for factor, _ in _REDUCED_FLAGS:
+        if long_side // factor >= min_side:
+            return factor
+    return 1
+
+
+class UploadedImage:
+    """
+    An uploaded image and its decoded pixels.
+
+    ``image`` is a BGR array decoded at reduced resolution when the header
+    shows it is larger than the detector needs (JPEG is downscaled during
+    decoding); ``scale`` maps its coordinates back to the original. The
+    original bytes are kept so they can be stored without re-encoding.
+
+    A reduced upload is decoded a second time, at full size, only when a
+    face is smaller than MIN_ALIGN_FACE px in it (``align``). Set
+    FACE_UPLOAD_FULL_DECODE=1 when small faces are the norm to decode every
+    upload once at full size instead.
+    """
+
+    def __init__(self, data, image, scale, extension):
+        self.data = data
+        self.image = image
+        self.scale = scale
+        self.extension = extension
+
+    def full_resolution_crops(self, boxes, margin=CROP_MARGIN):
+        """
+        Decode the original at full resolution and keep only the regions around the boxes
+
+        Args:
+            boxes: Boxes (N,4) xyxy in ``image`` coordinates
+
+        Returns:
+            List of (crop, (x0, y0)) in original coordinates
+        """
+        full = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if full is None:
+            return None
+
+        height, width = full.shape[:2]
+        crops = []
+        for x1, y1, x2, y2 in np.asarray(boxes, dtype=np.float32) * self.scale:
+            pad_x, pad_y = (x2 - x1) * margin, (y2 - y1) * margin
+            x0, y0 = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+            crop_x1, crop_y1 = min(width, int(np.ceil(x2 + pad_x))), min(height, int(np.ceil(y2 + pad_y)))
+            crops.append((full[y0:crop_y1, x0:crop_x1].copy(), (x0, y0)))
+        return crops
+
+    def align(self, boxes, keypoints, target_size=(112, 112), min_face=MIN_ALIGN_FACE):
+        """
+        Align faces detected on ``image``
+
+        Faces large enough in the reduced image are aligned from it directly;
+        smaller faces are aligned from full-resolution crops around them.
+
+        Returns:
+            (aligned, indices): aligned faces (M,height,width,3) and their rows
+            in boxes / keypoints, as from align_faces_batch
+        """
+        keypoints = np.asarray(keypoints, dtype=np.float32)
+        aligned, indices = align_faces_batch(self.image, keypoints, target_size)
+        if self.scale == 1 or len(indices) == 0:
+            return aligned, indices
+
+        boxes = np.asarray(boxes, dtype=np.float32)[indices]
+        small = np.flatnonzero(np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) < min_face)
+        if len(small) == 0:
+            return aligned, indices
+
+        crops = self.full_resolution_crops(boxes[small])
+        if crops is None:
+            return aligned, indices
+        for row, (crop, offset) in zip(small, crops):
+            points = keypoints[indices[row]:indices[row] + 1, :5] * self.scale - np.asarray(offset, dtype=np.float32)
+            faces, _ = align_faces_batch(crop, points, target_size)
+            if len(faces):
+                aligned[row] = faces[0]
+        return aligned, indices
+
+    def save_original(self, script_dir):
+        """
+        Write the uploaded bytes unchanged under images/
+
+        Returns:
+            Relative url ("images/<uuid><ext>")
+        """
+        url = os.path.join("images", f"{uuid.uuid4()}{self.extension}")
+        url_save = os.path.join(script_dir, url)
+        os.makedirs(os.path.dirname(url_save), exist_ok=True)
+        with open(url_save, "wb") as f:
+            f.write(self.data)
+        return url
+
+
+def decode_upload(data: bytes, min_side=DETECT_SIZE, full=None) -> "UploadedImage":
+    """
+    Decode uploaded image bytes at the smallest resolution still sufficient for detection
+
+    Args:
+        full: Decode at full size (default FACE_UPLOAD_FULL_DECODE), so small
+              faces never need the second decode in UploadedImage.align
+
+    Returns:
+        UploadedImage or None if the bytes are not a decodable image
+    """
+    if not data:
+        return None
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    size = header_size(data)
+    full = FULL_DECODE if full is None else full
+    factor = reduction_for(*size, min_side=min_side) if size and not full else 1
+
+    image = None
+    if factor > 1:
+        image = cv2.imdecode(buffer, dict(_REDUCED_FLAGS)[factor])
+    if image is None:
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        factor = 1
+    if image is None:
+        return None
+
+    # Tỉ lệ thực tế (làm tròn khi chia, ảnh có thể bị xoay theo EXIF)
+    scale = max(size) / max(image.shape[:2]) if factor > 1 else 1
+    return UploadedImage(data, image, scale, image_extension(data))
@@ -0,0 +1,297 @@
+import itertools
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from check_platform import get_os_name, PlatformEnum
+from startup_report import StartupTimer
+from thread_budget import apply_in_child
+
+# Các loại request camera gửi lên inference server
+OP_DETECT = "detect"
+OP_EMBED = "embed"
+OP_RELEASE = "release"
+# Segment mà camera đã bỏ sau timeout nhưng chưa unlink (server có thể vẫn đang đọc)
+MAX_RETIRED_SEGMENTS = 4
+
+
+def drain_queue(response_queue):
+    """Drop replies left on a slot's response queue, so its next owner cannot read them"""
+    while True:
+        try:
+            response_queue.get_nowait()
+        except queue.Empty:
+            break
+
+
+def run_inference_server(request_queue, response_queues, max_batch=8, max_wait_ms=5):
+    """Function to run the shared inference server in a separate process"""
+    apply_in_child()
+    server = InferenceServer(request_queue, response_queues, max_batch, max_wait_ms)
+    server.serve_forever()
+
+
+class InferenceServer:
+    """
+    Single detector + recognizer shared by all face camera processes.
+
+    Cameras write frames / aligned crops into their own shared-memory slots
+    and send a small request through ``request_queue``. The server gathers
+    requests from several cameras until ``max_batch`` is reached or the
+    oldest request has waited ``max_wait_ms``, runs each operation as one
+    batch and answers on the camera's response queue.
+
+    Segments are read in place (the camera waits for the reply, or retires
+    the segment if it gives up). When a slot sends a new segment name for an
+    operation, the previous attachment of that slot is closed after the
+    batch, so restarted or crashed cameras do not leave mappings behind.
+    """
+
+    def __init__(self, request_queue, response_queues, max_batch=8, max_wait_ms=5):
+        self.request_queue = request_queue
+        self.response_queues = response_queues
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.startup = StartupTimer("Inference server")
+        self.platform = get_os_name()
+        self.startup.mark("platform")
+        self.stopped = False
+
+        self.script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.path_model_detect_face = os.path.join(self.script_dir, "weight/yolov8n-face.onnx")
+        self.path_model_recognition = os.path.join(self.script_dir, "weight/w600k_r50.onnx")
+        if self.platform != PlatformEnum.UBUNTU:
+            self.path_model_detect_face = os.path.join(self.script_dir, "weight/yolov8n-face_rknn_model_640")
+            self.path_model_recognition = os.path.join(self.script_dir, "weight/w600k_r50.rknn")
+
+        self.yolo_model = None
+        self.embedding_extractor = None
+        self._segments = {}
+        # (slot, op) -> tên segment đang dùng; attachment cũ được đóng sau batch
+        self._slot_segments = {}
+        self._stale = []
+
+        # Thống kê kích thước batch
+        self.batches = 0
+        self.requests = 0
+
+    def _load_models(self):
+        from face_detector import load_face_detector
+        from face_embedding import SimpleEmbeddingExtractor
+
+        self.yolo_model = load_face_detector(self.platform, self.path_model_detect_face)
+        self.embedding_extractor = SimpleEmbeddingExtractor(self.platform, self.path_model_recognition)
+        self.startup.mark("models")
+        self.startup.report()
+
+    def _view(self, request):
+        """Map a camera's shared-memory slot, caching the attachment by name"""
+        op, slot, _, shm_name, shape, _ = request
+        segment = self._segments.get(shm_name)
+        if segment is None:
+            segment = shared_memory.SharedMemory(name=shm_name, create=False)
+            self._segments[shm_name] = segment
+        previous = self._slot_segments.get((slot, op))
+        if previous != shm_name:
+            if previous is not None:
+                self._stale.append(previous)
+            self._slot_segments[(slot, op)] = shm_name
+        return np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+
+    def _release(self, shm_name):
+        segment = self._segments.pop(shm_name, None)
+        if segment is not None:
+            try:
+                segment.close()
+            except BufferError:
+                # Còn view đang dùng: giữ lại, đóng ở batch sau
+                self._segments[shm_name] = segment
+                return False
+        return True
+
+    def _release_stale(self):
+        stale, self._stale = self._stale, []
+        for shm_name in stale:
+            if shm_name not in self._slot_segments.values() and not self._release(shm_name):
+                self._stale.append(shm_name)
+
+    def _collect(self):
+        """Block for one request, then gather more until the batch or latency budget is used up"""
+        batch = [self.request_queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.request_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _respond(self, request, payload):
+        _, slot, request_id, _, _, _ = request
+        self.response_queues[slot].put((request_id, payload))
+
+    def _run_detect(self, requests):
+        from align_face import detect_faces_batch
+
+        # Mỗi imgsz (detect_size của ROI camera) chạy thành một batch riêng, 0 = mặc định của model
+        def imgsz_of(request):
+            return request[5] or 0
+
+        for imgsz, group in itertools.groupby(sorted(requests, key=imgsz_of), key=imgsz_of):
+            group = list(group)
+            # Camera đang chờ phản hồi nên có thể đọc thẳng từ shared memory, không cần copy
+            frames = [self._view(request) for request in group]
+            detections = detect_faces_batch(frames, self.yolo_model, batch_size=self.max_batch, imgsz=imgsz or None)
+            for request, detection in zip(group, detections):
+                self._respond(request, detection)
+
+    def _run_embed(self, requests):
+        crops = [self._view(request) for request in requests]
+        counts = [len(c) for c in crops]
+        embeddings = self.embedding_extractor.extract_embeddings_batch(np.concatenate(crops)) if sum(counts) else None
+
+        start = 0
+        for request, count in zip(requests, counts):
+            self._respond(request, None if embeddings is None else embeddings[start:start + count])
+            start += count
+
+    def serve_forever(self):
+        self._load_models()
+        while not self.stopped:
+            batch = self._collect()
+            self.batches += 1
+            self.requests += len(batch)
+
+            for op, requests in itertools.groupby(sorted(batch, key=lambda r: r[0]), key=lambda r: r[0]):
+                requests = list(requests)
+                try:
+                    if op == OP_DETECT:
+                        self._run_detect(requests)
+                    elif op == OP_EMBED:
+                        self._run_embed(requests)
+                    elif op == OP_RELEASE:
+                        for request in requests:
+                            self._release(request[3])
+                except Exception as e:
+                    print(f"[Inference server] Error running {op} batch: {e}")
+                    for request in requests:
+                        if op != OP_RELEASE:
+                            self._respond(request, None)
+            self._release_stale()
+
+
+class InferenceClient:
+    """
+    Camera-side handle to the shared inference server.
+
+    Owns two shared-memory slots (full frame and aligned crops) that grow
+    when a larger input arrives; requests are synchronous from the camera's
+    point of view. Request ids carry the pid, so replies meant for a previous
+    process on the same slot are never matched; a segment whose request
+    timed out is retired instead of being overwritten while the server may
+    still read it.
+    """
+
+    def __init__(self, id_camera, slot, request_queue, response_queue, timeout=5.0):
+        self.id_camera = id_camera
+        self.slot = slot
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.timeout = timeout
+        self._pid = os.getpid()
+        self._request_ids = itertools.count()
+        self._segments = {}
+        self._retired = []
+        self._generation = 0
+        # Slot có thể vừa thuộc về process camera trước (restart): bỏ các phản hồi còn sót
+        drain_queue(response_queue)
+
+    def _segment(self, kind, nbytes):
+        """Return a shared-memory slot of at least nbytes, recreating it under a new name if too small"""
+        segment = self._segments.get(kind)
+        if segment is not None and segment.size >= nbytes:
+            return segment
+        if segment is not None:
+            self.request_queue.put((OP_RELEASE, self.slot, None, segment.name, None, None))
+            segment.close()
+            segment.unlink()
+
+        self._generation += 1
+        name = f"infer_{self.slot}_{kind}_{os.getpid()}_{self._generation}"
+        segment = shared_memory.SharedMemory(name=name, create=True, size=max(nbytes, 1))
+        self._segments[kind] = segment
+        return segment
+
+    def _retire(self, kind):
+        """
+        Stop writing to a segment whose request is still queued on the server
+
+        The next call gets a fresh segment; the old one is released after the
+        pending request (requests of one camera are handled in order) and
+        unlinked once MAX_RETIRED_SEGMENTS newer ones have been retired.
+        """
+        segment = self._segments.pop(kind, None)
+        if segment is None:
+            return
+        self.request_queue.put((OP_RELEASE, self.slot, None, segment.name, None, None))
+        self._retired.append(segment)
+        while len(self._retired) > MAX_RETIRED_SEGMENTS:
+            self._unlink(self._retired.pop(0))
+
+    @staticmethod
+    def _unlink(segment):
+        try:
+            segment.close()
+            segment.unlink()
+        except Exception:
+            pass
+
+    def _call(self, op, kind, array, imgsz=None):
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        segment = self._segment(kind, array.nbytes)
+        np.copyto(np.ndarray(array.shape, dtype=np.uint8, buffer=segment.buf), array)
+
+        request_id = (self._pid, next(self._request_ids))
+        self.request_queue.put((op, self.slot, request_id, segment.name, array.shape, imgsz))
+        while True:
+            try:
+                response_id, payload = self.response_queue.get(timeout=self.timeout)
+            except queue.Empty:
+                # Server bận hoặc đang restart: bỏ frame, phản hồi trễ sẽ bị bỏ qua ở lần gọi sau
+                print(f"[Camera {self.id_camera}] Inference server did not answer {op} within {self.timeout}s")
+                self._retire(kind)
+                return None
+            # Bỏ qua các phản hồi trễ của request cũ
+            if response_id == request_id:
+                return payload
+
+    def detect(self, frame, imgsz=None):
+        """
+        Args:
+            imgsz: Letterbox size for detectors with a dynamic input (the ROI detect_size)
+
+        Returns:
+            (boxes, scores, keypoints) as from align_face.detect_faces, or None on server error / timeout
+        """
+        return self._call(OP_DETECT, "frame", frame, imgsz)
+
+    def embed(self, aligned_faces):
+        """
+        Returns:
+            L2-normalized embeddings (N,512), or None on server error / timeout
+        """
+        if len(aligned_faces) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+        return self._call(OP_EMBED, "faces", aligned_faces)
+
+    def close(self):
+        for segment in list(self._segments.values()) + self._retired:
+            self._unlink(segment)
+        self._segments = {}
+        self._retired = []
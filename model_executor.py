@@ -0,0 +1,50 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+class ModelExecutor:
+    """
+    Runs CPU-bound model work (decode, YOLO, ArcFace, blocking Qdrant writes) off the event loop.
+
+    At most ``max_workers`` jobs run at once on a dedicated thread pool and
+    at most ``max_queue`` more may wait; further requests are rejected with
+    503 instead of piling up. Both limits can be set with the
+    FACE_MODEL_WORKERS / FACE_MODEL_QUEUE environment variables.
+    """
+
+    def __init__(self, max_workers=None, max_queue=None):
+        self.max_workers = max_workers or int(os.environ.get("FACE_MODEL_WORKERS", 2))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get("FACE_MODEL_QUEUE", 16))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model")
+        self._pending = 0
+
+    @property
+    def in_flight(self):
+        return self._pending
+
+    @property
+    def queue_depth(self):
+        """Jobs waiting for a free worker"""
+        return max(0, self._pending - self.max_workers)
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the model pool and await its result"""
+        if self._pending >= self.max_workers + self.max_queue:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry later")
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+model_executor = ModelExecutor()
@@ -0,0 +1,114 @@
+import time
+
+import cv2
+import numpy as np
+
+from face_roi import roi_polygon
+
+
+class MotionGate:
+    """
+    Cheap scene-change pre-filter in front of the face detector.
+
+    Each frame is reduced to a small blurred grayscale image (for NV12
+    frames the Y plane is used directly, no color conversion) and compared
+    with a running-average background. The detector only runs when enough
+    pixels inside the region of interest changed, for ``hold`` seconds after
+    a change, when the caller forces it (faces were visible in the previous
+    frame) and at least every ``keep_alive`` seconds.
+
+    ``sensitivity`` in [0, 1]: higher reacts to smaller / fainter changes.
+    """
+
+    def __init__(self, roi=None, sensitivity=0.5, keep_alive=2.0, hold=1.0, width=160, alpha=0.05, nv12=False):
+        self.roi = roi_polygon(roi)
+        self.sensitivity = float(np.clip(sensitivity, 0.0, 1.0))
+        self.keep_alive = keep_alive
+        self.hold = hold
+        self.width = width
+        self.alpha = alpha
+        self.nv12 = nv12
+
+        # Ngưỡng điểm ảnh và tỉ lệ diện tích thay đổi, suy ra từ sensitivity
+        self.pixel_threshold = int(10 + (1.0 - self.sensitivity) * 40)
+        self.min_changed = 0.001 + (1.0 - self.sensitivity) * 0.02
+
+        self._background = None
+        self._mask = None
+        self._mask_pixels = 0
+        self._last_run = 0.0
+        self._last_motion = 0.0
+
+        # Thống kê
+        self.processed = 0
+        self.skipped = 0
+        self.changed_fraction = 0.0
+
+    @classmethod
+    def from_options(cls, options, nv12=False):
+        """
+        Build from a camera's options dict
+
+        {"motion": {"sensitivity": ..., "keep_alive": ...}, "roi": [[x, y], ...] or [x1, y1, x2, y2]};
+        {"motion": False} disables the gate (returns None).
+        """
+        motion = options.get("motion", {})
+        if motion is False:
+            return None
+        motion = dict(motion) if isinstance(motion, dict) else {}
+        motion.setdefault("roi", options.get("roi"))
+        return cls(nv12=nv12, **motion)
+
+    def _small_gray(self, frame):
+        if frame.ndim == 2:
+            # NV12: mặt phẳng Y là 2/3 số dòng đầu tiên
+            gray = frame[:frame.shape[0] * 2 // 3] if self.nv12 else frame
+        else:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape[:2]
+        small = cv2.resize(gray, (self.width, max(1, round(height * self.width / width))), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0), (width, height)
+
+    def _build_mask(self, small_shape, frame_size):
+        if self.roi is None:
+            self._mask = None
+            self._mask_pixels = small_shape[0] * small_shape[1]
+            return
+        scale = np.array([small_shape[1] / frame_size[0], small_shape[0] / frame_size[1]], dtype=np.float32)
+        self._mask = np.zeros(small_shape, dtype=np.uint8)
+        cv2.fillPoly(self._mask, [np.round(self.roi * scale).astype(np.int32)], 255)
+        self._mask_pixels = max(1, cv2.countNonZero(self._mask))
+
+    def should_process(self, frame, force=False, now=None):
+        """
+        Update the background with this frame and decide whether to run the detector
+
+        Args:
+            frame: BGR frame, or NV12 / grayscale single-channel frame
+            force: Run regardless of motion (e.g. faces are being tracked)
+        """
+        now = time.time() if now is None else now
+        small, frame_size = self._small_gray(frame)
+
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.astype(np.float32)
+            self._build_mask(small.shape, frame_size)
+            self.changed_fraction = 1.0
+        else:
+            diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+            _, changed = cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+            if self._mask is not None:
+                changed = cv2.bitwise_and(changed, self._mask)
+            self.changed_fraction = cv2.countNonZero(changed) / self._mask_pixels
+            cv2.accumulateWeighted(small, self._background, self.alpha)
+
+        if self.changed_fraction >= self.min_changed:
+            self._last_motion = now
+
+        run = (force or now - self._last_motion <= self.hold or now - self._last_run >= self.keep_alive)
+        if run:
+            self._last_run = now
+            self.processed += 1
+        else:
+            self.skipped += 1
+        return run
@@ -1,17 +1,18 @@
 import logging
 import os
-import queue
+import signal
 import threading
 import time
-from multiprocessing import shared_memory
 
 import cv2
-import numpy as np
-import requests
-from ultralytics import YOLO
 
 from check_platform import get_os_name, PlatformEnum
-from shapely.geometry import Polygon, box as shapely_box
+from frame_mailbox import LatestFrameMailbox
+from parking_dispatcher import ParkingDispatcher
+from shared_frame import SharedFrameWriter
+from startup_report import StartupTimer
+from thread_budget import current_threads
+from zone_mask import DetectionZone
 
 # Giảm mức log của httpx xuống WARNING
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -19,17 +20,26 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 def run_vehicle_processing(id_camera, rtsp, shared_mem_name, lane, url_parking, data):
     """Function to run face processing in a separate process"""
-    face_processor = OneProcessVehicle(id_camera, rtsp, shared_mem_name, lane, url_parking, data)
+    # data: danh sách điểm polygon, hoặc {"polygon": [...], "min_overlap": 0.3}
+    options = data if isinstance(data, dict) else {"polygon": data}
+    face_processor = OneProcessVehicle(id_camera, rtsp, shared_mem_name, lane, url_parking, options.get("polygon", []),
+                                       options.get("min_overlap", 0.1))
+    signal.signal(signal.SIGTERM, lambda signum, frame: face_processor.stop())
     face_processor.process_face()
 
 
 class OneProcessVehicle:
-    def __init__(self, id_camera, rtsp, shared_mem_name=None, lane="left", url_parking=None, polygon_detect=[]):
+    def __init__(self, id_camera, rtsp, shared_mem_name=None, lane="left", url_parking=None, polygon_detect=[],
+                 min_overlap=0.1):
         self.id_camera = id_camera
+        self.startup = StartupTimer(f"Camera {id_camera}")
         self.platform = get_os_name()
+        self.startup.mark("platform")
         self.lane = lane  # Thêm lane vào constructor
         self.url_parking = url_parking
         self.polygon_detect = polygon_detect
+        # Vùng phát hiện được biên dịch một lần: mask raster + bảng tổng tích lũy
+        self.zone = DetectionZone(polygon_detect, min_overlap)
 
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.path_model_detect_vehicle = os.path.join(self.script_dir, "weight/yolov8n.onnx")
@@ -48,119 +58,116 @@ class OneProcessVehicle:
         self.frame_size = self.frame_width * self.frame_height * self.frame_channels
 
         # Initialize these in process_face() to avoid pickle issues
-        self.frame_queue = None
+        self.frame_mailbox = None
         self.yolo_model = None
         self.embedding_extractor = None
+        self.dispatcher = None
+
+        # Thống kê pipeline
+        self.frames_processed = 0
+        # Số thread được launcher cấp (thread_budget), 0 = không giới hạn
+        self.threads = current_threads()
+        self.latency_ms = 0.0
 
     def _setup_shared_memory(self):
         """Tạo shared memory cho việc chia sẻ frame"""
         if self.shared_mem_name:
-            try:
-                # Tạo shared memory
-                self.shared_mem = shared_memory.SharedMemory(
-                    name=self.shared_mem_name,
-                    create=True,
-                    size=self.frame_size
-                )
-                print(f"[Camera {self.id_camera}] Shared memory created: {self.shared_mem_name}")
-            except FileExistsError:
-                # Nếu đã tồn tại, kết nối với shared memory hiện có
-                self.shared_mem = shared_memory.SharedMemory(
-                    name=self.shared_mem_name,
-                    create=False
-                )
-                print(f"[Camera {self.id_camera}] Connected to existing shared memory: {self.shared_mem_name}")
+            self.shared_mem = SharedFrameWriter(self.shared_mem_name, self.frame_width, self.frame_height,
+                                                self.frame_channels)
+            print(f"[Camera {self.id_camera}] Shared memory created: {self.shared_mem_name}")
 
     def _cleanup_shared_memory(self):
         """Dọn dẹp shared memory"""
         if self.shared_mem:
             try:
                 self.shared_mem.close()
-                self.shared_mem.unlink()
                 print(f"[Camera {self.id_camera}] Shared memory cleaned up")
             except:
                 pass
 
-    def _write_frame_to_shared_memory(self, frame):
+    def _write_frame_to_shared_memory(self, frame, captured_at=None, **stats):
         """Ghi frame vào shared memory"""
         if self.shared_mem is None:
             return
 
         try:
-            # Resize frame về kích thước cố định
-            resized_frame = cv2.resize(frame, (self.frame_width, self.frame_height))
-
-            # Chuyển đổi sang numpy array và ghi vào shared memory
-            frame_array = np.array(resized_frame, dtype=np.uint8)
-            np.copyto(np.ndarray(
-                (self.frame_height, self.frame_width, self.frame_channels),
-                dtype=np.uint8,
-                buffer=self.shared_mem.buf
-            ), frame_array)
+            self.shared_mem.write(frame, captured_at, latency_ms=self.latency_ms,
+                                  frames_dropped=self.frame_mailbox.dropped,
+                                  frames_processed=self.frames_processed, threads=self.threads, **stats)
         except Exception as e:
             print(f"[Camera {self.id_camera}] Error writing to shared memory: {e}")
+        if not self.startup.reported:
+            self.startup.mark("first frame")
+            self.startup.report()
+
+    def _record_latency(self, captured_at):
+        """Update capture-to-decision latency stats (exponential moving average)"""
+        latency_ms = (time.time() - captured_at) * 1000
+        self.latency_ms = latency_ms if self.frames_processed == 0 else 0.9 * self.latency_ms + 0.1 * latency_ms
+        self.frames_processed += 1
 
     def process_face(self):
 
         # Initialize objects that can't be pickled
-        self.frame_queue = queue.Queue(maxsize=1)
+        self.frame_mailbox = LatestFrameMailbox()
         # Setup shared memory
         self._setup_shared_memory()
         print("[Camera {self.id_camera}] Shared memory setup complete")
+        self.startup.mark("shared memory")
 
         try:
-            self.yolo_model = YOLO(self.path_model_detect_vehicle, task='detect')
-
+            # Kết nối RTSP song song với việc import ultralytics và load model
             thread = threading.Thread(target=self.read_frames, daemon=True)
             thread.start()
+
+            from ultralytics import YOLO
+            self.yolo_model = YOLO(self.path_model_detect_vehicle, task='detect')
+            self.startup.mark("models")
+            self.dispatcher = ParkingDispatcher(self.url_parking, self.id_camera).start()
+
             start_time = time.time()
 
             while not self.stopped:
-                if not self.frame_queue.empty():
-                    frame = self.frame_queue.get_nowait()
-                    if self.platform != PlatformEnum.UBUNTU:
-                        frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_NV12)
-                        # Run YOLO inference on the frame
-                    results = self.yolo_model(frame, verbose=False, classes=[2], conf=0.6, iou=0.1)
-
-                    # draw the polygon area for detection
-                    cv2.polylines(frame, [np.array(self.polygon_detect, np.int32)], isClosed=True,
-                                  color=(255, 0, 0),
-                                  thickness=2)
-
-                    for result in results:
-                        boxes = result.boxes.numpy()
-                        for b in boxes:
-                            x1, y1, x2, y2 = map(int, b.xyxy[0])
-
-                            bbox_polygon = shapely_box(x1, y1, x2, y2)
-                            intersection = Polygon(self.polygon_detect).intersection(bbox_polygon)
-                            intersection_area = intersection.area
-                            if intersection_area == 0:
-                                # draw bounding box red
-                                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                            else:
-                                cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
-                                if time.time() - start_time > 10:
-                                    start_time = time.time()
-                                    print("Intersection area:", intersection_area)
-                                    try:
-
-                                        result = requests.post(f"{self.url_parking}/barrier/open",
-                                                               json={"io_pin": 3})
-
-                                    except Exception as e:
-                                        print(f"[Camera {self.id_camera}] Error sending data: {e}")
-                    # Write frame to shared memory for GUI display
-                    self._write_frame_to_shared_memory(frame)
-
-                time.sleep(0.01)
+                item = self.frame_mailbox.get(timeout=0.5)
+                if item is None:
+                    continue
+                frame, captured_at, _ = item
+                if self.platform != PlatformEnum.UBUNTU:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_NV12)
+                    # Run YOLO inference on the frame
+                results = self.yolo_model(frame, verbose=False, classes=[2], conf=0.6, iou=0.1)
+
+                # draw the polygon area for detection
+                self.zone.draw(frame)
+
+                for result in results:
+                    boxes = result.boxes.xyxy.cpu().numpy()
+                    # Tỉ lệ diện tích nằm trong vùng cho tất cả box trong một lần tra bảng
+                    in_zone, fractions = self.zone.in_zone(boxes, frame.shape)
+                    for (x1, y1, x2, y2), inside, fraction in zip(boxes.astype(int), in_zone, fractions):
+                        if not inside:
+                            # draw bounding box red
+                            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+                        else:
+                            cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
+                            if time.time() - start_time > 10:
+                                start_time = time.time()
+                                print(f"Overlap with detection zone: {fraction:.2f}")
+                                self.dispatcher.submit("/barrier/open", {"io_pin": 3}, dedup_key="barrier")
+
+                # Độ trễ từ lúc capture đến lúc ra quyết định
+                self._record_latency(captured_at)
+
+                # Write frame to shared memory for GUI display
+                self._write_frame_to_shared_memory(frame, captured_at)
 
         except Exception as e:
             print(f"[Camera {self.id_camera}] Error in process_face: {e}")
             import traceback
             traceback.print_exc()
         finally:
+            if self.dispatcher is not None:
+                self.dispatcher.stop()
             self._cleanup_shared_memory()
             # cv2.destroyAllWindows()
 
@@ -178,6 +185,7 @@ class OneProcessVehicle:
         if not cap.isOpened():
             print(f"[Camera {self.id_camera}] Không thể kết nối RTSP: {self.rtsp}")
             self.stopped = True
+            self.frame_mailbox.close()
             return
 
         print(f"[Camera {self.id_camera}] RTSP connected successfully")
@@ -185,15 +193,7 @@ class OneProcessVehicle:
         while not self.stopped:
             ret, frame = cap.read()
             if ret:
-                if self.frame_queue.full():
-                    try:
-                        self.frame_queue.get_nowait()
-                    except queue.Empty:
-                        pass
-                try:
-                    self.frame_queue.put_nowait(frame)
-                except queue.Full:
-                    pass
+                self.frame_mailbox.put(frame, time.time())
             else:
                 print(f"[Camera {self.id_camera}] Failed to read frame")
                 time.sleep(0.1)
@@ -204,6 +204,8 @@ class OneProcessVehicle:
     def stop(self):
         """Stop the face processing"""
         self.stopped = True
+        if self.frame_mailbox is not None:
+            self.frame_mailbox.close()
 
 
 if __name__ == "__main__":
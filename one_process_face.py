@@ -1,33 +1,51 @@
 import os
-import queue
+import signal
 import threading
 import time
 import cv2
 import numpy as np
-from multiprocessing import shared_memory
 
-import requests
-from ultralytics import YOLO
-
-from align_face import extract_faces_with_alignment, draw_keypoints_and_boxes
+from align_face import align_faces_batch, detect_faces, draw_detections
 from check_platform import get_os_name, PlatformEnum
+from frame_mailbox import LatestFrameMailbox
+from face_detector import load_face_detector
 from face_embedding import SimpleEmbeddingExtractor
+from face_roi import FaceDetectionRoi
+from face_tracker import FaceTracker, face_quality
+from inference_server import InferenceClient
+from motion_gate import MotionGate
+from parking_dispatcher import ParkingDispatcher
+from shared_frame import SharedFrameWriter
+from startup_report import StartupTimer
+from thread_budget import current_threads
 import logging
 
 # Giảm mức log của httpx xuống WARNING
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
-def run_face_processing(id_camera, rtsp, shared_mem_name, lane,url_parking, data):
+def run_face_processing(id_camera, rtsp, shared_mem_name, lane,url_parking, data, inference=None):
     """Function to run face processing in a separate process"""
-    face_processor = OneProcessFace(id_camera, rtsp, shared_mem_name, lane,url_parking)
+    options = data if isinstance(data, dict) else {}
+    face_processor = OneProcessFace(id_camera, rtsp, shared_mem_name, lane,url_parking, inference, options)
+    # Dừng vòng lặp khi bị terminate thay vì chết giữa lúc đang ghi vào queue dùng chung của inference server
+    signal.signal(signal.SIGTERM, lambda signum, frame: face_processor.stop())
     face_processor.process_face()
 
 
 class OneProcessFace:
-    def __init__(self, id_camera, rtsp, shared_mem_name=None, lane="left",url_parking=None):
+    def __init__(self, id_camera, rtsp, shared_mem_name=None, lane="left",url_parking=None, inference=None,
+                 options=None):
         self.id_camera = id_camera
+        self.startup = StartupTimer(f"Camera {id_camera}")
+        # Tùy chọn riêng của camera (data trong cấu hình), ví dụ
+        # {"roi": [[x, y], ...] hoặc [x1, y1, x2, y2], "detect_size": 320, "motion": {"sensitivity": 0.7}}
+        self.options = options or {}
+        # (slot, request_queue, response_queue) của inference server dùng chung, None = tự load model
+        self.inference = inference
+        self.inference_client = None
         self.platform = get_os_name()
+        self.startup.mark("platform")
         self.lane = lane  # Thêm lane vào constructor
         self.url_parking = url_parking
 
@@ -50,141 +68,270 @@ class OneProcessFace:
         self.frame_size = self.frame_width * self.frame_height * self.frame_channels
 
         # Initialize these in process_face() to avoid pickle issues
-        self.frame_queue = None
+        self.frame_mailbox = None
         self.yolo_model = None
         self.embedding_extractor = None
+        self.tracker = None
+        self.dispatcher = None
+        self.motion_gate = None
+        self.roi = FaceDetectionRoi.from_options(self.options)
+        # find_face_service (Qdrant + gallery) nạp ở thread nền, không chặn frame đầu tiên
+        self.matcher = None
+        self._matcher_loader = None
+        self._matcher_retry_at = 0.0
+
+        # Thống kê pipeline
+        self.frames_processed = 0
+        # Số thread được launcher cấp (thread_budget), 0 = không giới hạn
+        self.threads = current_threads()
+        self.latency_ms = 0.0
+
+        # Khuôn mặt vừa được bãi xe xác thực, cập nhật từ thread dispatcher
+        self.id_current = None
+        self.current_time = time.time()
 
     def _setup_shared_memory(self):
         """Tạo shared memory cho việc chia sẻ frame"""
         if self.shared_mem_name:
-            try:
-                # Tạo shared memory
-                self.shared_mem = shared_memory.SharedMemory(
-                    name=self.shared_mem_name,
-                    create=True,
-                    size=self.frame_size
-                )
-                print(f"[Camera {self.id_camera}] Shared memory created: {self.shared_mem_name}")
-            except FileExistsError:
-                # Nếu đã tồn tại, kết nối với shared memory hiện có
-                self.shared_mem = shared_memory.SharedMemory(
-                    name=self.shared_mem_name,
-                    create=False
-                )
-                print(f"[Camera {self.id_camera}] Connected to existing shared memory: {self.shared_mem_name}")
+            self.shared_mem = SharedFrameWriter(self.shared_mem_name, self.frame_width, self.frame_height,
+                                                self.frame_channels)
+            print(f"[Camera {self.id_camera}] Shared memory created: {self.shared_mem_name}")
 
     def _cleanup_shared_memory(self):
         """Dọn dẹp shared memory"""
         if self.shared_mem:
             try:
                 self.shared_mem.close()
-                self.shared_mem.unlink()
                 print(f"[Camera {self.id_camera}] Shared memory cleaned up")
             except:
                 pass
 
-    def _write_frame_to_shared_memory(self, frame):
+    def _write_frame_to_shared_memory(self, frame, captured_at=None, **stats):
         """Ghi frame vào shared memory"""
         if self.shared_mem is None:
             return
 
         try:
-            # Resize frame về kích thước cố định
-            resized_frame = cv2.resize(frame, (self.frame_width, self.frame_height))
-
-            # Chuyển đổi sang numpy array và ghi vào shared memory
-            frame_array = np.array(resized_frame, dtype=np.uint8)
-            np.copyto(np.ndarray(
-                (self.frame_height, self.frame_width, self.frame_channels),
-                dtype=np.uint8,
-                buffer=self.shared_mem.buf
-            ), frame_array)
+            self.shared_mem.write(frame, captured_at, latency_ms=self.latency_ms,
+                                  frames_dropped=self.frame_mailbox.dropped,
+                                  frames_processed=self.frames_processed, threads=self.threads,
+                                  frames_skipped=self.motion_gate.skipped if self.motion_gate else 0, **stats)
         except Exception as e:
             print(f"[Camera {self.id_camera}] Error writing to shared memory: {e}")
+        if not self.startup.reported:
+            self.startup.mark("first frame")
+            self.startup.report()
+
+    def _record_latency(self, captured_at):
+        """Update capture-to-decision latency stats (exponential moving average)"""
+        latency_ms = (time.time() - captured_at) * 1000
+        self.latency_ms = latency_ms if self.frames_processed == 0 else 0.9 * self.latency_ms + 0.1 * latency_ms
+        self.frames_processed += 1
+
+    @staticmethod
+    def _tick_fps(count, start_time, fps):
+        """Count a frame; every second publish the count as the FPS"""
+        count += 1
+        if time.time() - start_time > 1:
+            return 0, time.time(), count
+        return count, start_time, fps
+
+    def _should_dispatch(self, data):
+        """True when a search result would open the barrier (confident match not just acknowledged)"""
+        if not data or data[0]['similarity_score'] <= 0.5:
+            return False
+        return not (self.id_current == data[0]['face_id'] and time.time() - self.current_time < 5)
+
+    def _authentication_callback(self, face_id):
+        """Build the dispatcher callback that records an acknowledged authentication"""
+        def callback(result, error):
+            if error is None and result is True:
+                self.id_current = face_id
+                self.current_time = time.time()
+        return callback
+
+    def _detect(self, frame):
+        """
+        Detect faces (inside the ROI if set) locally or through the shared inference server
+
+        Returns:
+            (boxes, scores, keypoints), or None when the inference server failed or timed out
+        """
+        image, offset = self.roi.crop(frame) if self.roi is not None else (frame, (0, 0))
+        imgsz = self.roi.detect_size if self.roi is not None else None
+        if self.inference_client is not None:
+            detections = self.inference_client.detect(image, imgsz)
+            if detections is None:
+                return None
+        else:
+            boxes, scores, keypoints, _ = detect_faces(image, self.yolo_model, imgsz=imgsz)
+            detections = boxes, scores, keypoints
+        if self.roi is None:
+            return detections
+        # Toạ độ keypoint về lại frame gốc để align_face cắt trên ảnh đầy đủ
+        return self.roi.to_frame(*detections, offset)
+
+    def _load_matcher(self):
+        try:
+            from find_face_service import find_face_service
+            self.matcher = find_face_service
+        except Exception as e:
+            # Ví dụ Qdrant chưa sẵn sàng lúc khởi động: thử lại ở lần tìm sau
+            print(f"[Camera {self.id_camera}] Error loading face matcher: {e}")
+            self._matcher_retry_at = time.time() + 10
+
+    def _start_matcher_loader(self):
+        self._matcher_loader = threading.Thread(target=self._load_matcher, daemon=True)
+        self._matcher_loader.start()
+
+    def _find_faces(self, embeddings):
+        """
+        Match embeddings against the gallery, waiting for the background load on first use
+
+        Returns:
+            One match list per embedding, or None while the matcher is unavailable
+        """
+        if self.matcher is None and not self._matcher_retry_at:
+            self._matcher_loader.join()
+        if self.matcher is None:
+            # Lần thử lại chạy nền, vòng lặp camera không chờ
+            if time.time() >= self._matcher_retry_at and not self._matcher_loader.is_alive():
+                self._start_matcher_loader()
+            print(f"[Camera {self.id_camera}] Face matcher unavailable, faces not matched")
+            return None
+        return self.matcher.find_faces(embeddings)
+
+    def _embed(self, aligned_faces):
+        """Embed aligned faces locally or through the shared inference server"""
+        if self.inference_client is not None:
+            return self.inference_client.embed(aligned_faces)
+        return self.embedding_extractor.extract_embeddings_batch(aligned_faces)
 
     def process_face(self):
-        from find_face_service import find_face_service
+        self._start_matcher_loader()
 
         # Initialize objects that can't be pickled
-        self.frame_queue = queue.Queue(maxsize=1)
+        self.frame_mailbox = LatestFrameMailbox()
         # Setup shared memory
         self._setup_shared_memory()
+        self.startup.mark("shared memory")
 
         try:
-            self.yolo_model = YOLO(self.path_model_detect_face, task='pose')
+            if self.inference is not None:
+                slot, request_queue, response_queue = self.inference
+                self.inference_client = InferenceClient(self.id_camera, slot, request_queue, response_queue)
+            else:
+                # ultralytics chỉ được import khi camera tự chạy detector
+                self.yolo_model = load_face_detector(self.platform, self.path_model_detect_face)
 
-            self.embedding_extractor = SimpleEmbeddingExtractor(self.platform, self.path_model_recognition)
+                self.embedding_extractor = SimpleEmbeddingExtractor(self.platform, self.path_model_recognition)
+            self.startup.mark("models")
+            self.tracker = FaceTracker()
+            self.dispatcher = ParkingDispatcher(self.url_parking, self.id_camera).start()
+            self.motion_gate = MotionGate.from_options(self.options, nv12=self.platform != PlatformEnum.UBUNTU)
 
             thread = threading.Thread(target=self.read_frames, daemon=True)
             thread.start()
             count = 0
             start_time = time.time()
             temp = 0
-            id_current = None
-            current_time = time.time()
+            track_ids = []
+            idle_preview_at = 0.0
 
             while not self.stopped:
-                if not self.frame_queue.empty():
-                    frame = self.frame_queue.get_nowait()
-                    if self.platform != PlatformEnum.UBUNTU:
-                        frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_NV12)
-
-                    # # Face recognition processing
-                    aligned_faces, results = extract_faces_with_alignment(frame, self.yolo_model)
-                    for i, aligned_face in enumerate(aligned_faces):
-                        embedding = self.embedding_extractor.extract_embedding_from_aligned_face(aligned_face)
-                        if embedding is not None:
-                            data = find_face_service.find_face(embedding)
-                            if len(data) > 0:
-                                similarity = data[0]['similarity_score']
-                                face_id = data[0]['face_id']
-                                code_card = data[0]['code_card']
-                                # percentage = (similarity + 1) / 2 * 100  # chuẩn hóa từ [-1,1] về [0,100]
-                                if similarity > 0.5:
-                                    print(data)
-                                    if id_current == face_id and time.time() - current_time < 5:
-                                        continue
-                                    data_send = {
-                                        "code_card": code_card,
-                                        "lane": self.lane,
-
-                                    }
-                                    try:
-
-                                        result = requests.post(f"{self.url_parking}/parking/authentication",
-                                                               json=data_send)
-                                        if result.json() is True:
-                                            id_current = face_id
-                                            current_time = time.time()
-                                    except Exception as e:
-                                        print(f"[Camera {self.id_camera}] Error sending data: {e}")
-                                    # id_current = face_id
-                                    # current_time = time.time()
-                                    # requests.get("http://192.168.103.97:8090/3")
-
-                    # # Draw keypoints and boxes
-                    count += 1
-                    if time.time() - start_time > 1:
-                        # print(f"[Camera {self.id_camera}] Processed {count} frames in the last second")
-                        count = 0
-                        start_time = time.time()
-                        temp = count
-
-                    # draw temp frames per second
-
-                    cv2.putText(frame, f"FPS: {temp}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                    draw_keypoints_and_boxes(frame, results)
-
-                    # Write frame to shared memory for GUI display
-                    self._write_frame_to_shared_memory(frame)
-
-                time.sleep(0.01)
+                item = self.frame_mailbox.get(timeout=0.5)
+                if item is None:
+                    continue
+                frame, captured_at, _ = item
+
+                # Cảnh không đổi (và không có khuôn mặt đang theo dõi): bỏ qua YOLO, preview tối đa 5 FPS
+                if self.motion_gate is not None and not self.motion_gate.should_process(frame, force=len(track_ids) > 0):
+                    count, start_time, temp = self._tick_fps(count, start_time, temp)
+                    if self.shared_mem is not None and time.time() - idle_preview_at >= 0.2:
+                        idle_preview_at = time.time()
+                        if self.platform != PlatformEnum.UBUNTU:
+                            frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_NV12)
+                        cv2.putText(frame, f"FPS: {temp} (idle)", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 200, 255), 2)
+                        self._write_frame_to_shared_memory(frame, captured_at, fps=temp)
+                    continue
+
+                if self.platform != PlatformEnum.UBUNTU:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_NV12)
+
+                # # Face recognition processing
+                detections = self._detect(frame)
+                if detections is None:
+                    # Inference server lỗi / quá hạn: bỏ frame này, thử lại ở frame sau
+                    print(f"[Camera {self.id_camera}] Face detection failed, frame dropped")
+                    continue
+                boxes, scores, keypoints = detections
+                track_ids = self.tracker.update(boxes, scores)
+                qualities = face_quality(boxes, scores)
+
+                # Chỉ embed các track mới, chất lượng tốt hơn hoặc đã quá N frame;
+                # track có danh tính cache sắp mở barrier luôn được nhận dạng lại trên frame này
+                pending = [i for i, track_id in enumerate(track_ids)
+                           if self.tracker.needs_embedding(track_id, qualities[i])
+                           or self._should_dispatch(self.tracker.get_identity(track_id))]
+                if pending:
+                    aligned_faces, kept = align_faces_batch(frame, keypoints[pending])
+                    # Keypoint suy biến không cho ra ảnh align: không embed ảnh trống
+                    pending = [pending[j] for j in kept]
+                    embeddings = self._embed(aligned_faces)
+                    if embeddings is not None:
+                        # Một lần tìm cho tất cả khuôn mặt trong frame
+                        matches = self._find_faces(embeddings) or []
+                        for i, embedding, data in zip(pending, embeddings, matches):
+                            self.tracker.set_identity(track_ids[i], data, qualities[i], embedding)
+
+                for track_id in track_ids:
+                    # Chỉ danh tính vừa nhận dạng trên frame này mới được mở barrier, không dùng cache
+                    data = self.tracker.get_identity(track_id) if self.tracker.is_fresh(track_id) else None
+                    if data:
+                        face_id = data[0]['face_id']
+                        code_card = data[0]['code_card']
+                        # percentage = (similarity + 1) / 2 * 100  # chuẩn hóa từ [-1,1] về [0,100]
+                        if self._should_dispatch(data):
+                            print(data)
+                            data_send = {
+                                "code_card": code_card,
+                                "lane": self.lane,
+
+                            }
+                            # Gửi bất đồng bộ, kết quả xác thực trả về qua callback
+                            self.dispatcher.submit("/parking/authentication", data_send, dedup_key=face_id,
+                                                   callback=self._authentication_callback(face_id))
+                            # id_current = face_id
+                            # current_time = time.time()
+                            # requests.get("http://192.168.103.97:8090/3")
+
+                # Độ trễ từ lúc capture đến lúc ra quyết định
+                self._record_latency(captured_at)
+
+                # # Draw keypoints and boxes
+                count, start_time, temp = self._tick_fps(count, start_time, temp)
+
+                # draw temp frames per second
+
+                cv2.putText(frame, f"FPS: {temp}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                cv2.putText(frame, f"Latency: {self.latency_ms:.0f} ms", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7,
+                            (0, 255, 0), 2)
+                if self.roi is not None and self.roi.polygon is not None:
+                    cv2.polylines(frame, [self.roi.polygon.astype(np.int32)], True, (255, 0, 0), 2)
+                draw_detections(frame, boxes, keypoints)
+
+                # Write frame to shared memory for GUI display
+                self._write_frame_to_shared_memory(frame, captured_at, fps=temp)
 
         except Exception as e:
             print(f"[Camera {self.id_camera}] Error in process_face: {e}")
             import traceback
             traceback.print_exc()
         finally:
+            if self.dispatcher is not None:
+                self.dispatcher.stop()
+            if self.inference_client is not None:
+                self.inference_client.close()
             self._cleanup_shared_memory()
             # cv2.destroyAllWindows()
 
@@ -202,6 +349,7 @@ class OneProcessFace:
         if not cap.isOpened():
             print(f"[Camera {self.id_camera}] Không thể kết nối RTSP: {self.rtsp}")
             self.stopped = True
+            self.frame_mailbox.close()
             return
 
         print(f"[Camera {self.id_camera}] RTSP connected successfully")
@@ -209,15 +357,7 @@ class OneProcessFace:
         while not self.stopped:
             ret, frame = cap.read()
             if ret:
-                if self.frame_queue.full():
-                    try:
-                        self.frame_queue.get_nowait()
-                    except queue.Empty:
-                        pass
-                try:
-                    self.frame_queue.put_nowait(frame)
-                except queue.Full:
-                    pass
+                self.frame_mailbox.put(frame, time.time())
             else:
                 print(f"[Camera {self.id_camera}] Failed to read frame")
                 time.sleep(0.1)
@@ -228,6 +368,8 @@ class OneProcessFace:
     def stop(self):
         """Stop the face processing"""
         self.stopped = True
+        if self.frame_mailbox is not None:
+            self.frame_mailbox.close()
 
 
 if __name__ == "__main__":
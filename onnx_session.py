@@ -0,0 +1,126 @@
+import os
+import platform
+import time
+
+import numpy as np
+
+# Cấu hình mặc định của ONNX Runtime, ghi đè bằng biến môi trường
+OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+EXECUTION_MODES = ("sequential", "parallel")
+
+ORT_OPTIMIZATION = os.environ.get("FACE_ORT_OPTIMIZATION", "all")
+# 0 = để ONNX Runtime tự chọn (mặc định: số core vật lý)
+ORT_INTRA_THREADS = int(os.environ.get("FACE_ORT_INTRA_THREADS", "0"))
+ORT_INTER_THREADS = int(os.environ.get("FACE_ORT_INTER_THREADS", "0"))
+ORT_EXECUTION_MODE = os.environ.get("FACE_ORT_EXECUTION_MODE", "sequential")
+# Lưu model đã tối ưu ra đĩa để lần khởi động sau không phải tối ưu lại graph
+ORT_CACHE_OPTIMIZED = os.environ.get("FACE_ORT_CACHE_OPTIMIZED", "1") == "1"
+ORT_CACHE_DIR = os.environ.get("FACE_ORT_CACHE_DIR")
+
+_ORT_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(uint8)": np.uint8,
+    "tensor(int8)": np.int8,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+}
+
+
+def _optimized_model_path(ort, model_path, optimization):
+    """Cache file of the optimized graph; the name changes with the runtime version, level and CPU type"""
+    cache_dir = ORT_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(model_path)), ".ort_cache")
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{name}.{optimization}.ort{ort.__version__}.{platform.machine()}.onnx")
+
+
+def create_session(model_path, intra_op_threads=None, inter_op_threads=None, optimization=None,
+                   execution_mode=None, cache_optimized=None, providers=("CPUExecutionProvider",)):
+    """
+    Create an ONNX Runtime session with explicit session options
+
+    Arguments left as None take the FACE_ORT_* environment defaults. With
+    ``cache_optimized`` the graph optimized at ``optimization`` level is
+    written once to a cache file and later sessions load that file with
+    graph optimization disabled, so a restarted process skips the
+    optimization pass. The cache is rebuilt when the source model is newer.
+
+    Returns:
+        onnxruntime.InferenceSession
+    """
+    import onnxruntime as ort
+
+    optimization = optimization or ORT_OPTIMIZATION
+    execution_mode = execution_mode or ORT_EXECUTION_MODE
+    if optimization not in OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unsupported optimization level {optimization}, expected one of {OPTIMIZATION_LEVELS}")
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unsupported execution mode {execution_mode}, expected one of {EXECUTION_MODES}")
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = ORT_INTRA_THREADS if intra_op_threads is None else intra_op_threads
+    options.inter_op_num_threads = ORT_INTER_THREADS if inter_op_threads is None else inter_op_threads
+    options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if execution_mode == "parallel"
+                              else ort.ExecutionMode.ORT_SEQUENTIAL)
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    options.graph_optimization_level = levels[optimization]
+
+    cache_optimized = ORT_CACHE_OPTIMIZED if cache_optimized is None else cache_optimized
+    cached_path = tmp_path = None
+    if cache_optimized and optimization != "disable":
+        cached_path = _optimized_model_path(ort, model_path, optimization)
+        if os.path.exists(cached_path) and os.path.getmtime(cached_path) >= os.path.getmtime(model_path):
+            try:
+                options.graph_optimization_level = levels["disable"]
+                return ort.InferenceSession(cached_path, options, providers=list(providers))
+            except Exception as e:
+                print(f"Optimized model cache {cached_path} unusable, rebuilding: {e}")
+                options.graph_optimization_level = levels[optimization]
+        try:
+            os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            # Nhiều camera khởi động cùng lúc: mỗi process ghi file riêng rồi thay thế nguyên tử
+            tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+            options.optimized_model_filepath = tmp_path
+        except OSError:
+            tmp_path = None  # Thư mục model chỉ đọc: vẫn chạy, chỉ không cache
+
+    session = ort.InferenceSession(model_path, options, providers=list(providers))
+    if tmp_path is not None and os.path.exists(tmp_path):
+        try:
+            os.replace(tmp_path, cached_path)
+        except OSError:
+            pass
+    return session
+
+
+def warm_up(session, shapes=None, runs=1):
+    """
+    Run the session on zero inputs so the first real request does not pay
+    for memory allocation and kernel selection
+
+    Args:
+        session: onnxruntime.InferenceSession
+        shapes: {input name: shape} for inputs with symbolic dimensions
+                (unspecified symbolic dimensions become 1)
+
+    Returns:
+        Duration of the last warm-up run in ms
+    """
+    shapes = shapes or {}
+    feeds = {}
+    for tensor in session.get_inputs():
+        shape = shapes.get(tensor.name) or [dim if isinstance(dim, int) else 1 for dim in tensor.shape]
+        feeds[tensor.name] = np.zeros(shape, dtype=_ORT_DTYPES.get(tensor.type, np.float32))
+
+    elapsed_ms = 0.0
+    for _ in range(runs):
+        started = time.perf_counter()
+        session.run(None, feeds)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    return elapsed_ms
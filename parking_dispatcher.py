@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class ParkingDispatcher:
+    """
+    Background sender for parking-controller notifications of one camera process.
+
+    The inference loop only calls ``submit``; the HTTP call runs on a worker
+    thread with a pooled keep-alive session, timeouts and retries with
+    exponential backoff. Only connection failures are retried: the endpoints
+    (barrier open, authentication) are not idempotent, so a request that may
+    have reached the controller is never resent. Events with the same
+    ``dedup_key`` are dropped while one is queued or in flight, or within
+    ``dedup_window`` seconds of the last send. The controller response is
+    handed back through ``callback``.
+    """
+
+    def __init__(self, base_url, id_camera=None, max_queue=32, timeout=(1.0, 2.0),
+                 max_retries=2, backoff=0.2, dedup_window=1.0):
+        self.base_url = base_url
+        self.id_camera = id_camera
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dedup_window = dedup_window
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._pending = set()
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        # Thống kê
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.deduplicated = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        # Worker kiểm tra cờ sau mỗi lần chờ queue; sentinel chỉ để đánh thức sớm, mất khi queue đầy cũng không sao
+        self._stopped.set()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self.session.close()
+
+    def submit(self, path, payload, dedup_key=None, callback=None):
+        """
+        Queue a POST to ``base_url + path`` without blocking
+
+        Args:
+            path: Endpoint path, e.g. "/parking/authentication"
+            payload: JSON body
+            dedup_key: Events with the same key are sent at most once per window
+            callback: Called on the dispatcher thread as callback(response_json, error)
+
+        Returns:
+            True if the event was queued
+        """
+        with self._lock:
+            if dedup_key is not None:
+                if dedup_key in self._pending or time.time() - self._last_sent.get(dedup_key, 0) < self.dedup_window:
+                    self.deduplicated += 1
+                    return False
+                self._pending.add(dedup_key)
+
+        try:
+            self.queue.put_nowait((path, payload, dedup_key, callback))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(dedup_key)
+                self.dropped += 1
+            return False
+
+    @staticmethod
+    def _not_sent(error):
+        """True when the request never reached the controller, so resending it cannot open the barrier twice"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+            return False
+        # Read timeout / reset sau khi đã gửi request không retry được
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+
+    def _post(self, path, payload):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                return response.json(), None
+            except Exception as e:
+                error = e
+                if not self._not_sent(e):
+                    break
+                if attempt < self.max_retries and not self._stopped.is_set():
+                    time.sleep(self.backoff * (2 ** attempt))
+        return None, error
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+
+            path, payload, dedup_key, callback = item
+            result, error = self._post(path, payload)
+
+            with self._lock:
+                self._pending.discard(dedup_key)
+                now = time.time()
+                if dedup_key is not None:
+                    self._last_sent[dedup_key] = now
+                # Bỏ các key đã quá dedup_window để dict không tăng mãi theo số track / biển số
+                self._last_sent = {key: sent_at for key, sent_at in self._last_sent.items()
+                                   if now - sent_at < self.dedup_window}
+                if error is None:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+
+            if error is not None:
+                print(f"[Camera {self.id_camera}] Error sending data: {error}")
+
+            if callback is not None:
+                try:
+                    callback(result, error)
+                except Exception as e:
+                    print(f"[Camera {self.id_camera}] Error in dispatcher callback: {e}")
@@ -0,0 +1,314 @@
+import glob
+import os
+
+import numpy as np
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(vectors, dtype):
+    """
+    Scalar-quantize float32 vectors (N,d)
+
+    Returns:
+        (codes, scales): codes in the target dtype and per-vector scales
+        (int8 only, None otherwise) so that vectors ~= codes * scales[:, None]
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "float32":
+        return np.ascontiguousarray(vectors), None
+    raise ValueError(f"Unsupported dtype {dtype}, expected one of {DTYPES}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_path(path):
+    """
+    Per-process variant of a rescore file path: ``<root>.<pid><ext>``
+
+    Every camera process reads the same FACE_GALLERY_RESCORE_PATH, so each
+    one writes its own file. Files (and leftover temporaries) of processes
+    that no longer exist are removed.
+    """
+    root, ext = os.path.splitext(path)
+    ext = ext or ".npy"
+    for stale in glob.glob(f"{glob.escape(root)}.*"):
+        pid = stale[len(root) + 1:].split(".", 1)[0]
+        if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return f"{root}.{os.getpid()}{ext}"
+
+
+class ExactRows:
+    """
+    Float32 rows of a memory-mapped rescore file plus an in-memory overlay.
+
+    Edited and appended rows stay in the overlay, so syncing one face does
+    not rewrite the whole N x d file; ``QuantizedEmbeddingStore`` rewrites
+    the file once the overlay holds ``overlay_rows`` rows. Supports row
+    indexing with an index array and ``np.asarray``.
+    """
+
+    def __init__(self, base, patched=None, tail=None):
+        self.base = base
+        self.patched = patched or {}
+        self.tail = tail if tail is not None else np.zeros((0, base.shape[1]), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.base) + len(self.tail)
+
+    @property
+    def overlay_rows(self):
+        return len(self.patched) + len(self.tail)
+
+    @property
+    def resident_bytes(self):
+        return self.tail.nbytes + sum(vector.nbytes for vector in self.patched.values())
+
+    def __getitem__(self, rows):
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        out = np.empty((len(rows), self.base.shape[1]), dtype=np.float32)
+        in_base = rows < len(self.base)
+        out[in_base] = self.base[rows[in_base]]
+        out[~in_base] = self.tail[rows[~in_base] - len(self.base)]
+        if self.patched:
+            for j in np.flatnonzero(in_base):
+                vector = self.patched.get(int(rows[j]))
+                if vector is not None:
+                    out[j] = vector
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = np.concatenate([np.asarray(self.base, dtype=np.float32), self.tail])
+        for row, vector in self.patched.items():
+            matrix[row] = vector
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    def updated(self, rows, vectors):
+        patched, tail = dict(self.patched), self.tail.copy()
+        for row, vector in zip(np.asarray(rows).reshape(-1), vectors):
+            if row < len(self.base):
+                patched[int(row)] = vector.copy()
+            else:
+                tail[row - len(self.base)] = vector
+        return ExactRows(self.base, patched, tail)
+
+    def appended(self, vectors):
+        return ExactRows(self.base, self.patched, np.concatenate([self.tail, vectors]))
+
+
+class QuantizedEmbeddingStore:
+    """
+    Compact, immutable embedding matrix for nearest-neighbour search.
+
+    Vectors are kept as int8 (per-vector scale) or float16 codes and scored
+    with chunked vectorized dot products. With ``rescore`` the float32
+    vectors are kept as well (in memory, or in a memory-mapped file derived
+    from ``rescore_path`` so only the touched rows are paged in) and the top
+    ``limit * rescore_factor`` candidates are re-scored exactly. The file is
+    per process (``process_path``); edits go to an in-memory overlay until
+    ``overlay_rows`` rows have changed. Updates return a new store so
+    readers of the old one are never disturbed. Scoring casts ``chunk_rows``
+    codes at a time to float32, so its temporary memory stays at
+    ``chunk_rows * dim * 4`` bytes (8 MB by default) whatever the gallery size.
+    """
+
+    def __init__(self, vectors, dtype="int8", rescore=False, rescore_path=None, dim=512,
+                 rescore_factor=4, chunk_rows=4096, overlay_rows=1024):
+        self.dtype = dtype
+        self.dim = dim
+        self.rescore = rescore and dtype != "float32"
+        self.rescore_path = process_path(rescore_path) if rescore_path and self.rescore else rescore_path
+        self.rescore_factor = rescore_factor
+        self.chunk_rows = chunk_rows
+        self.overlay_rows = overlay_rows
+
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, dim)
+        self.codes, self.scales = quantize(vectors, dtype)
+        self.exact = self._store_exact(vectors) if self.rescore else None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _store_exact(self, vectors):
+        if not self.rescore_path:
+            return np.array(vectors, dtype=np.float32)
+        # Ghi file mới rồi thay thế: memmap của store cũ vẫn trỏ vào inode cũ
+        tmp_path = self.rescore_path + ".tmp"
+        mapped = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=vectors.shape)
+        mapped[:] = vectors
+        mapped.flush()
+        del mapped
+        os.replace(tmp_path, self.rescore_path)
+        return ExactRows(np.load(self.rescore_path, mmap_mode="r"))
+
+    def _derive(self, codes, scales, exact):
+        store = object.__new__(QuantizedEmbeddingStore)
+        store.__dict__.update(self.__dict__)
+        store.codes, store.scales = codes, scales
+        if not self.rescore:
+            store.exact = None
+        elif isinstance(exact, ExactRows) and exact.overlay_rows < self.overlay_rows:
+            store.exact = exact
+        else:
+            store.exact = self._store_exact(np.asarray(exact))
+        return store
+
+    def _exact_rows(self):
+        return np.asarray(self.exact) if self.rescore else None
+
+    def dequantize(self, rows=slice(None)):
+        vectors = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows, None]
+        return vectors
+
+    def updated(self, rows, vectors):
+        """New store with the given rows replaced"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        new_codes, new_scales = quantize(vectors, self.dtype)
+        codes = self.codes.copy()
+        codes[rows] = new_codes
+        scales = None
+        if self.scales is not None:
+            scales = self.scales.copy()
+            scales[rows] = new_scales
+        exact = None
+        if isinstance(self.exact, ExactRows):
+            exact = self.exact.updated(rows, vectors)
+        elif self.rescore:
+            exact = self._exact_rows().copy()
+            exact[rows] = vectors
+        return self._derive(codes, scales, exact)
+
+    def appended(self, vectors):
+        """New store with vectors added at the end"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        new_codes, new_scales = quantize(vectors, self.dtype)
+        codes = np.concatenate([self.codes, new_codes])
+        scales = np.concatenate([self.scales, new_scales]) if self.scales is not None else None
+        exact = None
+        if isinstance(self.exact, ExactRows):
+            exact = self.exact.appended(vectors)
+        elif self.rescore:
+            exact = np.concatenate([self._exact_rows(), vectors])
+        return self._derive(codes, scales, exact)
+
+    def subset(self, keep):
+        """New store with only the rows selected by a boolean mask or index array"""
+        scales = self.scales[keep] if self.scales is not None else None
+        exact = self._exact_rows()[keep] if self.rescore else None
+        return self._derive(self.codes[keep], scales, exact)
+
+    def scores(self, queries):
+        """Approximate scores (Q,N) of L2-normalized queries (Q,d) against every stored vector"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if self.dtype == "float32":
+            return queries @ self.codes.T
+
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), self.chunk_rows):
+            end = start + self.chunk_rows
+            scores[:, start:end] = queries @ self.codes[start:end].astype(np.float32).T
+            if self.scales is not None:
+                scores[:, start:end] *= self.scales[start:end]
+        return scores
+
+    @staticmethod
+    def _top_k(scores, k):
+        if k >= scores.shape[1]:
+            top = np.argsort(-scores, axis=1)
+        else:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        return top[:, :k], np.take_along_axis(scores, top[:, :k], axis=1)
+
+    def search_batch(self, queries, limit=1):
+        """
+        Nearest stored vectors for each query
+
+        Returns:
+            (rows, scores), each (Q,limit); scores are exact when rescoring is enabled
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        limit = min(limit, len(self.codes))
+        if limit == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+
+        scores = self.scores(queries)
+        if not self.rescore:
+            return self._top_k(scores, limit)
+
+        candidates, _ = self._top_k(scores, min(limit * self.rescore_factor, len(self.codes)))
+        exact = np.einsum("qkd,qd->qk", self.exact[candidates.ravel()].reshape(*candidates.shape, self.dim), queries)
+        order, exact_scores = self._top_k(exact, limit)
+        return np.take_along_axis(candidates, order, axis=1), exact_scores
+
+    def search(self, query, limit=1):
+        rows, scores = self.search_batch(query, limit)
+        return rows[0], scores[0]
+
+    def memory_report(self):
+        """
+        Bytes used by the search copy compared to a plain float32 matrix
+
+        ``peak_scoring_bytes`` is the temporary float32 chunk allocated per
+        query batch on top of ``resident_bytes``.
+        """
+        float32_bytes = len(self.codes) * self.dim * 4
+        quantized_bytes = self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        resident_exact = 0
+        if isinstance(self.exact, ExactRows):
+            resident_exact = self.exact.resident_bytes
+        elif self.rescore:
+            resident_exact = self.exact.nbytes
+        used = quantized_bytes + resident_exact
+        return {
+            "count": len(self.codes),
+            "dtype": self.dtype,
+            "rescore": ("memmap" if self.rescore_path else "memory") if self.rescore else None,
+            "float32_bytes": float32_bytes,
+            "quantized_bytes": quantized_bytes,
+            "resident_bytes": used,
+            "saved_bytes": float32_bytes - used,
+            "compression": round(float32_bytes / used, 2) if used else None,
+            "peak_scoring_bytes": 0 if self.dtype == "float32" else min(self.chunk_rows, len(self.codes)) * self.dim * 4,
+        }
+
+    def recall(self, reference, queries, k=10):
+        """
+        Recall@k of this store's search against exact float32 search
+
+        Args:
+            reference: Exact float32 vectors (N,d) in the same row order
+            queries: L2-normalized queries (Q,d)
+
+        Returns:
+            Mean fraction of the exact top-k rows that this store also returns
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        k = min(k, len(self.codes))
+        if k == 0 or len(queries) == 0:
+            return 1.0
+        expected, _ = self._top_k(queries @ np.asarray(reference, dtype=np.float32).T, k)
+        found, _ = self.search_batch(queries, k)
+        hits = sum(len(np.intersect1d(e, f)) for e, f in zip(expected, found))
+        return hits / (k * len(queries))
@@ -2,15 +2,24 @@
 
 import warnings
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Query
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse, StreamingResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.exceptions import RequestValidationError
+from starlette.concurrency import run_in_threadpool
 from starlette.exceptions import HTTPException as StarletteHTTPException
+import asyncio
+import json
 import os
+import time
+from typing import List, Optional
 
+from batch_enrollment import build_items, parse_manifest, read_zip_archive
 from face_recognition_service import face_service
+from metrics import REGISTRY, REQUEST_LATENCY
+from model_executor import model_executor
+from thumbnails import THUMB_SIZES, thumbnail_path
 
 # Suppress FutureWarning from InsightFace before importing
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -41,6 +50,27 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
+REGISTRY.gauge("model_executor_queue_depth", "Model jobs waiting for a free worker",
+               lambda: model_executor.queue_depth)
+REGISTRY.gauge("model_executor_in_flight", "Model jobs running or waiting", lambda: model_executor.in_flight)
+REGISTRY.gauge("embedding_cache_hit_rate", "Embedding cache hit rate since start",
+               lambda: face_service.embedding_cache.stats()["hit_rate"])
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Dùng template của route (/faces/{face_id}) để số label không tăng theo id
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(time.perf_counter() - started, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=status)
+
 
 # Exception handlers
 @app.exception_handler(StarletteHTTPException)
@@ -128,7 +158,7 @@ async def add_face(
 
     try:
         image_bytes = await file.read()
-        result = face_service.add_face(image_bytes, person_name, code_card)
+        result = await model_executor.run(face_service.add_face, image_bytes, person_name, code_card)
         return JSONResponse(content=result)
 
     except HTTPException as e:
@@ -138,18 +168,61 @@ async def add_face(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.post("/add_faces_batch")
+async def add_faces_batch(
+        archive: UploadFile = File(None),
+        files: List[UploadFile] = File(None),
+        manifest: UploadFile = File(None)
+):
+    """Add many faces from a zip archive or a list of images plus a CSV/JSON manifest"""
+    try:
+        manifest_rows = None
+        if manifest is not None and manifest.filename:
+            manifest_rows = parse_manifest(await manifest.read(), manifest.filename)
+
+        images = {}
+        if archive is not None and archive.filename:
+            images, archive_manifest = await run_in_threadpool(read_zip_archive, await archive.read())
+            manifest_rows = manifest_rows or archive_manifest
+        for file in files or []:
+            if file.filename:
+                images[os.path.basename(file.filename)] = await file.read()
+
+        if not images:
+            raise HTTPException(status_code=400, detail="No images provided")
+
+        items = build_items(images, manifest_rows)
+        results = await model_executor.run(face_service.add_faces_batch, items)
+        return JSONResponse(content={
+            "total": len(results),
+            "succeeded": sum(1 for result in results if result["success"]),
+            "results": results
+        })
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Unexpected error in add_faces_batch: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @app.post("/search_face")
 async def search_face(
         file: UploadFile = File(...),
-        limit: int = 5
+        limit: int = 5,
+        multi_face: bool = False,
+        max_faces: Optional[int] = Query(None, ge=1)
 ):
-    """Search for similar faces"""
+    """Search for similar faces (multi_face=true: every face of the photo, one result list per face)"""
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
 
     try:
         image_bytes = await file.read()
-        results = face_service.search_face(image_bytes, limit)
+        if multi_face:
+            faces = await model_executor.run(face_service.search_faces, image_bytes, limit, max_faces)
+            return JSONResponse(content={"faces": faces})
+        results = await model_executor.run(face_service.search_face, image_bytes, limit)
         return JSONResponse(content={"results": results})
 
     except HTTPException as e:
@@ -160,11 +233,16 @@ async def search_face(
 
 
 @app.get("/faces")
-async def get_all_faces():
-    """Get all stored faces"""
+async def get_all_faces(
+        cursor: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        person_name: Optional[str] = None,
+        code_card: Optional[str] = None
+):
+    """Get stored faces one page at a time (pass next_cursor back as cursor)"""
     try:
-        faces = face_service.get_all_faces()
-        return JSONResponse(content={"faces": faces})
+        page = await face_service.aget_faces_page(cursor, limit, person_name, code_card)
+        return JSONResponse(content=page)
 
     except HTTPException as e:
         raise e
@@ -173,11 +251,21 @@ async def get_all_faces():
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/faces/stream")
+async def stream_faces(person_name: Optional[str] = None, code_card: Optional[str] = None):
+    """Stream every stored face as NDJSON (one JSON object per line, constant memory)"""
+    async def generate():
+        async for face in face_service.aiter_faces(person_name, code_card):
+            yield json.dumps(face, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @app.delete("/faces/{face_id}")
 async def delete_face(face_id: str):
     """Delete a face from database"""
     try:
-        result = face_service.delete_face(face_id)
+        result = await face_service.adelete_face(face_id)
         return JSONResponse(content=result)
 
     except HTTPException as e:
@@ -208,7 +296,7 @@ async def edit_face(
         if person_name is None and code_card is None and image_bytes is None:
             raise HTTPException(status_code=400, detail="At least one field must be provided for update")
         
-        result = face_service.edit_face(face_id, person_name, code_card, image_bytes)
+        result = await model_executor.run(face_service.edit_face, face_id, person_name, code_card, image_bytes)
         return JSONResponse(content=result)
         
     except HTTPException as e:
@@ -240,7 +328,7 @@ async def edit_face_post(
         if person_name is None and code_card is None and image_bytes is None:
             raise HTTPException(status_code=400, detail="At least one field must be provided for update")
         
-        result = face_service.edit_face(face_id, person_name, code_card, image_bytes)
+        result = await model_executor.run(face_service.edit_face, face_id, person_name, code_card, image_bytes)
         return JSONResponse(content=result)
         
     except HTTPException as e:
@@ -260,7 +348,7 @@ async def delete_face_post(request: Request):
         if not face_id:
             raise HTTPException(status_code=400, detail="face_id is required")
         
-        result = face_service.delete_face(face_id)
+        result = await face_service.adelete_face(face_id)
         return JSONResponse(content=result)
 
     except HTTPException as e:
@@ -270,11 +358,48 @@ async def delete_face_post(request: Request):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/thumbs/{size}/{face_id}")
+async def get_thumbnail(size: int, face_id: str, request: Request):
+    """Serve a face thumbnail with long-lived cache headers and an ETag"""
+    if size not in THUMB_SIZES:
+        raise HTTPException(status_code=404, detail="Unknown thumbnail size")
+
+    path = thumbnail_path(face_service.script_dir, size, face_id)
+    if not os.path.exists(path):
+        try:
+            path = await run_in_threadpool(face_service.ensure_thumbnail, face_id, size)
+        except Exception as e:
+            logger.error(f"Error building thumbnail: {e}")
+            path = None
+        if path is None:
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    # URL đã kèm ?v=updated_ts nên có thể cache lâu dài
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=REGISTRY.render(), media_type=REGISTRY.CONTENT_TYPE)
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """Embedding cache size and hit rate"""
+    return JSONResponse(content=face_service.embedding_cache.stats())
+
+
 @app.get("/collection_info")
 async def get_collection_info():
     """Get collection information"""
     try:
-        info = face_service.qdrant_client.get_collection(face_service.collection_name)
+        info = await face_service.aget_collection_info()
         return JSONResponse(content={
             "collection_name": face_service.collection_name,
             "vectors_count": info.vectors_count if hasattr(info, 'vectors_count') else 0,
@@ -295,24 +420,11 @@ async def get_face_detail(face_id: str):
     """Get detailed information about a specific face"""
     try:
         # Get face from Qdrant
-        points = face_service.qdrant_client.retrieve(
-            collection_name=face_service.collection_name,
-            ids=[face_id]
-        )
+        face_data = await face_service.aget_face(face_id)
         
-        if not points:
+        if face_data is None:
             raise HTTPException(status_code=404, detail="Face not found")
         
-        point = points[0]
-        face_data = {
-            "id": point.payload["face_id"],
-            "person_name": point.payload["person_name"],
-            "image_path": point.payload.get("image_url", "").replace("images/", ""),
-            "code_card": point.payload.get("code_card"),
-            "created_at": point.payload.get("created_at"),
-            "updated_at": point.payload.get("updated_at")
-        }
-        
         return JSONResponse(content={"success": True, "face": face_data})
         
     except HTTPException as e:
@@ -322,6 +434,12 @@ async def get_face_detail(face_id: str):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.on_event("startup")
+async def start_thumbnail_backfill():
+    """Create thumbnails for faces enrolled before thumbnails existed, in the background"""
+    asyncio.get_running_loop().run_in_executor(None, face_service.backfill_thumbnails)
+
+
 def run_background_tasks():
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8865)
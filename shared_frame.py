@@ -0,0 +1,188 @@
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# Bố cục header (256 byte): mỗi ô 8 byte, đọc dưới dạng uint64 hoặc float64
+HEADER_SLOTS = 32
+HEADER_SIZE = HEADER_SLOTS * 8
+MAGIC = 0x4652414D45524E47  # "FRAMERNG"
+LAYOUT_VERSION = 1
+MAX_BUFFERS = 8
+
+# uint64
+_MAGIC, _VERSION, _SEQ, _LATEST, _WIDTH, _HEIGHT, _CHANNELS, _NUM_BUFFERS = range(8)
+# float64
+_TIMESTAMP, _CAPTURE_TIMESTAMP = 8, 9
+# Pipeline stats (float64), ô 10..15
+STATS_FIELDS = ("fps", "latency_ms", "frames_dropped", "frames_processed", "frames_skipped", "threads")
+_STATS_OFFSET = 10
+# Sequence riêng của từng buffer (seqlock), ô 16..23
+_SLOT_SEQ_OFFSET = 16
+
+
+class _SharedFrameBase:
+    def _map(self):
+        buf = self.shm.buf
+        self._u64 = np.ndarray((HEADER_SLOTS,), dtype=np.uint64, buffer=buf)
+        self._f64 = np.ndarray((HEADER_SLOTS,), dtype=np.float64, buffer=buf)
+
+    def _map_buffers(self):
+        self.frames = np.ndarray(
+            (self.num_buffers, self.height, self.width, self.channels),
+            dtype=np.uint8,
+            buffer=self.shm.buf,
+            offset=HEADER_SIZE
+        )
+
+    @property
+    def sequence(self):
+        """Number of frames published so far"""
+        return int(self._u64[_SEQ])
+
+    @property
+    def last_update(self):
+        """Wall-clock time of the latest published frame (0 if none)"""
+        return float(self._f64[_TIMESTAMP])
+
+    @property
+    def capture_timestamp(self):
+        return float(self._f64[_CAPTURE_TIMESTAMP])
+
+    def stats(self):
+        return {name: float(self._f64[_STATS_OFFSET + i]) for i, name in enumerate(STATS_FIELDS)}
+
+
+class SharedFrameWriter(_SharedFrameBase):
+    """
+    Producer side of the preview channel between a camera process and the viewer.
+
+    Frames go into a ring of ``num_buffers`` slots after a small header that
+    holds a global sequence counter, timestamps, dimensions and pipeline
+    stats. Every slot is written seqlock-style (its own counter is odd while
+    the copy is in progress) so readers can detect torn frames.
+    """
+
+    def __init__(self, name, width=640, height=480, channels=3, num_buffers=3):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.num_buffers = min(num_buffers, MAX_BUFFERS)
+        size = HEADER_SIZE + self.num_buffers * width * height * channels
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Segment cũ từ lần chạy trước: tạo lại với bố cục mới
+            stale = shared_memory.SharedMemory(name=name, create=False)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self._map()
+        self._u64[:] = 0
+        self._u64[_MAGIC] = MAGIC
+        self._u64[_VERSION] = LAYOUT_VERSION
+        self._u64[_WIDTH] = width
+        self._u64[_HEIGHT] = height
+        self._u64[_CHANNELS] = channels
+        self._u64[_NUM_BUFFERS] = self.num_buffers
+        self._map_buffers()
+
+    def write(self, frame, capture_timestamp=None, **stats):
+        """Publish a frame (resized to the channel size) and optional pipeline stats"""
+        index = (int(self._u64[_LATEST]) + 1) % self.num_buffers if self.sequence > 0 else 0
+        slot_seq = _SLOT_SEQ_OFFSET + index
+
+        self._u64[slot_seq] += 1  # lẻ: đang ghi
+        if frame.shape[:2] == (self.height, self.width):
+            np.copyto(self.frames[index], frame)
+        else:
+            cv2.resize(frame, (self.width, self.height), dst=self.frames[index])
+        self._u64[slot_seq] += 1  # chẵn: ghi xong
+
+        now = time.time()
+        self._f64[_TIMESTAMP] = now
+        self._f64[_CAPTURE_TIMESTAMP] = capture_timestamp if capture_timestamp is not None else now
+        self.update_stats(**stats)
+        self._u64[_LATEST] = index
+        self._u64[_SEQ] += 1
+
+    def update_stats(self, **stats):
+        for i, name in enumerate(STATS_FIELDS):
+            if name in stats and stats[name] is not None:
+                self._f64[_STATS_OFFSET + i] = stats[name]
+
+    def close(self, unlink=True):
+        self._u64 = self._f64 = self.frames = None
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedFrameReader(_SharedFrameBase):
+    """
+    Consumer side of the preview channel.
+
+    ``sequence`` and ``last_update`` are O(1) header reads, so the viewer
+    only copies a frame when the sequence has advanced.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.shm = shared_memory.SharedMemory(name=name, create=False)
+        self._map()
+        if int(self._u64[_MAGIC]) != MAGIC:
+            self.close()
+            raise ValueError(f"Shared memory {name} is not a frame channel")
+
+        self.width = int(self._u64[_WIDTH])
+        self.height = int(self._u64[_HEIGHT])
+        self.channels = int(self._u64[_CHANNELS])
+        self.num_buffers = int(self._u64[_NUM_BUFFERS])
+        self._map_buffers()
+
+    def read(self, retries=3):
+        """
+        Copy the latest complete frame
+
+        Returns:
+            (frame, sequence) or None if no frame is available / every attempt was torn
+        """
+        for _ in range(retries):
+            sequence = self.sequence
+            if sequence == 0:
+                return None
+            index = int(self._u64[_LATEST])
+            slot_seq = _SLOT_SEQ_OFFSET + index
+
+            before = int(self._u64[slot_seq])
+            if before % 2 == 1:
+                continue
+            frame = self.frames[index].copy()
+            if int(self._u64[slot_seq]) == before:
+                return frame, sequence
+        return None
+
+    def close(self):
+        self._u64 = self._f64 = self.frames = None
+        self.shm.close()
+
+
+def unlink_frame_channel(name):
+    """Remove a frame channel left behind by a worker that was killed, so the next reader attaches to the new one"""
+    try:
+        stale = shared_memory.SharedMemory(name=name, create=False)
+    except FileNotFoundError:
+        return False
+    stale.close()
+    try:
+        stale.unlink()
+    except FileNotFoundError:
+        pass
+    return True
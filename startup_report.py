@@ -0,0 +1,50 @@
+import os
+import time
+
+
+def process_age():
+    """
+    Seconds since this process was created (interpreter start and imports included)
+
+    Read from /proc on Linux; 0.0 where that is not available.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Trường 22 (starttime, clock ticks sau khi boot); tên process có thể chứa dấu cách
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    """
+    Per-stage startup timing of a worker process.
+
+    The first stage ("spawn + imports") is the time from process creation to
+    the construction of the timer; every ``mark`` adds the time since the
+    previous one. ``report`` prints one line and returns the stages in ms.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = [("spawn + imports", process_age())]
+        self._last = time.perf_counter()
+        self.reported = False
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+
+    def total(self):
+        return sum(seconds for _, seconds in self.stages)
+
+    def report(self):
+        self.reported = True
+        stages = {stage: round(seconds * 1000, 1) for stage, seconds in self.stages}
+        detail = " | ".join(f"{stage} {ms:.0f} ms" for stage, ms in stages.items())
+        print(f"[{self.name}] Startup {self.total() * 1000:.0f} ms: {detail}")
+        return stages
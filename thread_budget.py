@@ -0,0 +1,164 @@
+import contextlib
+import glob
+import os
+import re
+
+from check_platform import PlatformEnum
+
+# Biến môi trường mang budget từ launcher sang process con (đặt trước khi spawn)
+BUDGET_ENV = "FACE_THREAD_BUDGET"
+AFFINITY_ENV = "FACE_CPU_AFFINITY"
+# Thread pool của BLAS / OpenMP được tạo lúc import numpy, torch, ... nên phải có sẵn trong môi trường
+POOL_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+class ThreadBudget:
+    """
+    Thread count and CPU set of one worker process.
+
+    ``spawn_environment`` exports the budget while the child is started, so
+    BLAS/OpenMP and onnx_session read it at import time; ``apply_in_child``
+    then pins the process and sizes OpenCV's pool.
+    """
+
+    def __init__(self, threads, cpus):
+        self.threads = threads
+        self.cpus = sorted(cpus)
+
+    def __repr__(self):
+        return f"ThreadBudget(threads={self.threads}, cpus={self.cpus})"
+
+    def __eq__(self, other):
+        return isinstance(other, ThreadBudget) and (self.threads, self.cpus) == (other.threads, other.cpus)
+
+    def environment(self):
+        env = {name: str(self.threads) for name in POOL_ENV}
+        env.update({
+            BUDGET_ENV: str(self.threads),
+            AFFINITY_ENV: ",".join(str(cpu) for cpu in self.cpus),
+            # ONNX Runtime (onnx_session): một inter-op thread, intra-op theo budget
+            "FACE_ORT_INTRA_THREADS": str(self.threads),
+            "FACE_ORT_INTER_THREADS": "1",
+        })
+        return env
+
+    @contextlib.contextmanager
+    def spawn_environment(self):
+        """Export the budget to os.environ while a child process is started, then restore it"""
+        env = self.environment()
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def big_cores(cpus):
+    """
+    CPUs with the highest maximum frequency (the Cortex-A76 cluster on RK3588)
+
+    Returns [] when cpufreq is unavailable or all cores are the same.
+    """
+    max_freq = {}
+    for path in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq/cpuinfo_max_freq"):
+        cpu = int(re.search(r"cpu(\d+)/cpufreq", path).group(1))
+        try:
+            with open(path) as f:
+                max_freq[cpu] = int(f.read())
+        except (OSError, ValueError):
+            continue
+    freqs = {max_freq[cpu] for cpu in cpus if cpu in max_freq}
+    if len(freqs) < 2:
+        return []
+    top = max(freqs)
+    return [cpu for cpu in cpus if max_freq.get(cpu) == top]
+
+
+def worker_cpus(platform):
+    """CPUs the workers may use: the big cores on RK3588 boards, otherwise all available CPUs"""
+    cpus = available_cpus()
+    if platform in (PlatformEnum.ORANGE_PI, PlatformEnum.ORANGE_PI_MAX):
+        return big_cores(cpus) or cpus
+    return cpus
+
+
+def allocate(weights, platform=None, cpus=None):
+    """
+    Split the worker CPUs between processes
+
+    Args:
+        weights: {worker name: weight}; weight 0 marks a light worker (no
+                 model of its own) that gets one thread on the shared CPU set
+        platform: PlatformEnum, selects the big cores on RK3588
+        cpus: CPU ids to split (default: worker_cpus(platform))
+
+    Returns:
+        {worker name: ThreadBudget}. Model workers get disjoint CPU sets
+        proportional to their weight (at least one CPU each); when there are
+        more model workers than CPUs they share all CPUs with one thread each.
+    """
+    pool = list(cpus) if cpus is not None else worker_cpus(platform)
+    heavy = {name: weight for name, weight in weights.items() if weight > 0}
+    budgets = {name: ThreadBudget(1, pool) for name in weights if name not in heavy}
+    if not heavy:
+        return budgets
+    if len(heavy) > len(pool):
+        budgets.update({name: ThreadBudget(1, pool) for name in heavy})
+        return budgets
+
+    # Chia theo tỉ lệ trọng số, mỗi worker ít nhất 1 CPU, phần dư cho worker thiếu nhiều nhất
+    total = sum(heavy.values())
+    shares = {name: max(1, len(pool) * weight // total) for name, weight in heavy.items()}
+    while sum(shares.values()) > len(pool):
+        largest = max(shares, key=lambda name: shares[name])
+        shares[largest] -= 1
+    while sum(shares.values()) < len(pool):
+        neediest = max(heavy, key=lambda name: heavy[name] / shares[name])
+        shares[neediest] += 1
+
+    start = 0
+    for name in heavy:
+        budgets[name] = ThreadBudget(shares[name], pool[start:start + shares[name]])
+        start += shares[name]
+    return budgets
+
+
+def apply_in_child():
+    """
+    Apply the budget exported by the launcher to this process
+
+    Pins the process (threads created afterwards inherit the CPU set) and
+    sizes OpenCV's thread pool. No-op when no budget was exported.
+
+    Returns:
+        ThreadBudget or None
+    """
+    threads = os.environ.get(BUDGET_ENV)
+    if not threads:
+        return None
+    cpus = [int(cpu) for cpu in os.environ.get(AFFINITY_ENV, "").split(",") if cpu]
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            print(f"Could not pin process {os.getpid()} to CPUs {cpus}: {e}")
+
+    import cv2
+    cv2.setNumThreads(int(threads))
+    return ThreadBudget(int(threads), cpus)
+
+
+def current_threads():
+    """Thread budget of this process (0 when none was set), published in the worker stats"""
+    return int(os.environ.get(BUDGET_ENV, "0"))
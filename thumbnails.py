@@ -0,0 +1,91 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Kích thước thumbnail (cạnh ảnh vuông, px)
+THUMB_SIZES = (128, 256)
+THUMB_QUALITY = 80
+
+
+def thumbnail_path(script_dir, size, face_id):
+    return os.path.join(script_dir, "images", "thumbs", str(size), f"{face_id}.webp")
+
+
+def make_thumbnails(image, face_id, script_dir, sizes=THUMB_SIZES):
+    """
+    Write square center-cropped WebP thumbnails of an image
+
+    Args:
+        image: BGR image
+        face_id: Face id used as file name
+        script_dir: Project directory containing images/
+
+    Returns:
+        True if every size was written
+    """
+    if image is None or image.size == 0:
+        return False
+
+    height, width = image.shape[:2]
+    side = min(height, width)
+    top, left = (height - side) // 2, (width - side) // 2
+    square = image[top:top + side, left:left + side]
+
+    ok = True
+    for size in sizes:
+        path = thumbnail_path(script_dir, size, face_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        thumb = cv2.resize(square, (size, size), interpolation=cv2.INTER_AREA)
+        ok = cv2.imwrite(path, thumb, [cv2.IMWRITE_WEBP_QUALITY, THUMB_QUALITY]) and ok
+    return ok
+
+
+def delete_thumbnails(face_id, script_dir, sizes=THUMB_SIZES):
+    for size in sizes:
+        path = thumbnail_path(script_dir, size, face_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def make_thumbnails_from_file(image_url, face_id, script_dir):
+    """Build thumbnails for an already stored original image"""
+    image = cv2.imread(os.path.join(script_dir, image_url), cv2.IMREAD_REDUCED_COLOR_2)
+    if image is None or min(image.shape[:2]) < max(THUMB_SIZES):
+        image = cv2.imread(os.path.join(script_dir, image_url), cv2.IMREAD_COLOR)
+    return make_thumbnails(image, face_id, script_dir)
+
+
+def backfill_thumbnails(qdrant_client, collection_name, script_dir, max_workers=4, page_size=256):
+    """
+    Create missing thumbnails for every stored face
+
+    Returns:
+        Number of faces whose thumbnails were created
+    """
+    def missing(payload):
+        return payload.get("image_url") and not all(
+            os.path.exists(thumbnail_path(script_dir, size, payload["face_id"])) for size in THUMB_SIZES)
+
+    created = 0
+    offset = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            points, offset = qdrant_client.scroll(
+                collection_name=collection_name,
+                limit=page_size,
+                offset=offset,
+                with_payload=["face_id", "image_url"],
+                with_vectors=False
+            )
+            todo = [point.payload for point in points if missing(point.payload)]
+            created += sum(executor.map(
+                lambda payload: make_thumbnails_from_file(payload["image_url"], payload["face_id"], script_dir), todo))
+            if offset is None:
+                break
+
+    logger.info(f"Thumbnail backfill created thumbnails for {created} faces")
+    return created
@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+
+class DetectionZone:
+    """
+    Detection polygon of a vehicle camera, compiled once.
+
+    The polygon is validated (and repaired if self-intersecting) with
+    shapely a single time, then rasterized into a mask whose summed-area
+    table (cv2.integral) gives the number of zone pixels inside any box with
+    four lookups. ``overlap`` returns the zone fraction of every box in one
+    vectorized expression. An empty polygon means no zone: nothing overlaps.
+    """
+
+    def __init__(self, polygon, min_overlap=0.1):
+        self.polygon = self._validate(np.asarray(polygon, dtype=np.float64).reshape(-1, 2))
+        self.min_overlap = min_overlap
+        self._frame_size = None
+        self._table = None
+
+    @staticmethod
+    def _validate(points):
+        if len(points) == 0:
+            return None
+        if len(points) < 3:
+            raise ValueError(f"Detection polygon needs at least 3 points, got {len(points)}")
+        try:
+            from shapely.geometry import Polygon
+        except ImportError:
+            return points.astype(np.int32)
+
+        shape = Polygon(points)
+        if not shape.is_valid:
+            # Đa giác tự cắt: sửa một lần, giữ phần lớn nhất
+            shape = shape.buffer(0)
+            if shape.geom_type == "MultiPolygon":
+                shape = max(shape.geoms, key=lambda g: g.area)
+        if shape.is_empty:
+            raise ValueError("Detection polygon has no area")
+        return np.round(np.asarray(shape.exterior.coords)[:-1]).astype(np.int32)
+
+    def _compile(self, width, height):
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(mask, [self.polygon], 1)
+        self._table = cv2.integral(mask, sdepth=cv2.CV_32S)
+        self._frame_size = (width, height)
+
+    def overlap(self, boxes, frame_shape):
+        """
+        Fraction of each box covered by the zone
+
+        Args:
+            boxes: Boxes (N,4) xyxy in frame pixels
+            frame_shape: Frame shape (height, width, ...)
+
+        Returns:
+            Fractions (N,) in [0, 1]
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if self.polygon is None:
+            return np.zeros(len(boxes))
+        height, width = frame_shape[:2]
+        if self._frame_size != (width, height):
+            self._compile(width, height)
+
+        x1 = np.clip(np.floor(boxes[:, 0]), 0, width).astype(np.intp)
+        y1 = np.clip(np.floor(boxes[:, 1]), 0, height).astype(np.intp)
+        x2 = np.clip(np.ceil(boxes[:, 2]), 0, width).astype(np.intp)
+        y2 = np.clip(np.ceil(boxes[:, 3]), 0, height).astype(np.intp)
+
+        table = self._table
+        inside = table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]
+        area = (x2 - x1) * (y2 - y1)
+        return np.where(area > 0, inside / np.maximum(area, 1), 0.0)
+
+    def in_zone(self, boxes, frame_shape):
+        """
+        Returns:
+            (mask, fractions): boolean (N,) true where the box overlaps the
+            zone by at least min_overlap, and the overlap fractions (N,)
+        """
+        fractions = self.overlap(boxes, frame_shape)
+        return (fractions >= self.min_overlap) & (fractions > 0), fractions
+
+    def draw(self, frame, color=(255, 0, 0), thickness=2):
+        if self.polygon is None:
+            return
+        cv2.polylines(frame, [self.polygon], isClosed=True, color=color, thickness=thickness)